@@ -1,22 +1,37 @@
 # LangChain
 from langchain_core.tools import tool
-from langchain.graphs import Neo4jGraph
-from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages import AnyMessage, HumanMessage, ToolMessage
 
 # LangGraph
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.config import get_config
 
 # LangSmith
 from langsmith import traceable
 
 # General Imports
 import os
+import json
+import time
+import asyncio
 import operator
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import TypedDict, Annotated # to construct the agent's state
 from FastAPI_Sub_Folder.Helpers import prompts 
+from FastAPI_Sub_Folder.Helpers.cypher_fingerprint import fingerprint, signature
+from FastAPI_Sub_Folder.Helpers.query_cache import QueryResultCache, get_data_version, get_size
+from FastAPI_Sub_Folder.Helpers.graph_client import get_async_driver, get_schema, run_query
+from FastAPI_Sub_Folder.Helpers.query_guard import QueryGuard, QueryRejected, is_rejection, is_truncated
+from FastAPI_Sub_Folder.Helpers.llm_cache import CachedChatModel
+from FastAPI_Sub_Folder.Helpers.llm_scheduler import ScheduledChatModel, USER_PRIORITY, HELPER_PRIORITY
+from FastAPI_Sub_Folder.Helpers.metrics import MeteredChatModel, instrument_node, record_query
+from FastAPI_Sub_Folder.Helpers.session_store import BoundedMemorySaver
+from FastAPI_Sub_Folder.Helpers.output_store import GraphOutputStore
+from FastAPI_Sub_Folder.Helpers.local_extractor import extract_locally
+from FastAPI_Sub_Folder.Helpers.occupation_scoring import EXPORT_QUERY, ScorerLoader, to_rows
+from FastAPI_Sub_Folder.Helpers.result_compaction import MAX_ROWS, MAX_BYTES, compact_output
+from FastAPI_Sub_Folder.Helpers.prompt_budget import DEFAULT_BUDGETS, estimate_tokens, dedupe_cyphers, build_chat_prompt, build_conversation_text
 
 # Connect to graph
 dotenv_path = Path('../.env')
@@ -24,22 +39,68 @@ load_dotenv(dotenv_path=dotenv_path)
 os.environ["NEO4J_URI"] = os.getenv('NEO4J_URI')
 os.environ["NEO4J_USERNAME"] = os.getenv('NEO4J_USERNAME')
 os.environ["NEO4J_PASSWORD"] = os.getenv('NEO4J_PASSWORD')
-os.environ["LANGCHAIN_TRACING_V2"] = os.getenv('LANGCHAIN_TRACING_V2')
+os.environ["LANGCHAIN_TRACING_V2"] = os.getenv('LANGCHAIN_TRACING_V2', 'false') # LangSmith is optional, see metrics.py for the local traces
 success = load_dotenv()
 print(f"\n\n-------- {success}")
-graph = Neo4jGraph()
+
+# NOTE: the Neo4j driver is shared and created on first use (see graph_client.py)
+
+# Outputs of the queries, shared by every conversation of this process
+query_cache = QueryResultCache(version_getter=lambda: get_data_version(run_query))
+
+# The LLM's queries are checked with EXPLAIN, then run read-only with a timeout and a row ceiling (see query_guard.py)
+query_guard = QueryGuard(get_async_driver, timeout=float(os.getenv('QUERY_TIMEOUT_SECONDS', 10)), max_rows=int(os.getenv('QUERY_MAX_ROWS', 10000)),
+                         max_estimated_rows=int(os.getenv('QUERY_MAX_ESTIMATED_ROWS', 200000)))
+
+## Guarded query, timed for the metrics
+async def run_llm_query(query):
+    start_time = time.perf_counter()
+    try:
+        output = await query_guard.run(query)
+    except QueryRejected as e:
+        record_query(time.perf_counter() - start_time, e.reason)
+        raise
+    record_query(time.perf_counter() - start_time, "ok", rows=len(output), size=get_size(output))
+    return output
 
 # Create the tool to be used by the Agent
 @tool
-def query_graph(query):
+async def query_graph(query):
     """Query from Neo4j knowledge graph using Cypher."""
-    return graph.query(query)
+    try:
+        return await query_cache.aget_or_run(query, run_llm_query) # rejections are not cached
+    except QueryRejected as e:
+        return e.to_output()
+
+## Edges of the occupations, exported once for the occupation scorer
+async def load_occupation_edges():
+    return [(row['occupation'], row['label'], row['title'], row['relation']) for row in await run_query(EXPORT_QUERY)]
+
+# Occupation scorer, rebuilt when the ingestion pipeline writes a new graph data version
+scorer_loader = ScorerLoader(load_occupation_edges, version_getter=lambda: get_data_version(run_query))
+
+@tool
+async def recommend_occupations(profile: dict[str, float], k: int = 6):
+    """Score every occupation of the knowledge graph against the user's profile and return the k best ones, with the nodes that explain their score.
+    profile: {title of a Personality_Trait, skill, ability or knowledge node: how much it describes the user, from 0 to 1}. example: {"Realistic": 1, "Investigative": 0.5}"""
+    scorer = await scorer_loader.aget()
+    return to_rows(scorer.recommend(profile, k=k))
+
+## Session (LangGraph thread) of the node running
+def get_session_id():
+    return get_config()['configurable']['thread_id']
+
+## (compacted output for the LLM, compaction info, full output as JSON) of a query's output. CPU bound, run it in a thread
+def prepare_output(query_output, max_rows, max_bytes):
+    compacted_output, info = compact_output(query_output, max_rows=max_rows, max_bytes=max_bytes, read_truncated=is_truncated(query_output))
+    return compacted_output, info, json.dumps(query_output, default=str)
 
 # Create Agent's State
 class AgentState(TypedDict):
     conversation: Annotated[list[ AnyMessage ], operator.add]
-    good_cypher_and_outputs: Annotated[dict[ str, str ], operator.or_]
+    good_cypher_and_outputs: Annotated[dict[ str, str ], operator.or_] # compacted outputs, given to the LLM. The full outputs are in the output store
     bad_cypher: Annotated[list[ str ], operator.add]
+    query_errors: Annotated[dict[ str, str ], operator.or_] # why the query guard rejected a cypher code, given to the LLM so it can fix it
     extracted_data: Annotated[list[ str ], operator.add]
 
     graph_data_to_be_used: list[str]
@@ -47,15 +108,31 @@ class AgentState(TypedDict):
 # Create Agent
 class Agent:
 
-    def __init__(self, model, tools, system: str):
+    def __init__(self, model, tools, system: str, llm_fallback: bool = False, max_concurrent_tool_calls: int = 4, checkpointer=None, token_budgets=None,
+                 max_result_rows: int = MAX_ROWS, max_result_bytes: int = MAX_BYTES, local_extraction: bool = False, llm_cache=None,
+                 scheduler=None, output_store=None, helper_model=None):
+        """
+        checkpointer: session store of the conversations (see session_store.py), defaults to an in-memory BoundedMemorySaver
+        token_budgets: {node name: maximum tokens of its prompt}, defaults to prompt_budget.DEFAULT_BUDGETS
+        max_result_rows, max_result_bytes: size limits of a query's output given to the LLM (see result_compaction.py)
+        local_extraction: extract the data from the outputs without the LLM when possible (see local_extractor.py). Off by default, its recall is below the LLM's
+        output_store: GraphOutputStore of the full outputs of the queries, kept out of the state (see output_store.py), defaults to a new one
+        helper_model: chat model of the helper steps (cypher comparison, data extraction), defaults to model. Give it a temperature of 0,
+                      llm_cache only stores the answers of a model at temperature 0
+        llm_cache: LLMResponseCache used by the helper steps, not by the conversation (see llm_cache.py)
+        scheduler: LLMScheduler shared by every LLM call (see llm_scheduler.py). The conversation nodes go before the helper steps
+        llm_fallback: when a query's fingerprint is new, ask the LLM to compare it with the previous queries using the same labels and relationships
+        max_concurrent_tool_calls: maximum number of tool calls of one turn that are checked and run at the same time
+        """
 
         graph = StateGraph(AgentState)
-        memory = MemorySaver()
+        memory = checkpointer if checkpointer is not None else BoundedMemorySaver()
 
-        graph.add_node("personality_scientist", self.call_groq)
-        graph.add_node("validate_cypher_then_query_graph", self.validate_cypher_then_query_graph) # Checks if query is new
-        graph.add_node("extract_data", self.extract_data)
-        graph.add_node("recommend_careers", self.recommend_careers)
+        # Every node is timed (see metrics.py)
+        graph.add_node("personality_scientist", instrument_node("personality_scientist", self.call_groq))
+        graph.add_node("validate_cypher_then_query_graph", instrument_node("validate_cypher_then_query_graph", self.validate_cypher_then_query_graph)) # Checks if query is new
+        graph.add_node("extract_data", instrument_node("extract_data", self.extract_data))
+        graph.add_node("recommend_careers", instrument_node("recommend_careers", self.recommend_careers))
 
         graph.add_conditional_edges("personality_scientist", self.validate_tool_call, {True: 'validate_cypher_then_query_graph', False: END})
         graph.add_conditional_edges("recommend_careers", self.validate_tool_call, {True: 'validate_cypher_then_query_graph', False: END})
@@ -64,18 +141,49 @@ class Agent:
         graph.set_entry_point("personality_scientist")
 
         self.graph = graph.compile(checkpointer=memory)
+        self.checkpointer = memory
+        self.output_store = output_store if output_store is not None else GraphOutputStore()
         self.system = system
         self.tools = {t.name: t for t in tools} # Save the tools' names that can be used
-        self.model = model.bind_tools(tools)
+        self.model = MeteredChatModel(model.bind_tools(tools)) # counts the calls and tokens of every node
+        self.helper_model = MeteredChatModel((helper_model if helper_model is not None else model).bind_tools(tools))
+        if scheduler is not None:
+            self.helper_model = ScheduledChatModel(self.helper_model, scheduler, priority=HELPER_PRIORITY)
+            self.model = ScheduledChatModel(self.model, scheduler, priority=USER_PRIORITY)
+        if llm_cache is not None: self.helper_model = CachedChatModel(self.helper_model, llm_cache) # same prompt => same answer, a hit skips the scheduler
+        self.scheduler = scheduler
+        self.llm_fallback = llm_fallback
+        self.max_concurrent_tool_calls = max_concurrent_tool_calls
+        self.token_budgets = {**DEFAULT_BUDGETS, **(token_budgets or {})}
+        self.prompt_tokens = {} # node: {calls, tokens, tokens_without_budget}
+        self.max_result_rows = max_result_rows
+        self.max_result_bytes = max_result_bytes
+        self.local_extraction = local_extraction
+
+    ## Print and sum the estimated tokens of a node's prompt
+    def log_prompt(self, node, report):
+        totals = self.prompt_tokens.setdefault(node, {'calls': 0, 'tokens': 0, 'tokens_without_budget': 0})
+        totals['calls'] += 1
+        totals['tokens'] += report['tokens']
+        totals['tokens_without_budget'] += report['tokens_without_budget']
+        print(f"----- {node} prompt: ~{report['tokens']} tokens (~{report['tokens_without_budget']} without budget, "
+              f"{report['messages']} messages kept, {report['summarized_messages']} summarized)")
 
     ## Helper function that returns the cyphers written before. This is used when calling the LLM
     def get_previous_cyphers(self, state: AgentState):
         cyphers_list = ""
         
-        if len(state['bad_cypher']) > 0:
-            cyphers_list += f"- Here are previously written cypher codes that did not return an output: {str(state['bad_cypher'])}"
-
-        good_cypher = list(state['good_cypher_and_outputs'].keys())
+        # Only the most recent cypher codes, one per fingerprint. The calls to the other tools are not cypher codes
+        query_errors = state.get('query_errors', {})
+        bad_cypher = dedupe_cyphers([cypher for cypher in state['bad_cypher'] if not self.is_tool_key(cypher)])
+        rejected_cypher = {cypher: query_errors[cypher] for cypher in bad_cypher if cypher in query_errors}
+        bad_cypher = [cypher for cypher in bad_cypher if cypher not in query_errors]
+        if len(bad_cypher) > 0:
+            cyphers_list += f"- Here are previously written cypher codes that did not return an output: {str(bad_cypher)}"
+        if len(rejected_cypher) > 0:
+            cyphers_list += f"- Here are previously written cypher codes that were rejected before running, with what to fix: {str(rejected_cypher)}"
+
+        good_cypher = dedupe_cyphers([cypher for cypher in state['good_cypher_and_outputs'].keys() if not self.is_tool_key(cypher)])
         if len(good_cypher) > 0:
             cyphers_list += f"- Here are previously written cypher codes that successfully returned an output: {str(good_cypher)}"
         
@@ -87,7 +195,7 @@ class Agent:
     
     ## Get the LLM's response and update the Agent's State by adding the response to the messages
     @traceable
-    def call_groq(self, state: AgentState):
+    async def call_groq(self, state: AgentState):
 
         previous_cyphers = self.get_previous_cyphers(state = state)
         if previous_cyphers:
@@ -95,8 +203,9 @@ class Agent:
         else:
             system_message = self.system
 
-        conversation = [SystemMessage(content=system_message)] + state['conversation']
-        ai_response = self.model.invoke(conversation)
+        conversation, report = build_chat_prompt(system_message, state['conversation'], self.token_budgets['personality_scientist'])
+        self.log_prompt('personality_scientist', report)
+        ai_response = await self.model.ainvoke(conversation)
 
         return {'conversation': [ai_response]}
 
@@ -105,89 +214,147 @@ class Agent:
         ai_message = state['conversation'][-1]
         return len(ai_message.tool_calls) > 0
         
-    ## Check if the new cypher codes have already been written by the LLM
-    def validate_cypher_then_query_graph(self, state: AgentState):
+    ## Key of a tool call in the state: the cypher code of query_graph, or the call itself for the other tools
+    @staticmethod
+    def get_tool_call_key(tool_call):
+        if 'query' in tool_call['args']: return tool_call['args']['query']
+        return f"{tool_call['name']}({json.dumps(tool_call['args'], sort_keys=True)})"
+
+    ## True for the key of a call to another tool than query_graph (see get_tool_call_key), it is not a cypher code
+    def is_tool_key(self, key):
+        return any(key.startswith(f"{name}({{") for name in self.tools)
+
+    ## Check if one cypher code has already been written by the LLM, otherwise query the graph. Returns (status, cypher, output)
+    async def run_tool_call(self, tool_call, good_fingerprints, bad_fingerprints):
+        new_cypher = self.get_tool_call_key(tool_call)
+        new_fingerprint = fingerprint(new_cypher)
+
+        # Check if the cypher query has already been made, by comparing the fingerprints of the queries
+        if new_fingerprint in good_fingerprints:
+            print("\n----- Good Cyphers are similar, save the cypher")
+            return "good_cypher", good_fingerprints[new_fingerprint], None
+        if new_fingerprint in bad_fingerprints:
+            print("---- Bad Cyphers are similar, have the LLM query again")
+            return "bad_cypher", bad_fingerprints[new_fingerprint], None
+
+        # Optional: LLM checks the near-misses (previous queries with the same labels and relationships)
+        if self.llm_fallback and 'query' in tool_call['args']:
+            status, key = await self.compare_with_llm(new_cypher, good_fingerprints, bad_fingerprints)
+            if status != None: return status, key, None
+
+        # If the cypher code hasn't been used before => query the graph
+        print(f"----- Checker 3")
+        query_output = await self.tools[tool_call['name']].ainvoke(tool_call['args'])
+
+        if is_rejection(query_output):
+            print(f"----- Query rejected by the guard ({query_output['reason']})")
+            return "new_bad_cypher", new_cypher, query_output['message']
+        elif query_output not in ["", None, []]:
+            # The LLM gets a compact table of the output, the full output is kept for the Streamlit graph page.
+            # NOTE: in a thread, on a large output this takes seconds and every other session would wait for it
+            compacted_output, info, full_output = await asyncio.to_thread(prepare_output, query_output, self.max_result_rows, self.max_result_bytes)
+            result = ToolMessage(content=compacted_output, name=tool_call['name'], tool_call_id=tool_call['id'])
+            print(f"----- Successfully queried graph ({info['rows']} rows, {info['unique_rows']} unique, {info['shown_rows']} given to the LLM)")
+            return "new_good_cypher", new_cypher, (result.content, full_output)
+        elif 'query' not in tool_call['args']:
+            # Nothing matched (example: recommend_occupations with unknown titles), it is not a cypher code that failed
+            print(f"----- {tool_call['name']} returned nothing")
+            return "no_output", new_cypher, None
+        else:
+            print("----- Bad query")
+            return "new_bad_cypher", new_cypher, None
+
+    ## Check the new cypher codes and query the graph, running the tool calls concurrently
+    async def validate_cypher_then_query_graph(self, state: AgentState):
         print(f"\n------- in validate query")
         tool_calls = state['conversation'][-1].tool_calls
 
         good_cypher_and_outputs = {} # stores the cypher queries that returned an output
         bad_cypher = [] # stores the cypher queries that did not return an output
+        query_errors = {} # stores why the rejected ones were rejected
         graph_data_to_be_used = [] # stores the queries that the model currently wants to use
 
-        # Go over the cypher codes given by the LLM
-        for i in range(len(tool_calls)):
-            current_tool_call = tool_calls[i]
-            new_cypher = current_tool_call['args']['query']
-
-            status = None
-
-            # Check if tool exists
-            if current_tool_call['name'] in self.tools:
-                
-                # LLM checks if the cypher query has already been made + if it returned an output
-                if status == None:
-                    print(f"----- Checker 1")
-                    good_cyphers = list(state['good_cypher_and_outputs'].keys())
-                    for i in range(len( good_cyphers )):
-                        key = good_cyphers[i]
-                        comparison = self.model.invoke(
-                            prompts.cypher_code_analyst_prompt.format(cypher_code_1=new_cypher, cypher_code_2=key, graph_schema=graph.structured_schema)
-                            )
-                        print(f"\n-------- {comparison.content}")
-                        # If Query exists => Save cypher code to later access the output and give it to the model
-                        if comparison.content.lower() == "true":
-                            print("\n----- Good Cyphers are similar, save the cypher")
-                            graph_data_to_be_used.append(key)
-                            status = "good_cypher"
-                            break
-                
-                # LLM checks if the cypher query has already been made + if it didn't return an output
-                if status == None:
-                    print(f"----- Checker 2")
-                    for i in range(len(state['bad_cypher'])):
-                        comparison = self.model.invoke(
-                            prompts.cypher_code_analyst_prompt.format(
-                                cypher_code_1=new_cypher, cypher_code_2=state['bad_cypher'][i], graph_schema=graph.structured_schema)
-                            )
-                        # Query exists => LLM should fix the query
-                        if comparison.content.lower() == "true":
-                            print("---- Bad Cyphers are similar, have the LLM query again")
-                            status = "bad_cypher"
-                            break
-
-                # If the cypher code hasn't been used before => query the graph
-                if status == None:
-                    print(f"----- Checker 3")
-                    query_output = self.tools[current_tool_call['name']].invoke(new_cypher)
-                    result = ToolMessage(content=str(query_output), name=current_tool_call['name'], tool_call_id=current_tool_call['id'])
-                    
-                    if result.content not in ["", None, '[]']:
-                        good_cypher_and_outputs[new_cypher] = result.content
-                        graph_data_to_be_used.append(new_cypher)
-                        print("----- Successfully queried graph")
-
-                    else:
-                        bad_cypher.append(new_cypher)
-                        print("----- Bad query")
+        # {fingerprint: cypher} of the queries written before
+        good_fingerprints = {fingerprint(cypher): cypher for cypher in state['good_cypher_and_outputs'].keys()}
+        bad_fingerprints = {fingerprint(cypher): cypher for cypher in state['bad_cypher']}
+
+        # Check if tool exists. Tool calls with the same fingerprint in this turn are only run once
+        calls_to_run = {}
+        for tool_call in tool_calls:
+            if tool_call['name'] in self.tools:
+                calls_to_run.setdefault(fingerprint(self.get_tool_call_key(tool_call)), tool_call)
             else:
                 print("tool name not found in list of tools")
 
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrent_tool_calls))
+        async def run_with_limit(tool_call):
+            async with semaphore:
+                return await self.run_tool_call(tool_call, good_fingerprints, bad_fingerprints)
+
+        # asyncio.gather keeps the order of the tool calls
+        results = dict(zip(calls_to_run.keys(), await asyncio.gather(*[run_with_limit(tool_call) for tool_call in calls_to_run.values()])))
+
+        # Merge the results in the order of the tool calls
+        for status, cypher, output in results.values():
+            if status in ["good_cypher", "new_good_cypher"] and cypher not in graph_data_to_be_used:
+                graph_data_to_be_used.append(cypher)
+            if status == "new_good_cypher":
+                good_cypher_and_outputs[cypher], full_output = output
+                self.output_store.put(get_session_id(), cypher, full_output) # not in the state, it would be saved in every checkpoint
+            elif status == "new_bad_cypher":
+                bad_cypher.append(cypher)
+                if output is not None: query_errors[cypher] = output
+
         # Save the data that we got in the AgentState
         return_statement = {}
         if len(good_cypher_and_outputs) > 0: return_statement['good_cypher_and_outputs'] = good_cypher_and_outputs
         if len(bad_cypher) > 0: return_statement['bad_cypher'] = bad_cypher
+        if len(query_errors) > 0: return_statement['query_errors'] = query_errors
         if len(graph_data_to_be_used) > 0: return_statement['graph_data_to_be_used'] = graph_data_to_be_used
 
         return return_statement
     
+    ## LLM comparison of a new cypher code with the previous ones that use the same labels and relationships. Returns (status, cypher)
+    async def compare_with_llm(self, new_cypher, good_fingerprints, bad_fingerprints):
+        new_signature = signature(new_cypher)
+
+        for status, cyphers in [("good_cypher", good_fingerprints.values()), ("bad_cypher", bad_fingerprints.values())]:
+            for cypher in cyphers:
+                if self.is_tool_key(cypher) or signature(cypher) != new_signature: continue
+                comparison = await self.helper_model.ainvoke(
+                    prompts.cypher_code_analyst_prompt.format(cypher_code_1=new_cypher, cypher_code_2=cypher, graph_schema=get_schema())
+                    )
+                print(f"\n-------- {comparison.content}")
+                if comparison.content.lower() == "true":
+                    print(f"----- LLM found a similar cypher ({status})")
+                    return status, cypher
+
+        return None, None
+
     ## LLM extracts what it needs from the query's output
-    def extract_data(self, state: AgentState):
+    async def extract_data(self, state: AgentState):
         print('\n-------> In extract data')
 
         if len(state['graph_data_to_be_used']) > 0:
+
+            # Fast path: filter the outputs by the traits found in the conversation, without calling the LLM
+            if self.local_extraction:
+                graph_outputs = self.output_store.get_session(get_session_id(), state['graph_data_to_be_used'])
+                extracted_data = await asyncio.to_thread(extract_locally, [graph_outputs.get(cypher) for cypher in state['graph_data_to_be_used']], state['conversation'])
+                if extracted_data is not None:
+                    print("----- Data has been extracted locally")
+                    return {'extracted_data': [str(extracted_data)]}
+                print("----- Local extractor could not decide, asking the LLM")
+
             data_to_give_to_the_LLM = [{cypher: state['good_cypher_and_outputs'][cypher]} for cypher in state['graph_data_to_be_used']]
-            extracted_data = self.model.invoke(
-                prompts.extractor_prompt.format(queried_data = data_to_give_to_the_LLM, conversation = state['conversation'])
+
+            # The conversation gets what is left of the budget after the prompt and the data
+            prompt_tokens = estimate_tokens(prompts.extractor_prompt.format(queried_data = data_to_give_to_the_LLM, conversation = ""))
+            conversation, report = build_conversation_text(state['conversation'], max(0, self.token_budgets['extract_data'] - prompt_tokens))
+            self.log_prompt('extract_data', {**report, 'tokens': report['tokens'] + prompt_tokens, 'tokens_without_budget': report['tokens_without_budget'] + prompt_tokens})
+
+            extracted_data = await self.helper_model.ainvoke(
+                prompts.extractor_prompt.format(queried_data = data_to_give_to_the_LLM, conversation = conversation)
                 )
             print("----- Data has been extracted")
             return {'extracted_data': [extracted_data.content]}
@@ -197,7 +364,7 @@ class Agent:
             return
 
     ## Generate final output
-    def recommend_careers(self, state: AgentState):
+    async def recommend_careers(self, state: AgentState):
 
         # Give the LLM context of previously written cypher code
         previous_cyphers = self.get_previous_cyphers(state = state)
@@ -206,16 +373,17 @@ class Agent:
         else:
             system_message = self.system
         
-        conversation = [SystemMessage(content=system_message)] + state['conversation']
-
         # Give LLM a prompt based on the data received from the graph. (Data received can be empty or not)
         if len(state['graph_data_to_be_used']) > 0:
-            prompt = conversation + [HumanMessage(content= prompts.recommender_prompt_with_data.format(extracted_data=state['extracted_data'][-1]))]
+            instruction = HumanMessage(content= prompts.recommender_prompt_with_data.format(extracted_data=state['extracted_data'][-1]))
             print("----- Giving extracted data to the agent")
         else:
-            prompt = conversation + [HumanMessage(content= prompts.recommender_prompt_without_data)]
+            instruction = HumanMessage(content= prompts.recommender_prompt_without_data)
             print("----- No data to give to the agent")
+
+        prompt, report = build_chat_prompt(system_message, state['conversation'], self.token_budgets['recommend_careers'], final_message=instruction)
+        self.log_prompt('recommend_careers', report)
         
-        ai_response = self.model.invoke(prompt)
+        ai_response = await self.model.ainvoke(prompt)
         print("------- Ready to recommend")
         return {'conversation': [ai_response]}
\ No newline at end of file
@@ -0,0 +1,480 @@
+"""
+Deterministic canonical form and fingerprint of Cypher queries.
+
+Two queries written differently but returning the same output should get the same fingerprint, so that the agent can
+find duplicates with a dictionary lookup instead of asking the LLM to compare every pair of queries.
+
+What is normalized:
+    - white spaces, comments, keyword case and function name case, quotes of strings
+    - variable names (renamed by order of appearance), variables used only once become anonymous
+    - order of the MATCH patterns, of the labels of a node (:A:B, every label required), of the alternatives of a label (:A|B, one of them),
+      of the keys of a property map, of the WHERE conjuncts and of the RETURN items
+    - direction of a path written from right to left: (a)<-[:R]-(b) is the same as (b)-[:R]->(a), unless the path is returned (p = (a)<-[:R]-(b))
+    - the labels of a node variable are merged across its occurrences
+
+MATCH clauses are not merged: a relationship is only matched once inside one MATCH, so MATCH (a)-[r1]->(b) MATCH (a)-[r2]->(c)
+can return rows that MATCH (a)-[r1]->(b), (a)-[r2]->(c) does not.
+
+Queries using clauses other than MATCH, WHERE, RETURN, ORDER BY, SKIP and LIMIT only get the first two normalizations.
+"""
+
+import re
+import hashlib
+
+KEYWORDS = {
+    'MATCH', 'OPTIONAL', 'WHERE', 'RETURN', 'WITH', 'AS', 'AND', 'OR', 'XOR', 'NOT', 'DISTINCT', 'ORDER', 'BY', 'ASC', 'DESC',
+    'ASCENDING', 'DESCENDING', 'LIMIT', 'SKIP', 'UNWIND', 'CREATE', 'MERGE', 'DELETE', 'DETACH', 'SET', 'REMOVE', 'CALL', 'YIELD',
+    'UNION', 'ALL', 'IN', 'IS', 'NULL', 'TRUE', 'FALSE', 'CONTAINS', 'STARTS', 'ENDS', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END',
+    'ON', 'EXISTS', 'FOREACH', 'LOAD', 'CSV', 'FROM', 'HEADERS', 'USE', 'EXPLAIN', 'PROFILE',
+}
+SIMPLE_CLAUSES = {'MATCH', 'WHERE', 'RETURN', 'ORDER BY', 'SKIP', 'LIMIT'}
+CLAUSE_KEYWORDS = ['OPTIONAL MATCH', 'ORDER BY', 'DETACH DELETE', 'MATCH', 'WHERE', 'RETURN', 'WITH', 'SKIP', 'LIMIT', 'UNWIND',
+                   'CREATE', 'MERGE', 'DELETE', 'SET', 'REMOVE', 'CALL', 'YIELD', 'UNION', 'FOREACH', 'LOAD', 'USE']
+
+TOKEN_PATTERN = re.compile(r"""
+     (?P<space>\s+)
+    |(?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<backtick>`[^`]*`)
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<parameter>\$\w+)
+    |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<arrow><-|->)
+    |(?P<operator><>|<=|>=|=~|\.\.|[-+*/%=<>(){}\[\]:,.|^;!])
+""", re.VERBOSE | re.DOTALL)
+
+OPENING, CLOSING = "([{", ")]}"
+
+
+class CypherParseError(ValueError):
+    pass
+
+##
+
+def tokenize(query):
+    """ Returns a list of (kind, value). Keywords and function names are normalized, strings are re-quoted with single quotes. """
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = TOKEN_PATTERN.match(query, position)
+        if match is None:
+            raise CypherParseError(f"Unexpected character {query[position]!r} at {position}")
+        position = match.end()
+        kind, value = match.lastgroup, match.group()
+
+        if kind in ('space', 'comment'):
+            continue
+        if kind == 'string':
+            quote = value[0]
+            value = value[1:-1].replace(f"\\{quote}", quote)
+            value = "'" + value.replace("'", "\\'") + "'"
+        elif kind == 'backtick' and re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", value[1:-1]):
+            kind, value = 'name', value[1:-1]
+        tokens.append([kind, value])
+
+    # Keywords are case insensitive, except when used as a property key or a label
+    for i, (kind, value) in enumerate(tokens):
+        if kind != 'name':
+            continue
+        previous_value = tokens[i - 1][1] if i > 0 else None
+        next_value = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if previous_value in ('.', ':'):
+            continue
+        if next_value == '(' and value.upper() not in KEYWORDS:
+            tokens[i] = ['function', value.lower()]
+        elif value.upper() in KEYWORDS and next_value != ':':
+            tokens[i] = ['keyword', value.upper()]
+
+    return [tuple(token) for token in tokens]
+
+##
+
+def render(tokens):
+    """ Join tokens with a fixed spacing """
+    text = ""
+    for i, (kind, value) in enumerate(tokens):
+        previous_value = tokens[i - 1][1] if i > 0 else None
+        no_space = (i == 0 or value in (',', ')', ']', '}', '.', ':') or previous_value in ('(', '[', '{', '.', ':', '$')
+                    or (value in ('(',) and tokens[i - 1][0] == 'function'))
+        text += ("" if no_space else " ") + value
+    return text
+
+##
+
+def split_top_level(tokens, separator_values):
+    """ Split tokens on the separators that are not inside (), [] or {} """
+    parts, current, depth = [], [], 0
+    for token in tokens:
+        if token[1] in OPENING: depth += 1
+        elif token[1] in CLOSING: depth -= 1
+        if depth == 0 and token[1] in separator_values and token[0] != 'string':
+            parts.append(current)
+            current = []
+        else:
+            current.append(token)
+    parts.append(current)
+    return parts
+
+##
+
+def split_clauses(tokens):
+    """ Returns [(clause keyword, tokens)] for the top-level clauses of the query """
+    clauses, depth, i = [], 0, 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        if value in OPENING: depth += 1
+        elif value in CLOSING: depth -= 1
+
+        clause = None
+        if depth == 0 and kind == 'keyword':
+            for keyword in CLAUSE_KEYWORDS:
+                words = keyword.split()
+                if [token[1] for token in tokens[i:i + len(words)]] == words and all(token[0] == 'keyword' for token in tokens[i:i + len(words)]):
+                    clause = keyword
+                    break
+
+        if clause is not None:
+            clauses.append([clause, []])
+            i += len(clause.split())
+            continue
+        if len(clauses) == 0:
+            raise CypherParseError("The query does not start with a clause")
+        clauses[-1][1].append(tokens[i])
+        i += 1
+
+    return clauses
+
+##
+
+def parse_map(tokens):
+    """ {key: value, ...} -> sorted [(key, value tokens)] """
+    if len(tokens) < 2 or tokens[0][1] != '{' or tokens[-1][1] != '}':
+        raise CypherParseError("Invalid property map")
+    entries = []
+    for entry in split_top_level(tokens[1:-1], {','}):
+        if len(entry) == 0: continue
+        if len(entry) < 3 or entry[1][1] != ':':
+            raise CypherParseError("Invalid property map entry")
+        entries.append((entry[0][1], entry[2:]))
+    return sorted(entries, key=lambda entry: (entry[0], render(entry[1])))
+
+##
+
+def parse_element(tokens, kind):
+    """
+    Parse the inside of a node (...) or a relationship [...].
+    Returns {'variable', 'labels', 'length', 'properties'}
+    """
+    element = {'variable': None, 'labels': [], 'length': [], 'properties': []}
+    i = 0
+    if i < len(tokens) and tokens[i][0] == 'name':
+        element['variable'] = tokens[i][1]
+        i += 1
+
+    # Groups of alternatives: (n:A:B) -> [{A}, {B}] (every group is required), (n:A|B) and [r:A|B] -> [{A, B}] (one of the group)
+    groups = []
+    while i < len(tokens) and tokens[i][1] in (':', '|'):
+        if tokens[i][1] == '|' and i + 1 < len(tokens) and tokens[i + 1][1] == ':': i += 1 # old syntax [r:A|:B]
+        if i + 1 >= len(tokens) or tokens[i + 1][0] not in ('name', 'backtick', 'keyword'):
+            raise CypherParseError("Invalid label")
+        if tokens[i][1] == ':' and not (kind == 'relationship' and len(groups) > 0): groups.append(set())
+        if len(groups) == 0: raise CypherParseError("Invalid label")
+        groups[-1].add(tokens[i + 1][1])
+        i += 2
+    # Order does not matter, inside a group or between groups. A group is kept as 'A|B' so that :A|B and :A:B stay different
+    element['labels'] = sorted(set("|".join(sorted(group)) for group in groups))
+
+    if kind == 'relationship' and i < len(tokens) and tokens[i][1] == '*':
+        start = i
+        i += 1
+        while i < len(tokens) and tokens[i][1] != '{':
+            i += 1
+        element['length'] = tokens[start:i]
+
+    if i < len(tokens):
+        element['properties'] = parse_map(tokens[i:])
+
+    return element
+
+##
+
+def parse_path(tokens):
+    """
+    Parse one comma separated part of a MATCH clause: (a:Label)-[r:TYPE]->(b)...
+    Returns {'variable': path variable or None, 'nodes': [...], 'relationships': [...]} where relationships[i] links nodes[i] and nodes[i + 1]
+    """
+    path = {'variable': None, 'nodes': [], 'relationships': []}
+    if len(tokens) > 2 and tokens[0][0] == 'name' and tokens[1][1] == '=':
+        path['variable'] = tokens[0][1]
+        tokens = tokens[2:]
+
+    def read_group(i, opening, closing):
+        if i >= len(tokens) or tokens[i][1] != opening:
+            raise CypherParseError(f"Expected {opening}")
+        depth, start = 0, i
+        while i < len(tokens):
+            if tokens[i][1] in OPENING: depth += 1
+            elif tokens[i][1] in CLOSING: depth -= 1
+            i += 1
+            if depth == 0: break
+        if tokens[i - 1][1] != closing:
+            raise CypherParseError(f"Expected {closing}")
+        return tokens[start + 1:i - 1], i
+
+    inside, i = read_group(0, '(', ')')
+    path['nodes'].append(parse_element(inside, 'node'))
+
+    while i < len(tokens):
+        left = tokens[i][1]
+        if left not in ('-', '<-'):
+            raise CypherParseError("Expected a relationship")
+        i += 1
+        relationship = {'variable': None, 'labels': [], 'length': [], 'properties': []}
+        if i < len(tokens) and tokens[i][1] == '[':
+            inside, i = read_group(i, '[', ']')
+            relationship = parse_element(inside, 'relationship')
+        if i >= len(tokens) or tokens[i][1] not in ('-', '->'):
+            raise CypherParseError("Expected the end of a relationship")
+        right = tokens[i][1]
+        i += 1
+
+        if left == '<-' and right == '->':
+            raise CypherParseError("Relationship with two directions")
+        relationship['direction'] = 'left' if left == '<-' else 'right' if right == '->' else 'none'
+        path['relationships'].append(relationship)
+
+        inside, i = read_group(i, '(', ')')
+        path['nodes'].append(parse_element(inside, 'node'))
+
+    return path
+
+##
+
+def reverse_path(path):
+    flipped = {'left': 'right', 'right': 'left', 'none': 'none'}
+    relationships = [{**relationship, 'direction': flipped[relationship['direction']]} for relationship in path['relationships'][::-1]]
+    return {'variable': path['variable'], 'nodes': path['nodes'][::-1], 'relationships': relationships}
+
+##
+
+def rename_tokens(tokens, names):
+    """ Rename the variables found in names, unless they are property keys, labels or function names """
+    renamed = []
+    for i, (kind, value) in enumerate(tokens):
+        previous_value = tokens[i - 1][1] if i > 0 else None
+        if kind == 'name' and value in names and previous_value not in ('.', ':'):
+            renamed.append(('name', names[value]))
+        else:
+            renamed.append((kind, value))
+    return renamed
+
+##
+
+def render_element(element, kind, names, seen=None):
+    """ If seen is a set, the labels and properties of a node variable are only written the first time it appears """
+    variable = names.get(element['variable'], "") if element['variable'] else ""
+    if seen is not None and variable:
+        if variable in seen: return f"({variable})" if kind == 'node' else f"[{variable}]"
+        seen.add(variable)
+    labels = "".join([f":{label}" for label in element['labels']]) if kind == 'node' else "|".join(element['labels'])
+    if kind == 'relationship' and labels: labels = ":" + labels
+    length = render(element['length'])
+    properties = ""
+    if element['properties']:
+        properties = " {" + ", ".join([f"{key}: {render(rename_tokens(value, names))}" for key, value in element['properties']]) + "}"
+    text = f"{variable}{labels}{length}{properties}"
+    return f"({text})" if kind == 'node' else f"[{text}]"
+
+##
+
+def render_path(path, names, seen=None):
+    text = render_element(path['nodes'][0], 'node', names, seen)
+    for relationship, node in zip(path['relationships'], path['nodes'][1:]):
+        left = "<-" if relationship['direction'] == 'left' else "-"
+        right = "->" if relationship['direction'] == 'right' else "-"
+        text += f"{left}{render_element(relationship, 'relationship', names, seen)}{right}{render_element(node, 'node', names, seen)}"
+    if path['variable'] and path['variable'] in names:
+        text = f"{names[path['variable']]} = {text}"
+    return text
+
+##
+
+def path_variables(path):
+    """ Variables of a path in the order they are written """
+    ordered = [path['variable']]
+    for i in range(len(path['nodes'])):
+        ordered.append(path['nodes'][i]['variable'])
+        if i < len(path['relationships']): ordered.append(path['relationships'][i]['variable'])
+    return [variable for variable in ordered if variable]
+
+##
+
+def canonicalize_simple(clauses):
+    """ Full normalization of a MATCH ... [WHERE ...] RETURN ... [ORDER BY ...] [SKIP ...] [LIMIT ...] query """
+    matches, conditions, returns, tail, distinct = [], [], None, [], False # matches: paths of every MATCH clause
+    for clause, tokens in clauses:
+        if clause == 'MATCH':
+            if returns is not None: raise CypherParseError("MATCH after RETURN")
+            matches.append([parse_path(part) for part in split_top_level(tokens, {','})])
+        elif clause == 'WHERE':
+            # AND binds tighter than OR, so the conjuncts can only be reordered when there is no top-level OR
+            if has_top_level(tokens, ('OR', 'XOR')):
+                conditions.append(tokens)
+            else:
+                conditions += split_top_level(tokens, {'AND'})
+        elif clause == 'RETURN':
+            if len(tokens) > 0 and tokens[0][1] == 'DISTINCT':
+                distinct, tokens = True, tokens[1:]
+            returns = split_top_level(tokens, {','})
+        else:
+            tail.append((clause, tokens))
+
+    paths = [path for paths in matches for path in paths]
+    if len(paths) == 0 or returns is None:
+        raise CypherParseError("Not a MATCH ... RETURN query")
+
+    # (o:Occupation), (o)-->(p) is the same as (o:Occupation)-->(p): every occurrence of a node variable gets all its labels and
+    # properties, and a path made of a single node that is used in another path is dropped (it has no relationship, so it
+    # does not matter in which MATCH it was)
+    merged = {}
+    for path in paths:
+        for node in path['nodes']:
+            if node['variable']:
+                labels, properties = merged.get(node['variable'], (set(), {}))
+                merged[node['variable']] = (labels | set(node['labels']), {**properties, **dict(node['properties'])})
+    for path in paths:
+        for node in path['nodes']:
+            if node['variable']:
+                labels, properties = merged[node['variable']]
+                node['labels'], node['properties'] = sorted(labels), sorted(properties.items(), key=lambda entry: entry[0])
+    dropped = set()
+    for i, path in enumerate(paths):
+        variable = path['nodes'][0]['variable']
+        if len(path['nodes']) == 1 and variable and not path['variable'] and any(
+                variable in path_variables(other) for j, other in enumerate(paths) if j != i and (len(other['nodes']) > 1 or j < i)):
+            dropped.add(id(path))
+    matches = [[path for path in paths if id(path) not in dropped] for paths in matches]
+    matches = [paths for paths in matches if len(paths) > 0]
+    paths = [path for paths in matches for path in paths]
+
+    # Count the uses of every variable, a variable used once is the same as an anonymous one
+    uses = {}
+    for path in paths:
+        for variable in path_variables(path):
+            uses[variable] = uses.get(variable, 0) + 1
+        for element in path['nodes'] + path['relationships']:
+            for _, value in element['properties']:
+                for kind, name in value:
+                    if kind == 'name': uses[name] = uses.get(name, 0) + 1
+    for tokens in conditions + returns + [tokens for _, tokens in tail]:
+        for i, (kind, name) in enumerate(tokens):
+            if kind == 'name' and (i == 0 or tokens[i - 1][1] not in ('.', ':')):
+                uses[name] = uses.get(name, 0) + 1
+
+    returns_everything = any(render(item) == "*" for item in returns)
+    declared = {variable for path in paths for variable in path_variables(path)}
+    kept = {variable for variable in declared if uses.get(variable, 0) > 1 or returns_everything}
+
+    # Orient and sort the paths of every MATCH without looking at variable names, then name the variables in that order.
+    # A path bound to a variable keeps its direction: the nodes of the returned path are in the order it was written
+    anonymous_names = {variable: "_" for variable in kept}
+    oriented_matches = []
+    for paths in matches:
+        oriented = []
+        for path in paths:
+            options = [path] if path['variable'] else [path, reverse_path(path)]
+            oriented.append(min(options, key=lambda option: render_path(option, anonymous_names)))
+        oriented_matches.append(sorted(oriented, key=lambda path: render_path(path, anonymous_names)))
+
+    names = {}
+    for path in [path for oriented in oriented_matches for path in oriented]:
+        for variable in path_variables(path):
+            if variable in kept and variable not in names:
+                names[variable] = f"v{len(names)}"
+
+    seen = set()
+    text = " ".join(["MATCH " + ", ".join([render_path(path, names, seen) for path in oriented]) for oriented in oriented_matches])
+    if conditions:
+        text += " WHERE " + " AND ".join(sorted(render(rename_tokens(condition, names)) for condition in conditions))
+    text += " RETURN " + ("DISTINCT " if distinct else "") + ", ".join(sorted(render(rename_tokens(item, names)) for item in returns))
+    for clause, tokens in tail:
+        text += f" {clause} {render(rename_tokens(tokens, names))}"
+
+    return text
+
+##
+
+def has_top_level(tokens, values):
+    depth = 0
+    for kind, value in tokens:
+        if value in OPENING: depth += 1
+        elif value in CLOSING: depth -= 1
+        elif depth == 0 and kind == 'keyword' and value in values: return True
+    return False
+
+##
+
+def canonicalize_general(tokens):
+    """ Normalization used for queries with other clauses: spacing, case, quotes and variable names by order of appearance """
+    names = {}
+    for clause, clause_tokens in split_clauses(tokens):
+        if clause not in ('MATCH', 'OPTIONAL MATCH', 'MERGE', 'CREATE'):
+            continue
+        for part in split_top_level(clause_tokens, {','}):
+            try:
+                path = parse_path(part)
+            except CypherParseError:
+                continue
+            for variable in path_variables(path):
+                if variable not in names: names[variable] = f"v{len(names)}"
+    return render(rename_tokens(tokens, names))
+
+##
+
+def canonicalize(query):
+    """ Returns the canonical text of a Cypher query """
+    tokens = tokenize(query.strip().rstrip(';'))
+    if len(tokens) == 0:
+        return ""
+
+    try:
+        clauses = split_clauses(tokens)
+        if {clause for clause, _ in clauses} <= SIMPLE_CLAUSES:
+            return canonicalize_simple(clauses)
+    except CypherParseError:
+        pass
+
+    try:
+        return canonicalize_general(tokens)
+    except CypherParseError:
+        return render(tokens)
+
+##
+
+def fingerprint(query):
+    """ Hash of the canonical text. Equivalent queries get the same fingerprint """
+    try:
+        text = canonicalize(query)
+    except CypherParseError: # unterminated string or unknown character: fall back to the query without extra white spaces
+        text = " ".join(query.split())
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+##
+
+def signature(query):
+    """
+    Labels and relationship types used by a query. Two queries with different fingerprints but the same signature are
+    near-misses: they might still return the same output, which only the LLM comparison can tell.
+    """
+    try:
+        tokens = tokenize(query)
+    except CypherParseError:
+        return frozenset()
+
+    names, map_depth = set(), 0
+    for i in range(len(tokens) - 1):
+        if tokens[i][1] == '{': map_depth += 1
+        elif tokens[i][1] == '}': map_depth -= 1
+        elif map_depth == 0 and tokens[i][1] in (':', '|') and tokens[i + 1][0] == 'name':
+            names.add(tokens[i + 1][1])
+    return frozenset(names)
@@ -0,0 +1,145 @@
+"""
+Neo4j client shared by the whole process, and the graph's schema snapshot.
+
+    - get_async_driver(): the one Neo4j driver (and connection pool) of the process, used by the agent's tools, the data version
+      and the schema. Created on first use, inside the event loop that uses it
+    - run_query(): same output as Neo4jGraph.query, without blocking the event loop
+    - load_schema(): structured schema of the graph, in the format of Neo4jGraph.structured_schema. Reading it takes several APOC calls,
+      so it is saved in a snapshot file with the graph data version it was read at (see set_data_version in
+      Knowledge_Graph/CSV_to_Knowledge_Graph/graph_functions.py). Later startups use the snapshot while the data version is the same
+    - get_schema(): the schema loaded by load_schema(), without connecting to Neo4j
+    - refresh_schema(): reads the schema from the graph and rewrites the snapshot
+
+Nothing connects to Neo4j at import time.
+NOTE: if the graph has no data version, a snapshot is used until refresh_schema() is called.
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+from FastAPI_Sub_Folder.Helpers.query_cache import get_data_version
+
+SCHEMA_SNAPSHOT_PATH = Path(os.getenv('SCHEMA_SNAPSHOT_PATH', 'graph_schema.json'))
+
+# Same queries as Neo4jGraph.refresh_schema, apoc.meta.data() is only called once
+META_DATA_QUERY = "CALL apoc.meta.data() YIELD label, other, elementType, type, property RETURN label, other, elementType, type, property"
+CONSTRAINTS_QUERY = "SHOW CONSTRAINTS"
+INDEXES_QUERY = ("CALL apoc.schema.nodes() YIELD label, properties, type, size, valuesSelectivity WHERE type = 'RANGE' "
+                 "RETURN *, size * valuesSelectivity AS distinctValues")
+EXCLUDED_LABELS = ['_Bloom_Perspective_', '_Bloom_Scene_']
+EXCLUDED_RELATIONSHIPS = ['_Bloom_HAS_SCENE_']
+
+async_driver = None
+schema = None # {'version', 'structured_schema', 'saved_at'}
+
+##
+
+def get_async_driver():
+    global async_driver
+    if async_driver is None:
+        from neo4j import AsyncGraphDatabase
+        async_driver = AsyncGraphDatabase.driver(os.environ["NEO4J_URI"], auth=(os.environ["NEO4J_USERNAME"], os.environ["NEO4J_PASSWORD"]))
+    return async_driver
+
+## Same output as Neo4jGraph.query. NOTE: not guarded, only for the queries written in the code
+async def run_query(query, parameters=None):
+    records, _, _ = await get_async_driver().execute_query(query, parameters)
+    return [record.data() for record in records]
+
+async def close():
+    global async_driver
+    if async_driver is not None:
+        driver, async_driver = async_driver, None # a later get_async_driver() creates a new one
+        await driver.close()
+
+##
+
+def build_structured_schema(meta_data, constraints, indexes):
+    """ Rows of apoc.meta.data() -> structured schema, as Neo4jGraph.structured_schema """
+    node_properties, relationship_properties, relationships = {}, {}, []
+    for row in meta_data:
+        if row['type'] == "RELATIONSHIP":
+            # a node label, with the relationship type in property and the labels at the other end in other
+            if row['elementType'] != "node" or row['label'] in EXCLUDED_LABELS: continue
+            relationships += [{'start': row['label'], 'type': row['property'], 'end': str(other)} for other in row['other'] if other not in EXCLUDED_LABELS]
+        elif row['elementType'] == "node" and row['label'] not in EXCLUDED_LABELS:
+            node_properties.setdefault(row['label'], []).append({'property': row['property'], 'type': row['type']})
+        elif row['elementType'] == "relationship" and row['label'] not in EXCLUDED_RELATIONSHIPS:
+            relationship_properties.setdefault(row['label'], []).append({'property': row['property'], 'type': row['type']})
+
+    return {'node_props': node_properties, 'rel_props': relationship_properties, 'relationships': relationships,
+            'metadata': {'constraint': constraints, 'index': indexes}}
+
+async def read_structured_schema():
+    from neo4j.exceptions import ClientError
+    meta_data = await run_query(META_DATA_QUERY)
+    try:
+        constraints, indexes = await run_query(CONSTRAINTS_QUERY), await run_query(INDEXES_QUERY)
+    except ClientError: # the user can not list them, as Neo4jGraph does the schema is read without them
+        constraints, indexes = [], []
+    return build_structured_schema(meta_data, constraints, indexes)
+
+##
+
+def read_snapshot(path=SCHEMA_SNAPSHOT_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_snapshot(snapshot, path=SCHEMA_SNAPSHOT_PATH):
+    # Written next to the file then renamed, so that a crash never leaves half a snapshot
+    temporary_path = Path(f"{path}.tmp")
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, default=str)
+    os.replace(temporary_path, path)
+
+##
+
+async def refresh_schema(path=SCHEMA_SNAPSHOT_PATH):
+    """ Reads the schema from the graph, saves it in the snapshot file and returns it """
+    global schema
+    start_time = time.perf_counter()
+    version = await get_data_version(run_query)
+    structured_schema = await read_structured_schema()
+    schema = {'version': version, 'structured_schema': json.loads(json.dumps(structured_schema, default=str)), 'saved_at': time.time()}
+    write_snapshot(schema, path)
+    print(f"----- Graph schema read from Neo4j in {time.perf_counter() - start_time:.2f}s and saved in {path} (data version {version})")
+    return schema['structured_schema']
+
+async def load_schema(path=SCHEMA_SNAPSHOT_PATH, check_version=True):
+    """
+    Structured schema of the graph: from memory, then from the snapshot file if its data version is the current one, then from the graph.
+    check_version: if False, a snapshot is used without reading the data version (no connection to Neo4j)
+    """
+    global schema
+    if schema is not None: return schema['structured_schema']
+
+    snapshot = read_snapshot(path)
+    if snapshot is not None:
+        if not check_version:
+            schema = snapshot
+            return schema['structured_schema']
+        try:
+            version = await get_data_version(run_query)
+        except Exception as e:
+            print(f"----- Could not read the graph data version, using the schema snapshot: {e}")
+            version = snapshot['version']
+        if version == snapshot['version']:
+            print(f"----- Graph schema loaded from {path} (data version {version})")
+            schema = snapshot
+            return schema['structured_schema']
+        print(f"----- Graph data version changed ({snapshot['version']} -> {version}), reading the schema again")
+
+    return await refresh_schema(path)
+
+def get_schema(path=SCHEMA_SNAPSHOT_PATH):
+    """ Schema loaded by load_schema() (or the snapshot file if it did not run), without connecting to Neo4j """
+    global schema
+    if schema is None:
+        snapshot = read_snapshot(path)
+        if snapshot is None: raise RuntimeError("The graph schema is not loaded, await load_schema() first")
+        schema = snapshot
+    return schema['structured_schema']
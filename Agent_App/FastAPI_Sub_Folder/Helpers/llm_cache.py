@@ -0,0 +1,238 @@
+"""
+Content-addressed cache of the LLM's responses, saved in a SQLite file so that it survives restarts.
+
+Some prompts reach the LLM again and again with the same content: the comparison of the same pair of cypher codes,
+the extraction over the same query output, the judge calls of LLM_Evaluation/eval.ipynb. Every one is a paid call to Groq
+that counts against the rate limit.
+
+    - the key is the sha256 of the model's name, its temperature, the bound tools and the messages
+      (only what the model reads: type, content, tool calls. Not the ids or the metadata of the messages)
+    - the least recently used responses are deleted once the file holds more than max_bytes
+    - identical requests that arrive while the first one is running wait for its response instead of calling the LLM
+
+NOTE: only a model with a temperature of 0 (or without a temperature) is cached. With a higher temperature every call is a new
+sample, a cached response would freeze the first one: CachedChatModel then calls the model without the cache.
+The agent's conversation is not cached, its helper steps and the judge of the evaluation use a model at temperature 0.
+
+Usage:
+    cache = LLMResponseCache("llm_cache.sqlite")
+    model = CachedChatModel(ChatGroq(...), cache)
+    model.invoke(prompt) / await model.ainvoke(prompt)
+"""
+
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future, CancelledError
+from langchain_core.runnables import Runnable
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from FastAPI_Sub_Folder.Helpers.metrics import record_cache
+
+##
+
+def message_content(message):
+    """ What the model reads of a message """
+    if not isinstance(message, BaseMessage): return message
+    return {
+        'type': message.type, 'content': message.content,
+        'tool_calls': [{'name': tool_call['name'], 'args': tool_call['args']} for tool_call in getattr(message, 'tool_calls', None) or []],
+        'tool_call_id': getattr(message, 'tool_call_id', None),
+    }
+
+def get_model_settings(model):
+    """ (name, temperature, bound tools) of a chat model or of a model returned by bind_tools """
+    while not isinstance(model, Runnable) and hasattr(model, 'model'): model = model.model # wrappers (example: ScheduledChatModel)
+    kwargs = getattr(model, 'kwargs', {}) # bind_tools returns a RunnableBinding holding the tools in kwargs
+    model = getattr(model, 'bound', model)
+    name = getattr(model, 'model_name', None) or getattr(model, 'model', None) or type(model).__name__
+    return str(name), getattr(model, 'temperature', None), kwargs.get('tools')
+
+def is_cacheable(model):
+    """ False if the model samples its answers (temperature above 0) """
+    _, temperature, _ = get_model_settings(model)
+    return not temperature
+
+def get_key(model, model_input):
+    """ model_input: str or list of messages, as given to invoke """
+    name, temperature, tools = get_model_settings(model)
+    messages = [message_content(message) for message in model_input] if isinstance(model_input, list) else model_input
+    content = json.dumps({'model': name, 'temperature': temperature, 'tools': tools, 'messages': messages}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+##
+
+class LLMResponseCache:
+    """
+    path: SQLite file of the cache
+    max_bytes: maximum size of the stored responses, the least recently used ones are deleted past it
+    """
+
+    def __init__(self, path="llm_cache.sqlite", max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, size INTEGER, created_at REAL, last_used REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+        self.num_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        self.in_flight = {} # key: Future of the response, for the requests running now
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None: return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return messages_from_dict([json.loads(row[0])])[0]
+
+    def set(self, key, message):
+        value = json.dumps(message_to_dict(message), default=str)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes: return
+
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None: self.num_bytes -= row[0]
+            now = time.time()
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            self.num_bytes += size
+
+            # Delete the least recently used responses
+            while self.num_bytes > self.max_bytes:
+                old_key, old_size = self.conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 1").fetchone()
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                self.num_bytes -= old_size
+                self.evictions += 1
+            self.conn.commit()
+
+    ## Returns (future, is_leader). The leader calls the LLM and sets the future's result, the others wait for it
+    def join(self, key):
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self.in_flight[key] = future
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self.lock:
+            self.in_flight.pop(key, None)
+        if isinstance(error, (CancelledError, asyncio.CancelledError)): future.cancel() # the leader was cancelled, not the call: the waiting requests take its place
+        elif error is not None: future.set_exception(error)
+        else: future.set_result(result)
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'entries': entries, 'bytes': self.num_bytes, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0.0, 'coalesced': self.coalesced, 'evictions': self.evictions,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+##
+
+class CachedChatModel:
+    """
+    Chat model (or model returned by bind_tools) whose invoke and ainvoke go through an LLMResponseCache.
+    A model with a temperature above 0 is called without the cache (see the NOTE above)
+    """
+
+    def __init__(self, model, cache):
+        self.model = model
+        self.cache = cache
+        self.cacheable = is_cacheable(model)
+        if not self.cacheable:
+            name, temperature, _ = get_model_settings(model)
+            print(f"----- LLM cache not used for {name}: its temperature is {temperature}, give it a model at temperature 0")
+
+    def bind_tools(self, tools, **kwargs):
+        return CachedChatModel(self.model.bind_tools(tools, **kwargs), self.cache)
+
+    def invoke(self, model_input, **kwargs):
+        if not self.cacheable: return self.model.invoke(model_input, **kwargs)
+        key = get_key(self.model, model_input)
+        response = self.cache.get(key)
+        while response is None:
+            future, is_leader = self.cache.join(key)
+            if is_leader:
+                response = self.cache.get(key) # the previous leader may have saved it between get and join
+                if response is not None:
+                    self.cache.finish(key, future, result=response)
+                    break
+                return self.call_model(key, future, model_input, **kwargs)
+            try:
+                response = future.result()
+            except CancelledError: # the leader was cancelled, this request takes its place
+                continue
+            record_cache("llm", False)
+            return response
+
+        record_cache("llm", True)
+        self.cache.hits += 1
+        return response
+
+    async def ainvoke(self, model_input, **kwargs):
+        if not self.cacheable: return await self.model.ainvoke(model_input, **kwargs)
+        key = get_key(self.model, model_input)
+        response = await asyncio.to_thread(self.cache.get, key)
+        while response is None:
+            future, is_leader = self.cache.join(key)
+            if is_leader:
+                response = await asyncio.to_thread(self.cache.get, key) # the previous leader may have saved it between get and join
+                if response is not None:
+                    self.cache.finish(key, future, result=response)
+                    break
+                return await self.acall_model(key, future, model_input, **kwargs)
+            try:
+                # shield: a cancelled request does not cancel the shared future of the others
+                response = await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled(): raise # this request was cancelled
+                continue # the leader was cancelled, this request takes its place
+            record_cache("llm", False)
+            return response
+
+        record_cache("llm", True)
+        self.cache.hits += 1
+        return response
+
+    ## The leader's call. Its error reaches the waiting requests, its cancellation makes one of them the new leader
+    def call_model(self, key, future, model_input, **kwargs):
+        record_cache("llm", False)
+        self.cache.misses += 1
+        try:
+            response = self.model.invoke(model_input, **kwargs)
+        except BaseException as e:
+            self.cache.finish(key, future, error=e)
+            raise
+        self.cache.set(key, response)
+        self.cache.finish(key, future, result=response)
+        return response
+
+    async def acall_model(self, key, future, model_input, **kwargs):
+        record_cache("llm", False)
+        self.cache.misses += 1
+        try:
+            response = await self.model.ainvoke(model_input, **kwargs)
+        except BaseException as e:
+            self.cache.finish(key, future, error=e)
+            raise
+        await asyncio.to_thread(self.cache.set, key, response)
+        self.cache.finish(key, future, result=response)
+        return response
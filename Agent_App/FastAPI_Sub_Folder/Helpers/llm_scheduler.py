@@ -0,0 +1,217 @@
+"""
+Scheduler shared by every LLM call of the process, so that the sessions respect Groq's rate limits together.
+
+    - two token buckets: requests per minute and tokens per minute (estimated from the prompt, corrected with the usage of the answer)
+    - a priority queue: the nodes that answer the user (personality_scientist, recommend_careers) go before the helper calls
+    - a deadline: a request still waiting after deadline seconds fails with LLMQueueTimeout instead of waiting forever
+    - on a 429 (or 503), every request waits: the backoff is shared, with jitter, and uses the Retry-After header when there is one
+
+Set max_retries=0 on the chat model: its own retries would run outside the scheduler.
+
+Usage:
+    scheduler = LLMScheduler(requests_per_minute=30, tokens_per_minute=6000)
+    model = ScheduledChatModel(ChatGroq(..., max_retries=0), scheduler, priority=USER_PRIORITY)
+    await model.ainvoke(messages)
+"""
+
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from FastAPI_Sub_Folder.Helpers.prompt_budget import estimate_tokens, message_tokens
+
+USER_PRIORITY = 0
+HELPER_PRIORITY = 1
+RETRY_STATUS_CODES = [429, 503]
+EXPECTED_OUTPUT_TOKENS = 500 # added to the prompt's tokens before the answer is known
+
+##
+
+class LLMSchedulerError(Exception):
+    pass
+
+class LLMQueueTimeout(LLMSchedulerError):
+    """ The request waited in the queue past its deadline """
+
+class LLMRateLimited(LLMSchedulerError):
+    """ The LLM still answered 429 after max_retries retries """
+
+##
+
+def get_status_code(error):
+    status_code = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code
+
+def get_retry_after(error):
+    """ Seconds of the Retry-After header of the error's response, or None """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def estimate_request_tokens(model_input):
+    if isinstance(model_input, str): return estimate_tokens(model_input) + EXPECTED_OUTPUT_TOKENS
+    return sum(map(message_tokens, model_input)) + EXPECTED_OUTPUT_TOKENS
+
+##
+
+class TokenBucket:
+    """ rate_per_minute: refill rate, also the capacity. A request larger than the capacity is let through when the bucket is full """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    ## Seconds before amount can be taken
+    def wait_time(self, amount, now):
+        self.refill(now)
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount, now):
+        self.refill(now)
+        self.level -= amount # can go below 0, the next requests wait for it to refill
+
+##
+
+class LLMScheduler:
+    """
+    requests_per_minute, tokens_per_minute: limits of the Groq plan (None: no limit)
+    deadline: seconds a request can wait in the queue
+    max_retries: retries of a request answered with a 429 or 503
+    base_delay, max_delay: backoff of the n-th retry = min(max_delay, base_delay * 2^n) * random(0.5, 1), or the Retry-After header
+    """
+
+    def __init__(self, requests_per_minute=30, tokens_per_minute=6000, deadline=60, max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.queue = [] # heap of (priority, order, tokens)
+        self.order = itertools.count()
+        self.condition = None # created in the event loop on first use
+        self.paused_until = 0.0 # shared backoff after a 429
+
+        self.in_flight = 0
+        self.completed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+        self.wait_seconds = {USER_PRIORITY: [0.0, 0], HELPER_PRIORITY: [0.0, 0]} # priority: [total seconds waited, requests]
+        self.max_wait_seconds = 0.0
+
+    ## Seconds before the first request of the queue (needing tokens) can be sent
+    def wait_time(self, tokens, now):
+        wait = max(0.0, self.paused_until - now)
+        if self.request_bucket is not None: wait = max(wait, self.request_bucket.wait_time(1, now))
+        if self.token_bucket is not None: wait = max(wait, self.token_bucket.wait_time(tokens, now))
+        return wait
+
+    ## Waits until the request is first in the queue and the buckets have room, then takes from them
+    async def acquire(self, priority, tokens, deadline):
+        if self.condition is None: self.condition = asyncio.Condition()
+        entry = (priority, next(self.order), tokens)
+        queued_at = time.monotonic()
+
+        async with self.condition:
+            heapq.heappush(self.queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        self.timeouts += 1
+                        raise LLMQueueTimeout(f"The LLM request waited {now - queued_at:.1f}s in the queue ({len(self.queue)} requests waiting)")
+
+                    wait = self.wait_time(tokens, now) if self.queue[0] == entry else deadline - now
+                    if self.queue[0] == entry and wait == 0: break
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout=min(wait, deadline - now))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self.condition.notify_all()
+
+            now = time.monotonic()
+            if self.request_bucket is not None: self.request_bucket.take(1, now)
+            if self.token_bucket is not None: self.token_bucket.take(tokens, now)
+
+        waited = time.monotonic() - queued_at
+        self.wait_seconds[priority][0] += waited
+        self.wait_seconds[priority][1] += 1
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    ## Shared backoff: every request waits until it is over
+    def back_off(self, error, attempt):
+        delay = get_retry_after(error)
+        if delay is None: delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        print(f"----- LLM answered {get_status_code(error)}, every LLM request waits {delay:.1f}s (retry {attempt + 1}/{self.max_retries})")
+
+    async def submit(self, call, model_input, priority=USER_PRIORITY, deadline=None):
+        """ Runs the coroutine function call() once the limits allow it, retrying on 429 and 503. model_input is used to estimate the tokens """
+        tokens = estimate_request_tokens(model_input)
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.deadline)
+
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(priority, tokens, deadline_at)
+            self.in_flight += 1
+            try:
+                response = await call()
+            except Exception as e:
+                if get_status_code(e) not in RETRY_STATUS_CODES: raise
+                self.rate_limited += 1
+                if attempt == self.max_retries: raise LLMRateLimited(f"The LLM is still rate limited after {self.max_retries} retries") from e
+                self.retries += 1
+                self.back_off(e, attempt)
+                continue
+            finally:
+                self.in_flight -= 1
+
+            # Correct the token bucket with the tokens the answer really used
+            usage = getattr(response, 'usage_metadata', None)
+            if self.token_bucket is not None and usage and usage.get('total_tokens'):
+                self.token_bucket.take(usage['total_tokens'] - tokens, time.monotonic())
+            self.completed += 1
+            return response
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'queue_depth': len(self.queue),
+            'queue_depth_by_priority': {'user': sum(1 for entry in self.queue if entry[0] == USER_PRIORITY),
+                                        'helper': sum(1 for entry in self.queue if entry[0] == HELPER_PRIORITY)},
+            'in_flight': self.in_flight, 'completed': self.completed, 'retries': self.retries, 'rate_limited': self.rate_limited, 'timeouts': self.timeouts,
+            'average_wait_seconds': {'user': self.wait_seconds[USER_PRIORITY][0] / max(1, self.wait_seconds[USER_PRIORITY][1]),
+                                     'helper': self.wait_seconds[HELPER_PRIORITY][0] / max(1, self.wait_seconds[HELPER_PRIORITY][1])},
+            'max_wait_seconds': self.max_wait_seconds,
+            'paused_seconds': max(0.0, self.paused_until - now),
+        }
+
+##
+
+class ScheduledChatModel:
+    """ Chat model (or model returned by bind_tools) whose ainvoke goes through an LLMScheduler with the given priority """
+
+    def __init__(self, model, scheduler, priority=USER_PRIORITY):
+        self.model = model
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def bind_tools(self, tools, **kwargs):
+        return ScheduledChatModel(self.model.bind_tools(tools, **kwargs), self.scheduler, self.priority)
+
+    async def ainvoke(self, model_input, **kwargs):
+        return await self.scheduler.submit(lambda: self.model.ainvoke(model_input, **kwargs), model_input, priority=self.priority)
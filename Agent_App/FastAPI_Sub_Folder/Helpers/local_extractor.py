@@ -0,0 +1,200 @@
+"""
+Local, deterministic version of the extract_data step.
+
+The LLM extractor mostly filters the query output: it keeps the edges that touch the RIASEC traits found in the conversation.
+This does the same without an LLM call:
+    1. the user's traits are found with a keyword lexicon of every RIASEC trait (and the trait names themselves).
+       Keywords are whole words, and the ones after a negation in the same clause are not counted (example: I would not like to lead)
+    2. the query rows are parsed into edges (node, relation, node)
+    3. the nodes linked to the most identified traits are kept (up to max_nodes), then the ones with the strongest relations
+       and the ones linked to the user's first traits, with their edges to these traits and their strong_need_for_* edges
+
+It returns None when it cannot decide, and the LLM extractor is used instead:
+    - no trait found, or no clear top trait (the first traits tie)
+    - more nodes tie for the last places than max_nodes lets through (example: every occupation linked to Realistic)
+    - rows it can not parse, no edge touching a trait
+The output has the format the Streamlit page plots: [['Node1', 'relation', 'Node2'], ...] or [['Node1', 'Node2'], ...] when the query did not return the relation.
+
+NOTE: off by default (see local_extraction in agent_workflow.py). Check its recall with benchmark_extract_data.py before turning it on.
+"""
+
+import re
+import ast
+import json
+
+TRAITS = ['Realistic', 'Investigative', 'Artistic', 'Social', 'Enterprising', 'Conventional']
+
+# Words that point to a trait (whole words: "art" does not match "artificial")
+TRAIT_KEYWORDS = {
+    'Realistic': ['hands-on', 'hands on', 'build', 'builds', 'building', 'fix', 'fixing', 'repair', 'repairs', 'repairing', 'tool', 'tools',
+                  'machine', 'machines', 'machinery', 'mechanic', 'mechanics', 'mechanical', 'outdoor', 'outdoors', 'physical', 'practical',
+                  'construct', 'construction', 'constructing', 'equipment', 'manual', 'craft', 'crafts', 'crafting', 'athletic', 'technical',
+                  'immediate results'],
+    'Investigative': ['problem-solving', 'problem solving', 'solve', 'solving', 'analyze', 'analyse', 'analyzing', 'analysing', 'analysis',
+                      'analytical', 'research', 'researching', 'science', 'sciences', 'scientific', 'math', 'maths', 'mathematics', 'logic',
+                      'logical', 'curious', 'curiosity', 'investigate', 'investigating', 'investigation', 'experiment', 'experiments',
+                      'experimenting', 'theory', 'theories', 'theoretical', 'understand how', 'technical', 'critical thinking', 'intellectual'],
+    'Artistic': ['create', 'creating', 'creative', 'creativity', 'design', 'designs', 'designing', 'art', 'arts', 'music', 'musical', 'write',
+                 'writing', 'paint', 'painting', 'draw', 'drawing', 'express', 'expressing', 'expression', 'expressive', 'imagine', 'imagination',
+                 'imaginative', 'innovate', 'innovative', 'innovation', 'perform', 'performing', 'performance', 'original', 'originality',
+                 'flexible', 'flexibility', 'intuition'],
+    'Social': ['team', 'teams', 'teamwork', 'help', 'helping', 'teach', 'teaching', 'people', 'caring', 'care for', 'communicate',
+               'communicating', 'communication', 'collaborate', 'collaborating', 'collaboration', 'support', 'supporting', 'volunteer',
+               'volunteering', 'counsel', 'counseling', 'counselling', 'mentor', 'mentoring', 'serve', 'serving', 'empathy', 'empathetic'],
+    'Enterprising': ['lead', 'leading', 'leader', 'leadership', 'manage', 'managing', 'management', 'manager', 'business', 'sell', 'selling',
+                     'sales', 'persuade', 'persuading', 'persuasive', 'entrepreneur', 'entrepreneurial', 'negotiate', 'negotiating',
+                     'negotiation', 'influence', 'influencing', 'compete', 'competing', 'competition', 'competitive', 'ambition', 'ambitious',
+                     'risk', 'risks', 'big-picture', 'big picture', 'dynamic', 'independent', 'independence', 'independently', 'minimal supervision'],
+    'Conventional': ['organize', 'organise', 'organizing', 'organising', 'organized', 'organised', 'plan', 'plans', 'planning', 'detail',
+                     'details', 'detailed', 'detail-oriented', 'structure', 'structured', 'record', 'records', 'record-keeping', 'routine',
+                     'routines', 'schedule', 'schedules', 'scheduling', 'accurate', 'accuracy', 'procedure', 'procedures', 'spreadsheet',
+                     'spreadsheets', 'budget', 'budgets', 'budgeting', 'data entry', 'rule', 'rules', 'stable', 'stability', 'deadline',
+                     'deadlines', 'strict', 'guidance'],
+}
+TRAIT_PATTERNS = {trait: re.compile(r"\b(" + "|".join([re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)]) + r")\b", re.IGNORECASE)
+                  for trait, keywords in TRAIT_KEYWORDS.items()}
+TRAIT_NAME_PATTERN = re.compile(r"\b(" + "|".join(TRAITS) + r")\b", re.IGNORECASE)
+
+# A negation covers the rest of its clause: "I hate dealing with people, but I like to build" only counts build
+CLAUSE_PATTERN = re.compile(r"[.,;:!?\n]|\b(?:but|although|though|however|whereas|while)\b", re.IGNORECASE)
+NEGATION_PATTERN = re.compile(r"\b(?:not|no|never|nor|neither|cannot|hate|hates|dislike|dislikes|avoid|avoids)\b|n't\b", re.IGNORECASE)
+
+MAX_TRAITS = 3 # a RIASEC code has up to 3 letters
+MAX_NODES = 6 # the agent suggests up to 6 careers
+STRONG_RELATION_PREFIX = "strong_"
+RELATION_STRENGTHS = {'strong_': 3, 'medium_': 2, 'low_': 1} # prefixes of the relation labels (see evaluate_importance in format_functions.py)
+
+##
+
+def affirmed_matches(pattern, text):
+    """ Matches of pattern in text, except the ones after a negation in the same clause """
+    matches = []
+    for clause in CLAUSE_PATTERN.split(text):
+        negation = NEGATION_PATTERN.search(clause)
+        end = negation.start() if negation else len(clause)
+        matches += [match.group(0) for match in pattern.finditer(clause) if match.start() < end]
+    return matches
+
+def score_traits(conversation):
+    """
+    Returns {trait: score}. conversation: list of messages (type 'human' or 'ai').
+
+    The user's messages count keywords and trait names. The agent's messages only count the trait names,
+    since its questions list options the user did not choose.
+    """
+    scores = {trait: 0 for trait in TRAITS}
+    for message in conversation:
+        text = message.content if isinstance(message.content, str) else str(message.content)
+        for name in affirmed_matches(TRAIT_NAME_PATTERN, text):
+            scores[name.capitalize()] += 3 if message.type == 'human' else 1
+        if message.type == 'human':
+            for trait, pattern in TRAIT_PATTERNS.items():
+                scores[trait] += len(affirmed_matches(pattern, text))
+    return scores
+
+def select_traits(scores, max_traits=MAX_TRAITS):
+    """ Traits scoring at least half of the best score, the most likely first """
+    best_score = max(scores.values())
+    if best_score == 0: return []
+    traits = sorted([trait for trait in TRAITS if scores[trait] * 2 >= best_score], key=lambda trait: (-scores[trait], TRAITS.index(trait)))
+    return traits[:max_traits]
+
+def identify_traits(conversation, max_traits=MAX_TRAITS):
+    """ Returns the user's traits, the most likely first """
+    return select_traits(score_traits(conversation), max_traits)
+
+def is_clear(scores, traits):
+    """ The first trait scores more than every other one, and no trait left out ties with a kept one """
+    ranked = sorted(scores.values(), reverse=True)
+    if len(traits) == 0 or ranked[0] == ranked[1]: return False
+    return len(traits) == len(TRAITS) or ranked[len(traits)] < scores[traits[-1]]
+
+##
+
+##
+
+def parse_output(output):
+    """ Full output of a query (list of rows, or the JSON or str of the rows) -> list of rows, or None if it can not be read """
+    if isinstance(output, str):
+        try:
+            output = json.loads(output)
+        except ValueError:
+            try:
+                output = ast.literal_eval(output)
+            except (ValueError, SyntaxError):
+                return None
+    if not isinstance(output, list) or not all(isinstance(row, dict) for row in output): return None
+    return output
+
+##
+
+def parse_row(row):
+    """
+    Returns the edges of a query row: (node, relation, node) between its first node and each of the others.
+    relation is None when the row does not have one.
+    """
+    nodes, relation = [], None
+    for key, value in row.items():
+        if isinstance(value, dict) and 'title' in value:
+            nodes.append(str(value['title']))
+        elif isinstance(value, (list, tuple)) and len(value) == 3 and isinstance(value[1], str): # relationship: (start, type, end)
+            relation = value[1]
+        elif isinstance(value, str):
+            if key.lower().startswith("type(") or key.lower() in ["relation", "relationship", "type"]: relation = value
+            else: nodes.append(value)
+
+    return [(nodes[0], relation, node) for node in nodes[1:]]
+
+##
+
+def get_strength(relation):
+    """ strong_need_for_ability -> 3, relations without a strength (example: need_for_personality_trait) -> 0 """
+    for prefix, strength in RELATION_STRENGTHS.items():
+        if relation and relation.startswith(prefix): return strength
+    return 0
+
+def extract_locally(outputs, conversation, max_nodes=MAX_NODES):
+    """
+    outputs: full outputs of the queries (see parse_output)
+    conversation: list of messages
+
+    Returns the extracted edges in the format of the LLM extractor, or None if it can not decide.
+    """
+    scores = score_traits(conversation)
+    traits = select_traits(scores)
+    if not is_clear(scores, traits): return None
+
+    edges = []
+    for output in outputs:
+        rows = parse_output(output)
+        if rows is None: return None
+        edges += [edge for row in rows for edge in parse_row(row)]
+
+    # {node: {trait: relation}} for the edges between a node and an identified trait
+    matches = {}
+    for node_1, relation, node_2 in edges:
+        node, trait = (node_1, node_2) if node_2 in TRAITS else (node_2, node_1) if node_1 in TRAITS else (None, None)
+        if trait in traits: matches.setdefault(node, {})[trait] = relation
+    if len(matches) == 0: return None
+
+    # Nodes linked to the most traits first, then with the strongest relations, then linked to the user's first traits.
+    # NOTE: never by name, the nodes that still tie are all kept or the LLM decides
+    def rank(node):
+        return (-len(matches[node]), -sum(map(get_strength, matches[node].values())), sorted([traits.index(trait) for trait in matches[node]]))
+    ranked = sorted(matches.keys(), key=rank)
+    if len(ranked) > max_nodes and rank(ranked[max_nodes - 1]) == rank(ranked[max_nodes]): return None
+    selected = ranked[:max_nodes]
+
+    extracted = []
+    for node in selected:
+        for trait in traits:
+            if trait not in matches[node]: continue
+            relation = matches[node][trait]
+            extracted.append([node, relation, trait] if relation else [node, trait])
+
+    # Strong needs of the selected nodes (example: Occupation -strong_need_for_basic_skill-> Basic_Skill)
+    for node_1, relation, node_2 in edges:
+        if node_1 in selected and node_2 not in TRAITS and relation and relation.startswith(STRONG_RELATION_PREFIX):
+            if [node_1, relation, node_2] not in extracted: extracted.append([node_1, relation, node_2])
+
+    return extracted
@@ -0,0 +1,236 @@
+"""
+Instrumentation of the agent, without LangSmith or any other service.
+
+Process-wide metrics, rendered in the Prometheus text format by render() (GET /metrics):
+    - personabot_node_duration_seconds{node}: wall time of every LangGraph node
+    - personabot_llm_calls_total{node}, personabot_llm_duration_seconds{node}, personabot_llm_tokens{node, kind}: LLM calls,
+      with the prompt and completion tokens of the answer's usage (estimated when the model does not return it)
+    - personabot_neo4j_query_duration_seconds{status}, personabot_neo4j_result_rows, personabot_neo4j_result_bytes: queries of the LLM
+    - personabot_cache_requests_total{cache, result}: hits and misses of the query cache and of the LLM response cache
+    - personabot_request_duration_seconds{route}: HTTP requests
+
+Every HTTP request also gets a RequestMetrics (in a context variable) with the same measures for this request only:
+they are sent back as timing headers, and written as one JSON line in TRACE_LOG_PATH if it is set (local trace, works offline).
+"""
+
+import os
+import json
+import time
+import threading
+import contextvars
+from FastAPI_Sub_Folder.Helpers.prompt_budget import estimate_tokens, message_tokens
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+TOKEN_BUCKETS = [100, 250, 500, 1000, 2000, 4000, 8000, 16000]
+ROW_BUCKETS = [0, 1, 10, 100, 1000, 10000]
+BYTE_BUCKETS = [1000, 10000, 100000, 1000000, 10000000]
+
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH')
+
+current_request = contextvars.ContextVar('current_request', default=None) # RequestMetrics of the HTTP request
+current_node = contextvars.ContextVar('current_node', default=None) # LangGraph node running
+
+##
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + (extra or [])
+    if len(pairs) == 0: return ""
+    return "{" + ",".join([f'{name}="{escape(value)}"' for name, value in pairs]) + "}"
+
+class Counter:
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {} # label values: count
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name)) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self.values = {} # label values: [count per bucket..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name)) for name in self.label_names)
+        with self.lock:
+            counts = self.values.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                for i, bound in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, [('le', bound)])} {counts[i]}")
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, [('le', '+Inf')])} {counts[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {counts[-1]}")
+        return lines
+
+##
+
+node_duration = Histogram("personabot_node_duration_seconds", "Wall time of a LangGraph node", DURATION_BUCKETS, ("node",))
+llm_calls = Counter("personabot_llm_calls_total", "LLM calls (cache hits excluded)", ("node",))
+llm_duration = Histogram("personabot_llm_duration_seconds", "Duration of an LLM call, scheduler queue excluded", DURATION_BUCKETS, ("node",))
+llm_tokens = Histogram("personabot_llm_tokens", "Tokens of an LLM call", TOKEN_BUCKETS, ("node", "kind"))
+query_duration = Histogram("personabot_neo4j_query_duration_seconds", "Duration of a query written by the LLM", DURATION_BUCKETS, ("status",))
+query_rows = Histogram("personabot_neo4j_result_rows", "Rows returned by a query written by the LLM", ROW_BUCKETS)
+query_bytes = Histogram("personabot_neo4j_result_bytes", "Size of the output of a query written by the LLM", BYTE_BUCKETS)
+cache_requests = Counter("personabot_cache_requests_total", "Cache lookups", ("cache", "result"))
+request_duration = Histogram("personabot_request_duration_seconds", "Duration of an HTTP request", DURATION_BUCKETS, ("route",))
+
+METRICS = [node_duration, llm_calls, llm_duration, llm_tokens, query_duration, query_rows, query_bytes, cache_requests, request_duration]
+collectors = [] # functions () -> list of lines, called by render (example: gauges read from the scheduler's stats)
+
+def render():
+    lines = []
+    for metric in METRICS: lines += metric.render()
+    for collector in collectors: lines += collector()
+    return "\n".join(lines) + "\n"
+
+def gauge_lines(name, help_text, value):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+##
+
+class RequestMetrics:
+    """ Measures of one HTTP request """
+
+    def __init__(self, route):
+        self.route = route
+        self.started_at = time.time()
+        self.start_time = time.perf_counter()
+        self.spans = [] # {'node', 'start', 'seconds'}
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def node_seconds(self):
+        """ {node: total seconds} in the order the nodes first ran """
+        totals = {}
+        for span in self.spans: totals[span['node']] = totals.get(span['node'], 0.0) + span['seconds']
+        return totals
+
+    def summary(self):
+        return {
+            'route': self.route, 'seconds': time.perf_counter() - self.start_time, 'nodes': self.node_seconds(), 'llm_calls': self.llm_calls,
+            'prompt_tokens': self.prompt_tokens, 'completion_tokens': self.completion_tokens, 'queries': self.queries,
+            'query_seconds': self.query_seconds, 'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses,
+        }
+
+    def headers(self):
+        """ Server-Timing (durations in ms, shown by the browsers' dev tools) and the counts of the request """
+        timings = [f"total;dur={(time.perf_counter() - self.start_time) * 1000:.1f}"]
+        timings += [f"{node};dur={seconds * 1000:.1f}" for node, seconds in self.node_seconds().items()]
+        if self.queries > 0: timings.append(f"neo4j;dur={self.query_seconds * 1000:.1f}")
+        return {
+            'Server-Timing': ", ".join(timings), 'X-LLM-Calls': str(self.llm_calls), 'X-Prompt-Tokens': str(self.prompt_tokens),
+            'X-Completion-Tokens': str(self.completion_tokens), 'X-Neo4j-Queries': str(self.queries), 'X-Cache-Hits': str(self.cache_hits),
+        }
+
+    ## Observe the request's duration and write its trace
+    def finish(self, path=TRACE_LOG_PATH):
+        request_duration.observe(time.perf_counter() - self.start_time, route=self.route)
+        if not path: return
+        trace = {**self.summary(), 'started_at': self.started_at, 'spans': self.spans}
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace, default=str) + "\n")
+
+##
+
+def instrument_node(name, node):
+    """ Node function of the graph -> same node, timed. The LLM calls and queries made inside it are labelled with its name """
+    # NOTE: not functools.wraps, LangGraph would read the signature of the wrapped function and pass it arguments timed_node does not take
+    async def timed_node(state):
+        token = current_node.set(name)
+        start_time = time.perf_counter()
+        try:
+            return await node(state)
+        finally:
+            seconds = time.perf_counter() - start_time
+            current_node.reset(token)
+            node_duration.observe(seconds, node=name)
+            request = current_request.get()
+            if request is not None: request.spans.append({'node': name, 'start': start_time - request.start_time, 'seconds': seconds})
+    timed_node.__name__ = name
+    return timed_node
+
+def record_llm_call(seconds, prompt_tokens, completion_tokens):
+    node = current_node.get()
+    llm_calls.inc(node=node)
+    llm_duration.observe(seconds, node=node)
+    llm_tokens.observe(prompt_tokens, node=node, kind="prompt")
+    llm_tokens.observe(completion_tokens, node=node, kind="completion")
+    request = current_request.get()
+    if request is not None:
+        request.llm_calls += 1
+        request.prompt_tokens += prompt_tokens
+        request.completion_tokens += completion_tokens
+
+def record_query(seconds, status, rows=None, size=None):
+    query_duration.observe(seconds, status=status)
+    if rows is not None: query_rows.observe(rows)
+    if size is not None: query_bytes.observe(size)
+    request = current_request.get()
+    if request is not None:
+        request.queries += 1
+        request.query_seconds += seconds
+
+def record_cache(cache, hit):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+    request = current_request.get()
+    if request is not None:
+        if hit: request.cache_hits += 1
+        else: request.cache_misses += 1
+
+##
+
+class MeteredChatModel:
+    """ Chat model (or model returned by bind_tools) whose ainvoke calls are recorded with record_llm_call """
+
+    def __init__(self, model):
+        self.model = model
+
+    def bind_tools(self, tools, **kwargs):
+        return MeteredChatModel(self.model.bind_tools(tools, **kwargs))
+
+    async def ainvoke(self, model_input, **kwargs):
+        start_time = time.perf_counter()
+        response = await self.model.ainvoke(model_input, **kwargs)
+        seconds = time.perf_counter() - start_time
+
+        usage = getattr(response, 'usage_metadata', None) or {}
+        prompt_tokens = usage.get('input_tokens')
+        if prompt_tokens is None: prompt_tokens = estimate_tokens(model_input) if isinstance(model_input, str) else sum(map(message_tokens, model_input))
+        completion_tokens = usage.get('output_tokens')
+        if completion_tokens is None: completion_tokens = estimate_tokens(response.content if isinstance(response.content, str) else str(response.content))
+        record_llm_call(seconds, prompt_tokens, completion_tokens)
+        return response
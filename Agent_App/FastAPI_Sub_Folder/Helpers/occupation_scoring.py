@@ -0,0 +1,216 @@
+"""
+In-process scoring of every occupation against a user's profile, used by the recommend_occupations tool.
+
+The edges going out of the Occupation nodes (personality traits, abilities, skills, knowledge) are exported once into a
+SciPy sparse matrix: one row per occupation, one column per node title, weighted by the relation's label:
+    strong_need_for_* = 3, medium_need_for_* = 2, low_need_for_* = 1, any other relation (need_for_personality_trait) = 3
+
+A profile gives a weight to some of these nodes, by title: {'Realistic': 1, 'Investigative': 0.5, 'Mathematics': 1}
+Every occupation is scored in one matrix-vector product: score = sum(relation weight * profile weight) / sum(profile weights),
+so a score of 3 means the occupation strongly needs everything in the profile.
+The top k are returned with the nodes that explain their score.
+
+NOTE: titles are compared without case, spaces, "_" and "-". A title shared by several labels (example: Mathematics is a
+Basic_Skill and a Knowledge) is one column, holding the occupation's strongest relation to any of them, so it counts once.
+"""
+
+import re
+import time
+import asyncio
+import numpy as np
+from pathlib import Path
+from scipy import sparse
+
+RELATION_WEIGHTS = {'strong_': 3.0, 'medium_': 2.0, 'low_': 1.0} # prefix of the relation label: weight
+DEFAULT_RELATION_WEIGHT = 3.0 # relations without a level
+
+# Every edge going out of an Occupation, the same edges the ingestion pipeline writes
+EXPORT_QUERY = """
+MATCH (o:Occupation)-[r]->(n)
+WHERE n.title IS NOT NULL
+RETURN o.title AS occupation, labels(n)[0] AS label, n.title AS title, type(r) AS relation
+"""
+
+##
+
+def normalize_title(title):
+    """ 'Critical Thinking', 'critical_thinking' -> 'critical thinking' """
+    return re.sub(r"[\s_\-]+", " ", str(title)).strip().lower()
+
+def get_relation_weight(relation):
+    for prefix, weight in RELATION_WEIGHTS.items():
+        if relation.startswith(prefix): return weight
+    return DEFAULT_RELATION_WEIGHT
+
+##
+
+def read_edges_from_parquet(folder):
+    """ Edges (occupation, label, title, relation) of the formatted parquet files, when the graph is not available """
+    import pandas as pd
+    edges = []
+    for path in sorted(Path(folder).glob("*.parquet")):
+        df = pd.read_parquet(path, columns=['node_1_value', 'node_2_label', 'node_2_value', 'relation_label'])
+        df['node_2_label'] = df['node_2_label'].astype(str).str.replace(r"[ -]", "_", regex=True) # as create_node writes the labels
+        edges += list(df.astype(str).itertuples(index=False, name=None))
+    return edges
+
+##
+
+class OccupationScorer:
+    """
+    edges: iterable of (occupation, label, title, relation)
+    version: graph data version the edges were read from
+    """
+
+    def __init__(self, edges, version=None):
+        start_time = time.perf_counter()
+        self.version = version
+
+        occupation_ids, feature_ids = {}, {}
+        self.features = [] # title of every column, as first written
+        weights = {} # (occupation id, feature id): weight, the strongest relation is kept if there are several (also across labels)
+        relations = {} # (occupation id, feature id): (label, relation) of the kept weight
+        for occupation, label, title, relation in edges:
+            i = occupation_ids.setdefault(occupation, len(occupation_ids))
+            j = feature_ids.setdefault(normalize_title(title), len(feature_ids))
+            if j == len(self.features): self.features.append(title)
+            weight = get_relation_weight(relation)
+            if weight > weights.get((i, j), 0):
+                weights[(i, j)] = weight
+                relations[(i, j)] = (label, relation)
+
+        self.occupations = np.array(list(occupation_ids.keys()), dtype=object)
+        self.feature_index = feature_ids # normalized title: column
+
+        # The label and relation of every stored weight are kept in a matrix with the same structure, as an index in self.relation_labels
+        self.relation_labels = sorted(set(relations.values()))
+        relation_ids = {relation: i for i, relation in enumerate(self.relation_labels)}
+        rows = np.array([i for i, _ in weights.keys()], dtype=np.int32)
+        columns = np.array([j for _, j in weights.keys()], dtype=np.int32)
+        shape = (len(self.occupations), len(self.features))
+        self.matrix = sparse.csr_matrix((np.array(list(weights.values()), dtype=np.float32), (rows, columns)), shape=shape)
+        self.relations = sparse.csr_matrix((np.array([relation_ids[relations[key]] + 1 for key in weights.keys()], dtype=np.int32), (rows, columns)), shape=shape)
+
+        self.build_seconds = time.perf_counter() - start_time
+        print(f"----- Occupation scorer built: {shape[0]} occupations x {shape[1]} features, {self.matrix.nnz} edges in {self.build_seconds:.2f}s")
+
+    @classmethod
+    def from_parquet(cls, folder):
+        return cls(read_edges_from_parquet(folder))
+
+    ## Profile {title: weight} (or list of titles, weight 1) -> (dense vector over the features, titles that are not in the graph)
+    def profile_vector(self, profile):
+        if not isinstance(profile, dict): profile = {title: 1.0 for title in profile}
+        vector = np.zeros(len(self.features), dtype=np.float32)
+        unknown = []
+        for title, weight in profile.items():
+            column = self.feature_index.get(normalize_title(title))
+            if column is None:
+                unknown.append(title)
+                continue
+            vector[column] = float(weight)
+        return vector, unknown
+
+    def recommend(self, profile, k=6, max_matches=5):
+        """
+        Returns {'recommendations': [...], 'unknown': titles of the profile that are not in the graph}.
+        Every recommendation: {'occupation', 'score', 'matches': [{'label', 'title', 'relation', 'contribution'}, ...]}
+        with the max_matches nodes that contribute the most to its score.
+        """
+        vector, unknown = self.profile_vector(profile)
+        total_weight = vector.sum()
+        if total_weight <= 0: return {'recommendations': [], 'unknown': unknown}
+
+        scores = self.matrix @ vector / total_weight
+
+        # Top k without sorting every score, then sorted by score and title
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = sorted(candidates, key=lambda i: (-scores[i], self.occupations[i]))
+
+        recommendations = []
+        for i in top:
+            start, end = self.matrix.indptr[i], self.matrix.indptr[i + 1]
+            columns = self.matrix.indices[start:end]
+            contributions = self.matrix.data[start:end] * vector[columns] / total_weight
+            order = [n for n in np.argsort(-contributions, kind="stable") if contributions[n] > 0][:max_matches]
+            recommendations.append({
+                'occupation': self.occupations[i], 'score': round(float(scores[i]), 3),
+                'matches': [{'label': self.relation_labels[self.relations.data[start + n] - 1][0], 'title': self.features[columns[n]],
+                             'relation': self.relation_labels[self.relations.data[start + n] - 1][1],
+                             'contribution': round(float(contributions[n]), 3)} for n in order],
+            })
+
+        return {'recommendations': recommendations, 'unknown': unknown}
+
+    def stats(self):
+        return {
+            'occupations': self.matrix.shape[0], 'features': self.matrix.shape[1], 'edges': int(self.matrix.nnz),
+            'bytes': int(self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes + self.relations.data.nbytes),
+            'build_seconds': self.build_seconds, 'data_version': self.version,
+        }
+
+##
+
+def to_rows(result):
+    """
+    Recommendations -> rows in the format of query_graph's outputs: [{'occupation': {'title'}, 'matched': {'title'}, 'relation', 'score'}, ...]
+    so that they are compacted, extracted and plotted like the outputs of a query.
+    """
+    rows = []
+    for recommendation in result['recommendations']:
+        for match in recommendation['matches']:
+            rows.append({'occupation': {'title': recommendation['occupation']}, 'matched': {'title': match['title']},
+                         'relation': match['relation'], 'score': recommendation['score']})
+    return rows
+
+##
+
+class ScorerLoader:
+    """
+    Builds the OccupationScorer on first use and rebuilds it when the graph data version written by the ingestion pipeline changes
+    (see set_data_version in Knowledge_Graph/CSV_to_Knowledge_Graph/graph_functions.py).
+
+    load_edges: coroutine function () -> edges, see OccupationScorer
+    version_getter: coroutine function () -> current graph data version. If None, the scorer is never rebuilt
+    version_check_interval: the version is read at most once every version_check_interval seconds
+    """
+
+    def __init__(self, load_edges, version_getter=None, version_check_interval=30):
+        self.load_edges = load_edges
+        self.version_getter = version_getter
+        self.version_check_interval = version_check_interval
+        self.scorer = None
+        self.version_checked_at = None
+        self.builds = 0
+        self.lock = asyncio.Lock()
+
+    async def get_version(self):
+        if self.version_getter is None: return None
+        try:
+            return await self.version_getter()
+        except Exception as e:
+            print(f"----- Could not read the graph data version, keeping the occupation scorer: {e}")
+            return self.scorer.version if self.scorer is not None else None
+
+    async def aget(self):
+        now = time.monotonic()
+        if self.scorer is not None and (self.version_getter is None or now - self.version_checked_at < self.version_check_interval):
+            return self.scorer
+
+        async with self.lock: # concurrent first calls build it once
+            if self.scorer is not None and now - (self.version_checked_at or 0) < self.version_check_interval:
+                return self.scorer
+            version = await self.get_version()
+            self.version_checked_at = time.monotonic()
+            if self.scorer is None or version != self.scorer.version:
+                if self.scorer is not None: print(f"----- Graph data version changed ({self.scorer.version} -> {version}), rebuilding the occupation scorer")
+                edges = await self.load_edges()
+                self.scorer = await asyncio.to_thread(OccupationScorer, edges, version)
+                self.builds += 1
+            return self.scorer
+
+    ## Rebuild on the next call
+    def invalidate(self):
+        self.scorer = None
@@ -0,0 +1,91 @@
+"""
+Full outputs of the queries of every session, kept out of the LangGraph state.
+
+The LLM only gets a compacted version of a query's output (see result_compaction.py). The full output is needed by the
+local extractor and by the Streamlit graph page, but in the state it would be saved in every checkpoint and sent back in
+every /messages/ response, so the sessions would grow without limit. It is stored here instead, keyed by (session_id, cypher code),
+and the graph page reads it from GET /sessions/{session_id}/graph_outputs.
+
+    - in memory, the least recently used sessions are dropped past max_sessions or max_bytes
+    - a session keeps at most max_bytes_per_session bytes of outputs, its oldest outputs are dropped first
+
+NOTE: an output that was dropped (or lost in a restart) is simply missing: the local extractor then falls back to the LLM on the
+compacted output, and the graph page says the output is no longer available.
+"""
+
+import threading
+from collections import OrderedDict
+
+##
+
+class GraphOutputStore:
+    """
+    max_sessions: maximum number of sessions with outputs
+    max_bytes: maximum total size of the outputs (JSON text) of every session
+    max_bytes_per_session: maximum size of the outputs of one session
+    """
+
+    def __init__(self, max_sessions=1000, max_bytes=256 * 1024 * 1024, max_bytes_per_session=16 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_bytes_per_session = max_bytes_per_session
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict() # session_id: OrderedDict(cypher: output as JSON)
+        self.session_bytes = {} # session_id: size of its outputs
+        self.num_bytes = 0
+        self.evictions = 0
+
+    def remove_output(self, session_id, cypher):
+        output = self.sessions[session_id].pop(cypher)
+        size = len(output.encode("utf-8"))
+        self.session_bytes[session_id] -= size
+        self.num_bytes -= size
+
+    def remove_session(self, session_id):
+        self.sessions.pop(session_id)
+        self.num_bytes -= self.session_bytes.pop(session_id)
+
+    def put(self, session_id, cypher, output):
+        """ output: full output of the query as JSON """
+        size = len(output.encode("utf-8"))
+        if size > self.max_bytes_per_session or size > self.max_bytes: return
+
+        with self.lock:
+            outputs = self.sessions.setdefault(session_id, OrderedDict())
+            self.session_bytes.setdefault(session_id, 0)
+            if cypher in outputs: self.remove_output(session_id, cypher)
+            outputs[cypher] = output
+            self.session_bytes[session_id] += size
+            self.num_bytes += size
+            self.sessions.move_to_end(session_id)
+
+            # Oldest outputs of the session first, then the least recently used sessions
+            while self.session_bytes[session_id] > self.max_bytes_per_session:
+                self.remove_output(session_id, next(iter(outputs)))
+                self.evictions += 1
+            while len(self.sessions) > self.max_sessions or self.num_bytes > self.max_bytes:
+                self.remove_session(next(iter(self.sessions)))
+                self.evictions += 1
+
+    def get(self, session_id, cypher):
+        with self.lock:
+            outputs = self.sessions.get(session_id)
+            if outputs is None: return None
+            self.sessions.move_to_end(session_id)
+            return outputs.get(cypher)
+
+    ## {cypher: output as JSON} of a session, only the given cypher codes if cyphers is not None
+    def get_session(self, session_id, cyphers=None):
+        with self.lock:
+            outputs = self.sessions.get(session_id, {})
+            if cyphers is None: return dict(outputs)
+            return {cypher: outputs[cypher] for cypher in cyphers if cypher in outputs}
+
+    def delete(self, session_id):
+        with self.lock:
+            if session_id in self.sessions: self.remove_session(session_id)
+
+    def stats(self):
+        with self.lock:
+            return {'sessions': len(self.sessions), 'outputs': sum(len(outputs) for outputs in self.sessions.values()), 'bytes': self.num_bytes,
+                    'max_bytes': self.max_bytes, 'evictions': self.evictions}
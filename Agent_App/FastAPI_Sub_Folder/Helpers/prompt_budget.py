@@ -0,0 +1,130 @@
+"""
+Token budget of the prompts sent to the LLM by the agent's nodes.
+
+The system prompt (with the graph's schema) and the node's own instruction are always sent. The rest of the budget goes to
+the most recent messages of the conversation (sliding window). The older messages are replaced by a short summary of what
+the user said, so that the answers given at the start of the personality test are not lost.
+The previous cypher codes are deduplicated by fingerprint and only the most recent ones are kept.
+
+Tokens are estimated locally (no tokenizer to download). The estimate is close enough to keep prompts under a budget.
+"""
+
+import re
+import math
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from FastAPI_Sub_Folder.Helpers.cypher_fingerprint import fingerprint
+
+DEFAULT_BUDGETS = {'personality_scientist': 6000, 'extract_data': 6000, 'recommend_careers': 6000} # tokens per node
+MAX_PREVIOUS_CYPHERS = 8 # per list (good and bad)
+MESSAGE_OVERHEAD = 4 # tokens added by the chat format around every message
+SUMMARY_CHARS_PER_MESSAGE = 200
+SUMMARY_MAX_TOKENS = 500
+
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+##
+
+def estimate_tokens(text):
+    """ About 4 characters per token in English, but never less than the number of words and symbols """
+    if not text: return 0
+    return max(math.ceil(len(text) / 4), len(WORD_PATTERN.findall(text)))
+
+##
+
+def message_text(message):
+    text = message.content if isinstance(message.content, str) else str(message.content)
+    for tool_call in getattr(message, 'tool_calls', None) or []:
+        text += f" {tool_call['name']}({tool_call['args']})"
+    return text
+
+def message_tokens(message):
+    return estimate_tokens(message_text(message)) + MESSAGE_OVERHEAD
+
+##
+
+def dedupe_cyphers(cyphers, max_cyphers=MAX_PREVIOUS_CYPHERS):
+    """ Keep the most recent cypher code of every fingerprint, and only the max_cyphers most recent ones, in their original order """
+    kept, seen = [], set()
+    for cypher in reversed(cyphers):
+        key = fingerprint(cypher)
+        if key in seen: continue
+        seen.add(key)
+        kept.append(cypher)
+        if len(kept) == max_cyphers: break
+    return kept[::-1]
+
+##
+
+def split_history(conversation, budget):
+    """ Returns (kept, dropped): the most recent messages that fit in budget, and the older ones. The last message is always kept """
+    used = 0
+    for i in range(len(conversation) - 1, -1, -1):
+        used += message_tokens(conversation[i])
+        if used > budget and i < len(conversation) - 1:
+            return conversation[i + 1:], conversation[:i + 1]
+    return conversation, []
+
+##
+
+def summarize_messages(messages, max_tokens=SUMMARY_MAX_TOKENS):
+    """ Short summary of what the user said in messages (the most recent first if it does not fit in max_tokens) """
+    lines, used = [], 0
+    for message in reversed(messages):
+        if not isinstance(message, HumanMessage): continue
+        text = " ".join(message_text(message).split())
+        line = f"- {text[:SUMMARY_CHARS_PER_MESSAGE]}{'...' if len(text) > SUMMARY_CHARS_PER_MESSAGE else ''}"
+        tokens = estimate_tokens(line)
+        if used + tokens > max_tokens: break
+        lines.append(line)
+        used += tokens
+
+    if len(lines) == 0: return ""
+    return "Summary of the earlier part of the conversation, what the user said:\n" + "\n".join(lines[::-1])
+
+##
+
+def build_chat_prompt(system, conversation, budget, final_message=None):
+    """
+    Messages sent to a chat node: the system prompt, the conversation's most recent messages that fit in the budget,
+    then final_message (the node's instruction) if given. The dropped messages are summarized in the system prompt.
+
+    Returns (messages, report) where report has the prompt's estimated tokens and what it would have been without a budget.
+    """
+    fixed_tokens = estimate_tokens(system) + MESSAGE_OVERHEAD + (message_tokens(final_message) if final_message is not None else 0)
+    available = max(0, budget - fixed_tokens)
+    summary_tokens = min(SUMMARY_MAX_TOKENS, available // 3)
+    kept, dropped = split_history(conversation, available)
+    if len(dropped) > 0: # make room for the summary
+        kept, dropped = split_history(conversation, available - summary_tokens)
+
+    summary = summarize_messages(dropped, max_tokens=summary_tokens)
+    system_message = SystemMessage(content=f"{system}\n{summary}" if summary else system)
+    messages = [system_message] + kept + ([final_message] if final_message is not None else [])
+
+    report = {
+        'tokens': sum(map(message_tokens, messages)),
+        'tokens_without_budget': fixed_tokens + sum(map(message_tokens, conversation)),
+        'messages': len(kept), 'summarized_messages': len(dropped),
+    }
+    return messages, report
+
+##
+
+def build_conversation_text(conversation, budget):
+    """
+    Conversation as plain text (User: ... / Assistant: ...) for prompts that embed it, limited to budget tokens.
+
+    Returns (text, report). Without a budget, the prompt embedded str(conversation), which also holds every message's metadata.
+    """
+    summary_tokens = min(SUMMARY_MAX_TOKENS, budget // 3)
+    kept, dropped = split_history(conversation, budget)
+    if len(dropped) > 0: # make room for the summary
+        kept, dropped = split_history(conversation, budget - summary_tokens)
+    lines = [summarize_messages(dropped, max_tokens=summary_tokens)] if len(dropped) > 0 else []
+    for message in kept:
+        role = "User" if isinstance(message, HumanMessage) else "Assistant" if isinstance(message, AIMessage) else "System"
+        lines.append(f"{role}: {message_text(message)}")
+    text = "\n".join([line for line in lines if line])
+
+    report = {'tokens': estimate_tokens(text), 'tokens_without_budget': estimate_tokens(str(conversation)), 'messages': len(kept), 'summarized_messages': len(dropped)}
+    return text, report
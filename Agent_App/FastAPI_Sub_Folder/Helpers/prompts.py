@@ -13,13 +13,15 @@ ex: MATCH (n:label_1)-[]->(m:label_2) return n,m
 not: MATCH (n:label_1)-[]->(m:label_2) WHERE m.title='whatever' return n,m
 """
 
+scoring_tool = "Scoring tool: instead of querying the graph, you can call recommend_occupations with the personality traits (and skills, abilities or knowledge) you found, weighted from 0 to 1. It scores every occupation of the graph at once and returns the best ones with what explains their score."
+
 output = "Your final output: Interpret all the queried data, choose up to 6 suitable careers for me, list them in bullet points and include a brief explanation of how each path suites my personality. Include Cypher code in your answer."
 
 tone = "Output's tone: Make your output friendly, fun and easy to read."
 
 reminder = "Summary of your task: You will conduct a personality test then query the graph when needed to supplement your suggestions. The graph is your reference. If Property Values: empty, you will not use 'WHERE' or try to specify property values inside your Cypher code. Under no circumstances should you use 'DELETE'. Find the occupations that suite my character and give me personalized suggestions. Make sure to keep your answers concise and straight to the point."
 
-personality_scientist_prompt = f"{task}\ {schema_context}\ {property_values}\ {query_approach}\ {output}\ {tone}\ {reminder}"
+personality_scientist_prompt = f"{task}\ {schema_context}\ {property_values}\ {query_approach}\ {scoring_tool}\ {output}\ {tone}\ {reminder}"
 
 # Prompt given to the model to extract data from the returned query output
 extractor_prompt = "You have now queried the graph.\
@@ -0,0 +1,204 @@
+"""
+Process-wide cache of the query_graph tool's outputs, shared by every conversation.
+
+Most users reach the recommendation step with nearly the same queries (example: MATCH (o:Occupation)-[]->(p:Personality_Trait) ...).
+The outputs are cached by the fingerprint of the query (see cypher_fingerprint.py), so equivalent queries written differently share an entry.
+
+    - LRU eviction, bounded by the number of entries and by the size of the outputs in bytes
+    - every entry expires after ttl seconds
+    - hit, miss and eviction counters
+    - concurrent misses on the same query run it once: the other callers wait for the output of the first one
+    - the whole cache is cleared when the graph data version written by the ingestion pipeline changes
+      (see set_data_version in Knowledge_Graph/CSV_to_Knowledge_Graph/graph_functions.py)
+"""
+
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from collections import OrderedDict
+from FastAPI_Sub_Folder.Helpers.cypher_fingerprint import fingerprint
+from FastAPI_Sub_Folder.Helpers.metrics import record_cache
+
+DATA_VERSION_LABEL = "Graph_Data_Version" # same label as in graph_functions.py
+DATA_VERSION_QUERY = f"MATCH (v:{DATA_VERSION_LABEL}) RETURN v.version AS version"
+
+##
+
+async def get_data_version(run_query):
+    """ Returns the data version written by the ingestion pipeline, or None if the graph does not have one. run_query: coroutine function (query) -> rows """
+    output = await run_query(DATA_VERSION_QUERY)
+    return output[0]['version'] if len(output) > 0 else None
+
+##
+
+def get_size(value):
+    """ Size in bytes of an output, as the agent stores it (str) """
+    return len(str(value).encode("utf-8"))
+
+##
+
+class QueryResultCache:
+    """
+    max_entries: maximum number of cached queries
+    max_bytes: maximum total size of the cached outputs
+    ttl: seconds after which an entry expires (None: never)
+    version_getter: coroutine function () -> current graph data version. If None, the cache is never invalidated by the graph
+    version_check_interval: the version is read at most once every version_check_interval seconds, by aget_or_run
+
+    NOTE: outputs are returned as they were stored, they should not be modified by the caller.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=3600, version_getter=None, version_check_interval=30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_getter = version_getter
+        self.version_check_interval = version_check_interval
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # fingerprint: (output, size, expires_at)
+        self.in_flight = {} # fingerprint: Future of the output, for the queries running now
+        self.num_bytes = 0
+        self.version = None
+        self.version_checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.coalesced = 0
+
+    def version_check_due(self):
+        if self.version_getter is None: return False
+        return self.version_checked_at is None or time.monotonic() - self.version_checked_at >= self.version_check_interval
+
+    ## Clear the cache if the graph data version changed since the last check
+    async def check_version(self, force=False):
+        if self.version_getter is None: return
+        if not force and not self.version_check_due(): return
+        now = time.monotonic()
+
+        try:
+            version = await self.version_getter()
+        except Exception as e:
+            print(f"----- Could not read the graph data version, keeping the cache: {e}")
+            self.version_checked_at = now # try again after version_check_interval
+            return
+
+        with self.lock:
+            if self.version_checked_at is not None and version != self.version:
+                print(f"----- Graph data version changed ({self.version} -> {version}), clearing the query cache")
+                self.clear_entries()
+                self.invalidations += 1
+            self.version = version
+            self.version_checked_at = now
+
+    def clear_entries(self):
+        self.entries.clear()
+        self.num_bytes = 0
+
+    def clear(self):
+        with self.lock:
+            self.clear_entries()
+
+    def remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.num_bytes -= size
+
+    ## Returns (True, output) on a hit and (False, None) on a miss. NOTE: the data version is only checked by aget_or_run
+    def get(self, query):
+        key = fingerprint(query)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and entry[2] < time.monotonic():
+                self.remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                record_cache("query", False)
+                return False, None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            record_cache("query", True)
+            return True, entry[0]
+
+    def set(self, query, output):
+        key = fingerprint(query)
+        size = get_size(output)
+        if size > self.max_bytes: return # would evict everything else
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries: self.remove(key)
+            self.entries[key] = (output, size, expires_at)
+            self.num_bytes += size
+
+            # Evict the least recently used entries
+            while len(self.entries) > self.max_entries or self.num_bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    ## Returns (future, is_leader). The leader runs the query and sets the future's result, the others wait for it
+    def join(self, query):
+        key = fingerprint(query)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self.in_flight[key] = future
+            return future, True
+
+    def finish(self, query, future, output=None, error=None):
+        with self.lock:
+            self.in_flight.pop(fingerprint(query), None)
+        if error is not None: future.set_exception(error)
+        else: future.set_result(output)
+
+    ## Returns the cached output of a query, or runs it with run_query and caches its output
+    def get_or_run(self, query, run_query):
+        hit, output = self.get(query)
+        if hit: return output
+
+        future, is_leader = self.join(query)
+        if not is_leader: return future.result()
+        try:
+            output = run_query(query)
+        except BaseException as e: # the callers waiting for this query get the same error
+            self.finish(query, future, error=e)
+            raise
+        self.set(query, output)
+        self.finish(query, future, output=output)
+        return output
+
+    ## Async version of get_or_run, that also clears the cache when the graph data version changed. run_query is a coroutine function
+    async def aget_or_run(self, query, run_query):
+        await self.check_version()
+        hit, output = self.get(query)
+        if hit: return output
+
+        future, is_leader = self.join(query)
+        if not is_leader: return await asyncio.wrap_future(future)
+        try:
+            output = await run_query(query)
+        except BaseException as e: # also a cancelled run, so the callers waiting for it do not wait forever
+            self.finish(query, future, error=e)
+            raise
+        self.set(query, output)
+        self.finish(query, future, output=output)
+        return output
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries), 'bytes': self.num_bytes, 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(),
+                'evictions': self.evictions, 'invalidations': self.invalidations, 'coalesced': self.coalesced, 'data_version': self.version,
+            }
@@ -0,0 +1,159 @@
+"""
+Guard in front of the query_graph tool. The LLM writes the Cypher code and is not allowed to use LIMIT, so one bad query
+(example: MATCH (n), (m) RETURN n, m) could keep Neo4j busy for every session.
+
+Before a query runs, its plan is read with EXPLAIN (nothing is executed) and the query is rejected if:
+    - it writes to the graph (the query type is not read-only)
+    - its plan has a cartesian product, or scans every node of the graph
+    - the planner estimates more than max_estimated_rows rows
+An accepted query runs in a read transaction with a timeout, and only its first max_rows rows are read. The rows are returned
+as QueryRows, whose truncated flag says if the query returned more (the compacted output given to the LLM then says so).
+
+A rejection raises QueryRejected. Its to_output() is given to the agent instead of the query's output, so the LLM can fix its query.
+"""
+
+import neo4j
+
+WRITE_OPERATORS = {'Create', 'Merge', 'Delete', 'DetachDelete', 'SetProperty', 'SetNodeProperty', 'SetRelationshipProperty', 'SetLabels',
+                   'RemoveLabels', 'SetPropertiesFromMap', 'SetNodePropertiesFromMap', 'SetRelationshipPropertiesFromMap', 'LoadCSV'}
+REJECTED_OPERATORS = {
+    'CartesianProduct': ("cartesian_product", "The query matches patterns that are not connected to each other, so every combination of their rows is returned. "
+                                              "Connect the patterns with a relationship, example: MATCH (o:Occupation)-[]->(p:Personality_Trait)."),
+    'AllNodesScan': ("all_nodes_scan", "The query reads every node of the graph. Give every node in the MATCH a label, example: (o:Occupation)."),
+}
+
+##
+
+class QueryRejected(Exception):
+    """ reason: short code of the rejection (example: cartesian_product), message: what the LLM should change """
+
+    def __init__(self, reason, message, estimated_rows=None):
+        super().__init__(f"{reason}: {message}")
+        self.reason = reason
+        self.message = message
+        self.estimated_rows = estimated_rows
+
+    def to_output(self):
+        return {'error': 'query_rejected', 'reason': self.reason, 'message': self.message, 'estimated_rows': self.estimated_rows}
+
+def is_rejection(output):
+    return isinstance(output, dict) and output.get('error') == 'query_rejected'
+
+class QueryRows(list):
+    """ Rows of an accepted query. truncated: the query returned more rows, only these ones were read """
+
+    def __init__(self, rows=(), truncated=False):
+        super().__init__(rows)
+        self.truncated = truncated
+
+def is_truncated(output):
+    return getattr(output, 'truncated', False)
+
+##
+
+def get_operator(plan):
+    """ 'CartesianProduct@neo4j' -> 'CartesianProduct' """
+    return plan.get('operatorType', '').split('@')[0]
+
+def get_estimated_rows(plan):
+    arguments = plan.get('args', plan.get('arguments', {})) # 'args' over Bolt, 'arguments' over HTTP
+    return arguments.get('EstimatedRows')
+
+def iter_operators(plan):
+    yield plan
+    for child in plan.get('children', []):
+        yield from iter_operators(child)
+
+##
+
+def check_plan(plan, query_type="r", max_estimated_rows=200000):
+    """
+    plan: plan of the EXPLAIN summary ({'operatorType', 'args', 'children', ...}), query_type: type of the EXPLAIN summary ('r' is read-only)
+    Raises QueryRejected if the query should not run. Returns the estimated rows of the query.
+    """
+    estimated_rows = get_estimated_rows(plan) if plan is not None else None
+
+    if query_type not in [None, "r"] or any(get_operator(operator) in WRITE_OPERATORS for operator in iter_operators(plan or {})):
+        raise QueryRejected("write_query", "Only read queries are allowed. Use MATCH and RETURN without CREATE, MERGE, SET, REMOVE or DELETE.", estimated_rows)
+
+    for operator in iter_operators(plan or {}):
+        if get_operator(operator) in REJECTED_OPERATORS:
+            reason, message = REJECTED_OPERATORS[get_operator(operator)]
+            raise QueryRejected(reason, message, estimated_rows)
+
+    if estimated_rows is not None and estimated_rows > max_estimated_rows:
+        raise QueryRejected("too_many_rows", f"The query would return about {int(estimated_rows)} rows (maximum {max_estimated_rows}). "
+                                             f"Return fewer nodes, or aggregate them with count() or collect().", estimated_rows)
+
+    return estimated_rows
+
+##
+
+class QueryGuard:
+    """
+    get_driver: function () -> neo4j async driver
+    timeout: seconds after which Neo4j stops an accepted query
+    max_rows: rows read from an accepted query, the others are dropped
+    max_estimated_rows: queries estimated to return more rows are rejected
+    """
+
+    def __init__(self, get_driver, timeout=10, max_rows=10000, max_estimated_rows=200000):
+        self.get_driver = get_driver
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_estimated_rows = max_estimated_rows
+        self.rejections = {} # reason: count
+        self.truncations = 0
+
+    ## Returns (plan, query_type) of the query, without running it
+    async def explain(self, query):
+        async with self.get_driver().session(default_access_mode=neo4j.READ_ACCESS) as session:
+            result = await session.run(f"EXPLAIN {query}")
+            summary = await result.consume()
+        return summary.plan, summary.query_type
+
+    async def check(self, query):
+        try:
+            plan, query_type = await self.explain(query)
+        except neo4j.exceptions.CypherSyntaxError as e:
+            raise QueryRejected("syntax_error", e.message)
+        return check_plan(plan, query_type, self.max_estimated_rows)
+
+    ## Same rows as Neo4jGraph.query (as QueryRows, with the truncated flag), for an accepted query. Raises QueryRejected otherwise
+    async def run(self, query):
+        query = query.strip().rstrip(";")
+        if query.upper().startswith(("EXPLAIN ", "PROFILE ")): query = query.split(None, 1)[1]
+        try:
+            await self.check(query)
+        except QueryRejected as e:
+            self.rejections[e.reason] = self.rejections.get(e.reason, 0) + 1
+            print(f"----- Query rejected ({e.reason}): {query}")
+            raise
+
+        ## Reads one row more than max_rows: a result of exactly max_rows rows is not truncated
+        @neo4j.unit_of_work(timeout=self.timeout)
+        async def read_rows(tx):
+            result = await tx.run(query)
+            rows = []
+            async for record in result:
+                rows.append(record.data())
+                if len(rows) > self.max_rows: break # the rest of the result is discarded
+            return rows
+
+        try:
+            async with self.get_driver().session(default_access_mode=neo4j.READ_ACCESS) as session:
+                rows = await session.execute_read(read_rows)
+        except neo4j.exceptions.ClientError as e:
+            if "TransactionTimedOut" in (e.code or "") or "Terminated" in (e.code or ""):
+                self.rejections['timeout'] = self.rejections.get('timeout', 0) + 1
+                raise QueryRejected("timeout", f"The query took more than {self.timeout} seconds. Match fewer nodes or relationships.")
+            raise
+
+        if len(rows) <= self.max_rows: return QueryRows(rows)
+        self.truncations += 1
+        print(f"----- Query returned more than {self.max_rows} rows, only the first {self.max_rows} are kept")
+        return QueryRows(rows[:self.max_rows], truncated=True)
+
+    def stats(self):
+        return {'rejections': dict(self.rejections), 'truncations': self.truncations, 'timeout': self.timeout,
+                'max_rows': self.max_rows, 'max_estimated_rows': self.max_estimated_rows}
@@ -0,0 +1,73 @@
+"""
+Compaction of the query_graph outputs before they reach the LLM.
+
+A query like MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o, p returns hundreds of rows of full node dicts
+with the same keys repeated on every row. The LLM only needs the titles, so the rows are:
+    - projected: a node {'title': 'Baristas', ...} becomes Baristas
+    - deduplicated, keeping the order of the first occurrences
+    - written as a table: one header line, then one line per row
+    - cut at max_rows rows and max_bytes bytes, with a note saying how much was left out
+    - when the query guard only read part of the result (see query_guard.py), a note says so
+
+The full output is kept separately for the Streamlit graph page.
+"""
+
+MAX_ROWS = 200
+MAX_BYTES = 16000
+SEPARATOR = " | "
+
+##
+
+def project_value(value):
+    """ Node or relation dict -> its title (or its properties written compactly), list -> its projected items """
+    if isinstance(value, dict):
+        if 'title' in value: return str(value['title'])
+        return "{" + ", ".join([f"{key}: {project_value(item)}" for key, item in value.items()]) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join([project_value(item) for item in value]) + "]"
+    return str(value)
+
+##
+
+def get_columns(rows):
+    """ Keys of every row, in the order they first appear """
+    columns = []
+    for row in rows:
+        columns += [key for key in row.keys() if key not in columns]
+    return columns
+
+##
+
+def compact_output(output, max_rows=MAX_ROWS, max_bytes=MAX_BYTES, read_truncated=False):
+    """
+    output: list of row dicts, as returned by query_graph
+    read_truncated: the query returned more rows than output has (the query guard stopped reading them)
+
+    Returns (text, info) where text is the table given to the LLM and info has the number of rows, unique rows and rows shown.
+    """
+    if not isinstance(output, list) or not all(isinstance(row, dict) for row in output):
+        text = str(output)
+        return text[:max_bytes], {'rows': None, 'unique_rows': None, 'shown_rows': None, 'truncated': len(text) > max_bytes, 'read_truncated': read_truncated}
+
+    columns = get_columns(output)
+    unique_rows = list(dict.fromkeys([tuple(project_value(row.get(column)) for column in columns) for row in output]))
+
+    lines = [SEPARATOR.join(columns)]
+    size = len(lines[0].encode("utf-8"))
+    for row in unique_rows[:max_rows]:
+        line = SEPARATOR.join(row)
+        size += len(line.encode("utf-8")) + 1
+        if size > max_bytes: break
+        lines.append(line)
+
+    shown_rows = len(lines) - 1
+    info = {'rows': len(output), 'unique_rows': len(unique_rows), 'shown_rows': shown_rows, 'truncated': shown_rows < len(unique_rows),
+            'read_truncated': read_truncated}
+    if info['truncated']:
+        lines.append(f"[truncated: {shown_rows} of {len(unique_rows)} unique rows shown ({len(output)} rows returned). "
+                     f"Filter or aggregate in the cypher code to see the rest.]")
+    if read_truncated:
+        lines.append(f"[truncated: the query returned more than {len(output)} rows, only the first {len(output)} were read. "
+                     f"Filter or aggregate in the cypher code to see the rest.]")
+
+    return "\n".join(lines), info
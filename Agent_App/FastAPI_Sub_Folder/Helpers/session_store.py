@@ -0,0 +1,156 @@
+"""
+Session stores (LangGraph checkpointers) of the agent. Every session_id of the /messages/ API is one LangGraph thread.
+
+    - BoundedMemorySaver: in memory, with LRU eviction past max_sessions and a TTL on inactive sessions
+    - CompactingSqliteSaver: SQLite file, so sessions survive a restart (needs the langgraph-checkpoint-sqlite package)
+
+Both only keep the latest checkpoint of every thread: after every step, the previous checkpoints and their writes are deleted.
+The agent never goes back to a previous checkpoint, so this does not change its behavior.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from langgraph.checkpoint.memory import MemorySaver
+
+# Optional dependency: only needed for the SQLite store
+try:
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+except ImportError:
+    aiosqlite = None
+    AsyncSqliteSaver = object
+
+##
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    max_sessions: maximum number of threads kept, the least recently used ones are deleted first
+    ttl: seconds after which an inactive thread is deleted (None: never)
+    """
+
+    def __init__(self, max_sessions=1000, ttl=24 * 3600):
+        super().__init__()
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.last_used = OrderedDict() # thread_id: time of its last use
+        self.evictions = 0
+
+    ## Delete the expired threads and the least recently used ones past max_sessions
+    def evict(self):
+        now = time.monotonic()
+        while len(self.last_used) > 0:
+            thread_id, last_used = next(iter(self.last_used.items()))
+            if len(self.last_used) > self.max_sessions or (self.ttl is not None and now - last_used > self.ttl):
+                self.delete_thread(thread_id)
+                self.evictions += 1
+            else:
+                break
+
+    def touch(self, thread_id):
+        self.last_used[thread_id] = time.monotonic()
+        self.last_used.move_to_end(thread_id)
+        self.evict()
+
+    ## Delete the checkpoints of a thread older than checkpoint, their writes, and the channel values that checkpoint does not use
+    def compact(self, thread_id, checkpoint_ns, checkpoint):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [checkpoint_id for checkpoint_id in checkpoints if checkpoint_id != checkpoint['id']]:
+            old_checkpoint = self.serde.loads_typed(checkpoints.pop(checkpoint_id)[0])
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            for channel, version in old_checkpoint['channel_versions'].items():
+                if checkpoint['channel_versions'].get(channel) != version:
+                    self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+
+    def get_tuple(self, config):
+        self.evict()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_tuple = super().get_tuple(config)
+        if thread_id in self.storage: self.touch(thread_id)
+        return checkpoint_tuple
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        self.compact(next_config["configurable"]["thread_id"], next_config["configurable"]["checkpoint_ns"], checkpoint)
+        self.touch(next_config["configurable"]["thread_id"])
+        return next_config
+
+    def delete_thread(self, thread_id):
+        super().delete_thread(thread_id)
+        self.last_used.pop(thread_id, None)
+
+    ## Size of the serialized checkpoints, writes and channel values
+    def stats(self):
+        num_checkpoints, num_bytes = 0, 0
+        for namespaces in self.storage.values():
+            for checkpoints in namespaces.values():
+                for checkpoint, metadata, _ in checkpoints.values():
+                    num_checkpoints += 1
+                    num_bytes += len(checkpoint[1]) + len(metadata[1])
+        num_bytes += sum(len(write[2][1]) for writes in self.writes.values() for write in writes.values())
+        num_bytes += sum(len(blob[1]) for blob in self.blobs.values())
+
+        return {
+            'store': 'memory', 'sessions': len(self.storage), 'checkpoints': num_checkpoints, 'bytes': num_bytes,
+            'max_sessions': self.max_sessions, 'ttl': self.ttl, 'evictions': self.evictions,
+        }
+
+    async def astats(self):
+        return self.stats()
+
+    async def aclose(self):
+        pass
+
+##
+
+class CompactingSqliteSaver(AsyncSqliteSaver):
+    """ AsyncSqliteSaver that only keeps the latest checkpoint of every thread. NOTE: it must be created inside the event loop """
+
+    def __init__(self, conn, path):
+        super().__init__(conn)
+        self.path = path
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        key = (next_config["configurable"]["thread_id"], next_config["configurable"]["checkpoint_ns"], checkpoint['id'])
+        async with self.lock:
+            await self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?", key)
+            await self.conn.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?", key)
+            await self.conn.commit()
+        return next_config
+
+    async def astats(self):
+        await self.setup()
+        async with self.lock:
+            async with self.conn.execute("SELECT COUNT(DISTINCT thread_id), COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints") as cursor:
+                num_sessions, num_checkpoints, num_bytes = await cursor.fetchone()
+            async with self.conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes") as cursor:
+                num_bytes += (await cursor.fetchone())[0]
+
+        return {
+            'store': 'sqlite', 'sessions': num_sessions, 'checkpoints': num_checkpoints, 'bytes': num_bytes,
+            'file_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    async def aclose(self):
+        await self.conn.close()
+
+##
+
+async def create_checkpointer(kind="memory", path="sessions.sqlite", max_sessions=1000, ttl=24 * 3600):
+    """
+    kind: "memory" (BoundedMemorySaver) or "sqlite" (CompactingSqliteSaver)
+    path: SQLite file, only used by the sqlite store
+    max_sessions, ttl: only used by the memory store
+    """
+    if kind == "memory":
+        return BoundedMemorySaver(max_sessions=max_sessions, ttl=ttl)
+
+    if kind == "sqlite":
+        if aiosqlite is None:
+            raise ImportError("The sqlite session store needs the langgraph-checkpoint-sqlite package: pip install langgraph-checkpoint-sqlite")
+        checkpointer = CompactingSqliteSaver(await aiosqlite.connect(path), path=path)
+        await checkpointer.setup()
+        return checkpointer
+
+    raise ValueError(f"Unknown session store: {kind}. Use 'memory' or 'sqlite'")
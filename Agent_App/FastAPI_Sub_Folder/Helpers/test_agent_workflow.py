@@ -0,0 +1,132 @@
+"""
+Concurrency tests of the agent, with a fake chat model and fake graph tools (no Groq, no Neo4j).
+    - the tool calls of one turn run at the same time
+    - the CPU work on a large query output (compaction, local extraction) does not block the other sessions
+And the state kept for the LLM: full outputs out of the state, calls to the other tools out of the cypher lists.
+"""
+
+import json
+import time
+import asyncio
+import pytest
+from langchain_core.tools import tool
+from langchain_core.messages import AIMessage, HumanMessage
+from FastAPI_Sub_Folder.Helpers import agent_workflow
+
+QUERIES = ["MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o, p", "MATCH (o:Occupation)-[]->(s:Basic_Skill) RETURN o, s"]
+QUICK_MESSAGE = "quick question"
+
+##
+
+class FakeChatModel:
+    """
+    Answers after latency seconds (quick_latency for the conversations starting with QUICK_MESSAGE).
+    Asks for every query of QUERIES on the first call of a turn, unless the user sent QUICK_MESSAGE
+    """
+
+    def __init__(self, latency=0.01, quick_latency=0.01):
+        self.latency = latency
+        self.quick_latency = quick_latency
+
+    def bind_tools(self, tools):
+        return self
+
+    async def ainvoke(self, messages):
+        if isinstance(messages, str): # extractor prompt
+            await asyncio.sleep(self.latency)
+            return AIMessage(content="Realistic: high")
+
+        human_messages = [message for message in messages if isinstance(message, HumanMessage)]
+        if human_messages[0].content == QUICK_MESSAGE:
+            await asyncio.sleep(self.quick_latency)
+            return AIMessage(content="Here are careers that suit you")
+
+        await asyncio.sleep(self.latency)
+        if any(isinstance(message, AIMessage) and len(message.tool_calls) > 0 for message in messages):
+            return AIMessage(content="Here are careers that suit you")
+        return AIMessage(content="Querying", tool_calls=[{'name': 'query_graph', 'args': {'query': query}, 'id': f"call_{i}"} for i, query in enumerate(QUERIES)])
+
+def make_fake_graph_tool(latency, intervals):
+    """ query_graph tool answering after latency seconds. Appends (start, end) of every call to intervals """
+    @tool("query_graph")
+    async def query_graph(query):
+        """Query from Neo4j knowledge graph using Cypher."""
+        start_time = time.perf_counter()
+        await asyncio.sleep(latency)
+        intervals.append((start_time, time.perf_counter()))
+        return [{'o': {'title': f"Occupation {i}"}, 'p': {'title': "Realistic"}} for i in range(100)]
+    return query_graph
+
+async def run_turn(agent, thread_id, message):
+    config = {"configurable": {"thread_id": thread_id}}
+    start_time = time.perf_counter()
+    await agent.graph.ainvoke({"conversation": [HumanMessage(content=message)], "graph_data_to_be_used": []}, config)
+    return time.perf_counter() - start_time
+
+##
+
+def test_tool_calls_of_a_turn_overlap():
+    intervals = []
+    agent = agent_workflow.Agent(model=FakeChatModel(), tools=[make_fake_graph_tool(0.2, intervals)], system="system prompt")
+    seconds = asyncio.run(run_turn(agent, "overlap", "Recommend me a career"))
+
+    assert len(intervals) == 2
+    (start_1, end_1), (start_2, end_2) = intervals
+    assert start_1 < end_2 and start_2 < end_1 # both were running at the same time
+    assert seconds < 0.38
+
+@pytest.mark.parametrize("slow_function", ["compact_output", "extract_locally"])
+def test_slow_session_does_not_block_another_session(monkeypatch, slow_function):
+    # The CPU work on the output takes 0.5s (time.sleep: blocking, like CPU work). It must not run on the event loop
+    original = getattr(agent_workflow, slow_function)
+    def slow(*args, **kwargs):
+        time.sleep(0.5)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(agent_workflow, slow_function, slow)
+
+    # The quick session waits 0.3s for the LLM while the slow session is in the slow function (from about 0.02s to 0.52s)
+    agent = agent_workflow.Agent(model=FakeChatModel(latency=0.01, quick_latency=0.3), tools=[make_fake_graph_tool(0.01, [])], system="system prompt",
+                                 local_extraction=True)
+
+    async def main():
+        slow_turn = asyncio.create_task(run_turn(agent, "slow", "Recommend me a career"))
+        quick_seconds = await run_turn(agent, "quick", QUICK_MESSAGE)
+        return quick_seconds, slow_turn.done(), await slow_turn
+
+    quick_seconds, slow_done, slow_seconds = asyncio.run(main())
+    assert slow_seconds >= 0.5
+    assert not slow_done # the quick session finished first
+    assert quick_seconds < 0.45
+
+##
+
+def test_full_outputs_are_kept_out_of_the_state():
+    agent = agent_workflow.Agent(model=FakeChatModel(), tools=[make_fake_graph_tool(0.01, [])], system="system prompt")
+    asyncio.run(run_turn(agent, "session", "Recommend me a career"))
+
+    state = agent.graph.get_state({"configurable": {"thread_id": "session"}}).values
+    assert 'graph_outputs' not in state
+    assert sorted(state['good_cypher_and_outputs'].keys()) == sorted(QUERIES)
+    outputs = agent.output_store.get_session("session")
+    assert sorted(outputs.keys()) == sorted(QUERIES)
+    assert len(json.loads(outputs[QUERIES[0]])) == 100
+    assert agent.output_store.get_session("other session") == {}
+
+##
+
+@tool("recommend_occupations")
+async def empty_recommend_occupations(profile: dict[str, float], k: int = 6):
+    """Score every occupation against the user's profile."""
+    return []
+
+def test_other_tools_are_kept_out_of_the_cypher_lists():
+    agent = agent_workflow.Agent(model=FakeChatModel(), tools=[make_fake_graph_tool(0.01, []), empty_recommend_occupations], system="system prompt")
+    tool_call = {'name': 'recommend_occupations', 'args': {'profile': {'Juggling': 1}}, 'id': "call_0"}
+    status, key, output = asyncio.run(agent.run_tool_call(tool_call, {}, {}))
+    assert status == "no_output" and output is None
+
+    scorer_key = agent.get_tool_call_key({**tool_call, 'args': {'profile': {'Realistic': 1}}})
+    state = {'bad_cypher': [key, "MATCH (o:Occupations) RETURN o"], 'query_errors': {}, 'good_cypher_and_outputs': {scorer_key: "table", QUERIES[0]: "table"}}
+    previous_cyphers = agent.get_previous_cyphers(state)
+    assert "recommend_occupations" not in previous_cyphers
+    assert "MATCH (o:Occupations) RETURN o" in previous_cyphers and QUERIES[0] in previous_cyphers
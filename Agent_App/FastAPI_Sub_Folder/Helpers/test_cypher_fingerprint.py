@@ -0,0 +1,55 @@
+""" Tests of the canonical form and fingerprint of the Cypher queries """
+
+from FastAPI_Sub_Folder.Helpers.cypher_fingerprint import canonicalize, fingerprint, signature
+
+##
+
+def test_formatting_and_variable_names_do_not_change_the_fingerprint():
+    assert fingerprint("MATCH (o:Occupation)-[r]->(p:Personality_Trait) RETURN o, p") == \
+           fingerprint("match (job:Occupation) -[rel]-> (trait:Personality_Trait)\n// traits\nreturn job,trait;")
+
+def test_order_of_patterns_properties_and_return_items_does_not_change_the_fingerprint():
+    assert fingerprint("MATCH (o:Occupation {title: 'Poets', zone: 3}), (p:Skill) RETURN o, p") == \
+           fingerprint('MATCH (p:Skill), (o:Occupation {zone: 3, title: "Poets"}) RETURN p, o')
+
+def test_reversed_relationship_has_the_same_fingerprint():
+    assert fingerprint("MATCH (o:Occupation)-[:requires]->(s:Skill) RETURN o") == fingerprint("MATCH (s:Skill)<-[:requires]-(o:Occupation) RETURN o")
+
+def test_different_queries_have_different_fingerprints():
+    assert fingerprint("MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o") != fingerprint("MATCH (o:Occupation)-[]->(p:Basic_Skill) RETURN o")
+    assert fingerprint("MATCH (o:Occupation)-[]->(s:Skill) RETURN o") != fingerprint("MATCH (o:Occupation)<-[]-(s:Skill) RETURN o")
+
+##
+
+def test_label_alternatives_and_label_conjunctions_do_not_collide():
+    # (n:A|B) matches nodes with either label, (n:A:B) only the nodes with both
+    assert fingerprint("MATCH (n:A|B) RETURN n") != fingerprint("MATCH (n:A:B) RETURN n")
+    assert fingerprint("MATCH (n:A|B) RETURN n") == fingerprint("MATCH (n:B|A) RETURN n")
+    assert fingerprint("MATCH (n:A:B) RETURN n") == fingerprint("MATCH (n:B:A) RETURN n")
+    assert canonicalize("MATCH (n:B|A) RETURN n") == "MATCH (v0:A|B) RETURN v0"
+
+def test_relationship_type_alternatives():
+    assert fingerprint("MATCH (a)-[:R2|R1]->(b) RETURN a") == fingerprint("MATCH (a)-[:R1|:R2]->(b) RETURN a")
+    assert fingerprint("MATCH (a)-[:R1|R2]->(b) RETURN a") != fingerprint("MATCH (a)-[:R1]->(b) RETURN a")
+
+def test_labels_of_a_variable_are_merged_across_patterns():
+    assert fingerprint("MATCH (o:Occupation), (o)-->(p:Skill) RETURN o") == fingerprint("MATCH (o:Occupation)-->(p:Skill) RETURN o")
+
+def test_match_clauses_are_not_merged():
+    # relationship uniqueness only applies inside one MATCH: with two clauses r1 and r2 can be the same relationship
+    two_clauses = "MATCH (o:Occupation)-[r1]->(p:Personality_Trait) MATCH (o)-[r2]->(q:Personality_Trait) RETURN o, p, q"
+    assert fingerprint(two_clauses) != fingerprint("MATCH (o:Occupation)-[r1]->(p:Personality_Trait), (o)-[r2]->(q:Personality_Trait) RETURN o, p, q")
+    assert fingerprint(two_clauses) == fingerprint("match (job:Occupation)-->(a:Personality_Trait) match (job)-->(b:Personality_Trait) return job, a, b")
+
+def test_returned_paths_keep_their_direction():
+    # the nodes of p are returned in the order the path is written
+    assert fingerprint("MATCH p=(o:Occupation)-[:x]->(t) RETURN p") != fingerprint("MATCH p=(t)<-[:x]-(o:Occupation) RETURN p")
+    assert fingerprint("MATCH (o:Occupation)-[:x]->(t) RETURN o, t") == fingerprint("MATCH (t)<-[:x]-(o:Occupation) RETURN o, t")
+
+##
+
+def test_unparsable_query_still_gets_a_fingerprint():
+    assert fingerprint("MATCH (o:Occupation RETURN o") == fingerprint("MATCH  (o:Occupation  RETURN o")
+
+def test_signature_lists_labels_and_types():
+    assert signature("MATCH (o:Occupation)-[:requires|needs]->(s:Skill) RETURN o") == {'Occupation', 'requires', 'needs', 'Skill'}
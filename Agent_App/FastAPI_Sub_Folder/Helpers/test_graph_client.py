@@ -0,0 +1,73 @@
+""" Tests of the shared Neo4j client and the schema snapshot, with a fake run_query (no Neo4j) """
+
+import asyncio
+import pytest
+from FastAPI_Sub_Folder.Helpers import graph_client
+from FastAPI_Sub_Folder.Helpers.query_cache import DATA_VERSION_QUERY
+
+META_DATA = [
+    {'label': 'Occupation', 'other': [], 'elementType': 'node', 'type': 'STRING', 'property': 'title'},
+    {'label': 'Occupation', 'other': ['Personality_Trait', 'Basic_Skill'], 'elementType': 'node', 'type': 'RELATIONSHIP', 'property': 'need_for'},
+    {'label': 'need_for', 'other': [], 'elementType': 'relationship', 'type': 'INTEGER', 'property': 'importance'},
+    {'label': '_Bloom_Scene_', 'other': [], 'elementType': 'node', 'type': 'STRING', 'property': 'name'},
+]
+
+class FakeGraph:
+    """ run_query answering the data version and the schema queries, counting the schema reads """
+
+    def __init__(self, version):
+        self.version = version
+        self.schema_reads = 0
+
+    async def run_query(self, query, parameters=None):
+        if query == DATA_VERSION_QUERY: return [{'version': self.version}]
+        if query == graph_client.META_DATA_QUERY:
+            self.schema_reads += 1
+            return META_DATA
+        return []
+
+@pytest.fixture
+def fake_graph(monkeypatch):
+    graph = FakeGraph("v1")
+    monkeypatch.setattr(graph_client, "run_query", graph.run_query)
+    monkeypatch.setattr(graph_client, "schema", None)
+    return graph
+
+##
+
+def test_structured_schema_has_the_format_of_neo4jgraph():
+    assert graph_client.build_structured_schema(META_DATA, [], []) == {
+        'node_props': {'Occupation': [{'property': 'title', 'type': 'STRING'}]},
+        'rel_props': {'need_for': [{'property': 'importance', 'type': 'INTEGER'}]},
+        'relationships': [{'start': 'Occupation', 'type': 'need_for', 'end': 'Personality_Trait'},
+                          {'start': 'Occupation', 'type': 'need_for', 'end': 'Basic_Skill'}],
+        'metadata': {'constraint': [], 'index': []},
+    }
+
+def test_snapshot_is_used_while_the_data_version_is_the_same(fake_graph, tmp_path):
+    path = tmp_path / "graph_schema.json"
+    schema = asyncio.run(graph_client.load_schema(path))
+    assert schema['node_props'] == {'Occupation': [{'property': 'title', 'type': 'STRING'}]}
+    assert fake_graph.schema_reads == 1
+
+    graph_client.schema = None # new process
+    assert asyncio.run(graph_client.load_schema(path)) == schema
+    assert fake_graph.schema_reads == 1
+
+    graph_client.schema = None
+    fake_graph.version = "v2"
+    asyncio.run(graph_client.load_schema(path))
+    assert fake_graph.schema_reads == 2
+    assert graph_client.get_schema(path) == schema
+
+def test_close_resets_the_driver(monkeypatch):
+    closed = []
+    class FakeDriver:
+        async def close(self):
+            closed.append(self)
+
+    monkeypatch.setattr(graph_client, "async_driver", FakeDriver())
+    asyncio.run(graph_client.close())
+    assert len(closed) == 1 and graph_client.async_driver is None
+    asyncio.run(graph_client.close()) # nothing to close
+    assert len(closed) == 1
@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from FastAPI_Sub_Folder.Helpers.llm_cache import LLMResponseCache, CachedChatModel, get_key
+
+##
+
+class FakeModel:
+    """ Chat model that answers with the number of its calls, after latency seconds """
+
+    def __init__(self, model_name="llama-3.3-70b-versatile", temperature=0, latency=0.0, error=None):
+        self.model_name = model_name
+        self.temperature = temperature
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+
+    async def ainvoke(self, model_input, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.error is not None: raise self.error
+        return AIMessage(content=f"answer {self.calls}")
+
+    def invoke(self, model_input, **kwargs):
+        self.calls += 1
+        if self.error is not None: raise self.error
+        return AIMessage(content=f"answer {self.calls}")
+
+PROMPT = [SystemMessage(content="Compare the two cypher codes."), HumanMessage(content="MATCH (o:Occupation) RETURN o")]
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite"))
+    yield cache
+    cache.close()
+
+##
+
+def test_get_key_ignores_the_message_ids():
+    other_prompt = [SystemMessage(content=PROMPT[0].content, id="1"), HumanMessage(content=PROMPT[1].content, id="2")]
+    assert get_key(FakeModel(), PROMPT) == get_key(FakeModel(), other_prompt)
+
+def test_get_key_depends_on_the_model_and_the_messages():
+    key = get_key(FakeModel(), PROMPT)
+    assert key != get_key(FakeModel(model_name="llama-3.1-8b-instant"), PROMPT)
+    assert key != get_key(FakeModel(temperature=0.7), PROMPT)
+    assert key != get_key(FakeModel(), PROMPT[:1] + [HumanMessage(content="MATCH (p:Personality_Trait) RETURN p")])
+
+def test_responses_survive_a_restart(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite")
+    cache = LLMResponseCache(path)
+    cache.set("key", AIMessage(content="Realistic"))
+    cache.close()
+
+    cache = LLMResponseCache(path)
+    assert cache.get("key").content == "Realistic"
+    assert cache.stats()['bytes'] > 0
+    cache.close()
+
+def test_least_recently_used_responses_are_deleted(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite"))
+    cache.set("a", AIMessage(content="a" * 100))
+    cache.max_bytes = cache.stats()['bytes'] * 2 + 10 # room for two responses
+    cache.set("b", AIMessage(content="b" * 100))
+    assert cache.get("a") is not None # a is now more recently used than b
+    cache.set("c", AIMessage(content="c" * 100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()['evictions'] == 1
+    cache.close()
+
+def test_invoke_calls_the_model_once(cache):
+    model = FakeModel()
+    cached_model = CachedChatModel(model, cache)
+    assert cached_model.invoke(PROMPT).content == "answer 1"
+    assert cached_model.invoke(PROMPT).content == "answer 1"
+    assert model.calls == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_concurrent_identical_requests_call_the_model_once(cache):
+    model = FakeModel(latency=0.2)
+    cached_model = CachedChatModel(model, cache)
+
+    async def main():
+        return await asyncio.gather(*[cached_model.ainvoke(PROMPT) for _ in range(5)])
+
+    responses = asyncio.run(main())
+    assert [response.content for response in responses] == ["answer 1"] * 5
+    assert model.calls == 1
+    assert cache.stats()['coalesced'] == 4
+
+def test_errors_are_not_cached_and_reach_the_waiting_requests(cache):
+    model = FakeModel(latency=0.1, error=RuntimeError("rate limited"))
+    cached_model = CachedChatModel(model, cache)
+
+    async def main():
+        return await asyncio.gather(*[cached_model.ainvoke(PROMPT) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(main()))
+    assert model.calls == 1
+
+    model.error = None
+    assert asyncio.run(cached_model.ainvoke(PROMPT)).content == "answer 2"
+
+def test_a_model_with_a_temperature_is_not_cached(cache):
+    model = FakeModel(temperature=0.7)
+    cached_model = CachedChatModel(model, cache)
+    assert cached_model.invoke(PROMPT).content == "answer 1"
+    assert cached_model.invoke(PROMPT).content == "answer 2" # a new sample every time
+    assert cache.stats()['entries'] == 0 and cache.stats()['misses'] == 0
+
+def test_a_waiting_request_takes_the_place_of_a_cancelled_leader(cache):
+    model = FakeModel(latency=0.2)
+    cached_model = CachedChatModel(model, cache)
+
+    async def main():
+        leader = asyncio.create_task(cached_model.ainvoke(PROMPT))
+        await asyncio.sleep(0.05)
+        followers = [asyncio.create_task(cached_model.ainvoke(PROMPT)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await asyncio.gather(leader, *followers, return_exceptions=True)
+
+    leader, *followers = asyncio.run(main())
+    assert isinstance(leader, asyncio.CancelledError)
+    assert [response.content for response in followers] == ["answer 2"] * 2 # one new call, shared by the two
+    assert model.calls == 2
+
+def test_a_cancelled_waiting_request_does_not_cancel_the_others(cache):
+    model = FakeModel(latency=0.2)
+    cached_model = CachedChatModel(model, cache)
+
+    async def main():
+        leader = asyncio.create_task(cached_model.ainvoke(PROMPT))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(cached_model.ainvoke(PROMPT))
+        await asyncio.sleep(0.05)
+        follower.cancel()
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader, follower = asyncio.run(main())
+    assert leader.content == "answer 1" and isinstance(follower, asyncio.CancelledError)
+    assert model.calls == 1
+
+def test_a_new_leader_reads_the_cache_again(cache):
+    model = FakeModel()
+    cached_model = CachedChatModel(model, cache)
+    get = cache.get
+
+    def stale_get(key): # the previous leader saves its response just after this miss, before this request joins
+        response = get(key)
+        cache.get = get
+        cache.set(key, AIMessage(content="answer of the previous leader"))
+        return response
+
+    cache.get = stale_get
+    assert cached_model.invoke(PROMPT).content == "answer of the previous leader"
+    assert model.calls == 0
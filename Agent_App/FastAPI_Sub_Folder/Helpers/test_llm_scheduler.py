@@ -0,0 +1,116 @@
+import time
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage
+from FastAPI_Sub_Folder.Helpers.llm_scheduler import (LLMScheduler, ScheduledChatModel, LLMRateLimited, LLMQueueTimeout,
+                                                      USER_PRIORITY, HELPER_PRIORITY)
+
+##
+
+class FakeResponse:
+
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+
+class FakeAPIError(Exception):
+    """ Same shape as the groq / httpx errors: the status code and the headers are on error.response """
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Error code: {status_code}")
+        self.response = FakeResponse(status_code, retry_after)
+
+class StubModel:
+    """ Stub ainvoke: raises the next error of errors (None: answers), and records when and with what it was called """
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = [] # (time, model_input)
+
+    async def ainvoke(self, model_input, **kwargs):
+        self.calls.append((time.monotonic(), model_input))
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None: raise error
+        return AIMessage(content=f"answer to {model_input}")
+
+def make_scheduler(**kwargs):
+    kwargs = {'requests_per_minute': None, 'tokens_per_minute': None, 'deadline': 5, 'max_retries': 3, 'base_delay': 0.01, **kwargs}
+    return LLMScheduler(**kwargs)
+
+##
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_the_backoff_is_shared_by_concurrent_requests(status_code):
+    scheduler = make_scheduler()
+    model = StubModel(errors=[FakeAPIError(status_code, retry_after=0.3)])
+
+    async def main():
+        first = asyncio.create_task(ScheduledChatModel(model, scheduler).ainvoke("first"))
+        await asyncio.sleep(0.05) # the first request got the error, the backoff is running
+        second = await ScheduledChatModel(model, scheduler).ainvoke("second")
+        return await first, second
+
+    start_time = time.monotonic()
+    first, second = asyncio.run(main())
+    assert first.content == "answer to first" and second.content == "answer to second"
+
+    # the second request did not get the error, it still waited for the backoff (Retry-After: 0.3)
+    calls = {model_input: call_time - start_time for call_time, model_input in model.calls[1:]}
+    assert calls['second'] >= 0.29 and calls['first'] >= 0.29
+    assert scheduler.stats()['retries'] == 1 and scheduler.stats()['rate_limited'] == 1
+
+def test_llm_rate_limited_is_raised_after_max_retries():
+    scheduler = make_scheduler(max_retries=2)
+    model = StubModel(errors=[FakeAPIError(429, retry_after=0.01)] * 10)
+
+    with pytest.raises(LLMRateLimited):
+        asyncio.run(ScheduledChatModel(model, scheduler).ainvoke("prompt"))
+    assert len(model.calls) == 3 # the first call and 2 retries
+    assert scheduler.stats()['retries'] == 2 and scheduler.stats()['rate_limited'] == 3
+
+def test_other_errors_are_not_retried():
+    scheduler = make_scheduler()
+    model = StubModel(errors=[FakeAPIError(400)])
+
+    with pytest.raises(FakeAPIError):
+        asyncio.run(ScheduledChatModel(model, scheduler).ainvoke("prompt"))
+    assert len(model.calls) == 1 and scheduler.stats()['retries'] == 0
+
+def test_llm_queue_timeout_is_raised_at_the_deadline():
+    scheduler = make_scheduler(requests_per_minute=1, deadline=0.2) # the second request would wait a minute
+    model = StubModel()
+
+    async def main():
+        await ScheduledChatModel(model, scheduler).ainvoke("first")
+        start_time = time.monotonic()
+        with pytest.raises(LLMQueueTimeout):
+            await ScheduledChatModel(model, scheduler).ainvoke("second")
+        return time.monotonic() - start_time
+
+    seconds = asyncio.run(main())
+    assert 0.15 <= seconds < 1
+    assert len(model.calls) == 1
+    assert scheduler.stats()['timeouts'] == 1 and scheduler.stats()['queue_depth'] == 0
+
+def test_llm_queue_timeout_is_raised_during_a_long_backoff():
+    scheduler = make_scheduler(deadline=0.2)
+    model = StubModel(errors=[FakeAPIError(429, retry_after=30)])
+
+    start_time = time.monotonic()
+    with pytest.raises(LLMQueueTimeout):
+        asyncio.run(ScheduledChatModel(model, scheduler).ainvoke("prompt"))
+    assert time.monotonic() - start_time < 1
+
+def test_user_requests_go_before_helper_requests():
+    scheduler = make_scheduler()
+    model = StubModel()
+
+    async def main():
+        scheduler.paused_until = time.monotonic() + 0.2 # every request queues behind a backoff
+        helpers = [asyncio.create_task(ScheduledChatModel(model, scheduler, priority=HELPER_PRIORITY).ainvoke(f"helper {i}")) for i in range(3)]
+        await asyncio.sleep(0.05) # the helper requests are queued first
+        users = [asyncio.create_task(ScheduledChatModel(model, scheduler, priority=USER_PRIORITY).ainvoke(f"user {i}")) for i in range(2)]
+        await asyncio.gather(*helpers, *users)
+
+    asyncio.run(main())
+    assert [model_input for _, model_input in model.calls] == ["user 0", "user 1", "helper 0", "helper 1", "helper 2"]
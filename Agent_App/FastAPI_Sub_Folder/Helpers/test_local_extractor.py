@@ -0,0 +1,78 @@
+""" Tests of the local, deterministic extract_data step """
+
+import json
+from langchain_core.messages import AIMessage, HumanMessage
+from FastAPI_Sub_Folder.Helpers.local_extractor import identify_traits, parse_output, parse_row, extract_locally
+
+CONVERSATION = [
+    AIMessage(content="Do you prefer Realistic tasks, Artistic projects or Social activities?"),
+    HumanMessage(content="I love to build and repair things, and I like to analyze problems and research how they work."),
+]
+OUTPUT = [
+    {'o': {'title': 'Mechanics'}, 'r': [{}, 'high_interest', {}], 'p': {'title': 'Realistic'}},
+    {'o': {'title': 'Mechanics'}, 'r': [{}, 'medium_interest', {}], 'p': {'title': 'Investigative'}},
+    {'o': {'title': 'Chemists'}, 'r': [{}, 'high_interest', {}], 'p': {'title': 'Investigative'}},
+    {'o': {'title': 'Dancers'}, 'r': [{}, 'high_interest', {}], 'p': {'title': 'Artistic'}},
+    {'o': {'title': 'Mechanics'}, 'r': [{}, 'strong_need_for_basic_skill', {}], 'p': {'title': 'Troubleshooting'}},
+]
+
+##
+
+def test_traits_come_from_the_users_words_not_the_agents_options():
+    assert identify_traits(CONVERSATION) == ['Realistic', 'Investigative']
+    assert identify_traits([AIMessage(content="Are you Artistic?"), HumanMessage(content="hello")]) == ['Artistic']
+    assert identify_traits([HumanMessage(content="hello")]) == []
+
+def test_outputs_are_read_from_json_python_text_or_rows():
+    assert parse_output(json.dumps(OUTPUT)) == OUTPUT
+    assert parse_output(str(OUTPUT)) == OUTPUT
+    assert parse_output("not rows") is None
+    assert parse_output([1, 2]) is None
+
+def test_rows_become_edges():
+    assert parse_row(OUTPUT[0]) == [('Mechanics', 'high_interest', 'Realistic')]
+    assert parse_row({'o.title': 'Chefs', 'p.title': 'Artistic'}) == [('Chefs', None, 'Artistic')]
+    assert parse_row({'o.title': 'Chefs', 'type(r)': 'low_interest', 'p.title': 'Artistic'}) == [('Chefs', 'low_interest', 'Artistic')]
+
+def test_nodes_linked_to_the_most_traits_are_kept_with_their_strong_needs():
+    assert extract_locally([json.dumps(OUTPUT)], CONVERSATION) == [
+        ['Mechanics', 'high_interest', 'Realistic'],
+        ['Mechanics', 'medium_interest', 'Investigative'],
+        ['Chemists', 'high_interest', 'Investigative'],
+        ['Mechanics', 'strong_need_for_basic_skill', 'Troubleshooting'],
+    ]
+
+def test_max_nodes():
+    extracted = extract_locally([OUTPUT], CONVERSATION, max_nodes=1)
+    assert {edge[0] for edge in extracted} == {'Mechanics'}
+
+def test_falls_back_to_the_llm_when_it_can_not_decide():
+    assert extract_locally([OUTPUT], [HumanMessage(content="hello")]) is None # no trait
+    assert extract_locally([None], CONVERSATION) is None # output not available
+    assert extract_locally([[{'o': {'title': 'Dancers'}, 'p': {'title': 'Artistic'}}]], CONVERSATION) is None # no edge to the traits
+
+def test_keywords_are_whole_words_and_negations_are_skipped():
+    assert identify_traits([HumanMessage(content="I hate dealing with people. I like artificial intelligence and servers")]) == []
+    assert identify_traits([HumanMessage(content="I would not like to lead or manage")]) == []
+    assert identify_traits([HumanMessage(content="I don't want to manage people, but I love to build and repair engines")]) == ['Realistic']
+    assert identify_traits([HumanMessage(content="I am not Artistic")]) == []
+
+def test_falls_back_to_the_llm_without_a_clear_top_trait():
+    conversation = [HumanMessage(content="I like to build things and to analyze them")] # Realistic and Investigative tie
+    assert identify_traits(conversation) == ['Realistic', 'Investigative']
+    assert extract_locally([OUTPUT], conversation) is None
+
+def test_tied_nodes_are_not_picked_by_name():
+    # 8 occupations linked to Realistic only, nothing tells them apart: the LLM decides
+    output = [{'o': {'title': f"Occupation {i}"}, 'p': {'title': 'Realistic'}} for i in range(8)]
+    assert extract_locally([output], CONVERSATION) is None
+    # with fewer tied nodes than max_nodes they are all kept
+    assert len(extract_locally([output[:5]], CONVERSATION)) == 5
+
+def test_stronger_relations_go_first():
+    output = [{'o': {'title': title}, 'type(r)': relation, 'p': {'title': 'Realistic'}}
+              for title, relation in [('Actors', 'low_need_for_trait'), ('Welders', 'strong_need_for_trait'), ('Bakers', 'medium_need_for_trait')]]
+    assert extract_locally([output], CONVERSATION, max_nodes=2) == [
+        ['Welders', 'strong_need_for_trait', 'Realistic'],
+        ['Bakers', 'medium_need_for_trait', 'Realistic'],
+    ]
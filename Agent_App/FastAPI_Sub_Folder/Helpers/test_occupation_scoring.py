@@ -0,0 +1,100 @@
+""" Tests of the in-process occupation scorer """
+
+import asyncio
+import pytest
+from FastAPI_Sub_Folder.Helpers.occupation_scoring import OccupationScorer, ScorerLoader, get_relation_weight, normalize_title, to_rows
+
+EDGES = [
+    ('Geologists', 'Personality_Trait', 'Investigative', 'need_for_personality_trait'),
+    ('Geologists', 'Personality_Trait', 'Realistic', 'need_for_personality_trait'),
+    ('Geologists', 'Basic_Skill', 'Mathematics', 'medium_need_for_basic_skill'),
+    ('Geologists', 'Basic_Skill', 'Mathematics', 'low_need_for_basic_skill'), # the strongest relation is kept
+    ('Chefs', 'Personality_Trait', 'Artistic', 'need_for_personality_trait'),
+    ('Chefs', 'Personality_Trait', 'Realistic', 'need_for_personality_trait'),
+    ('Accountants', 'Personality_Trait', 'Conventional', 'need_for_personality_trait'),
+    ('Accountants', 'Knowledge', 'Mathematics', 'strong_need_for_knowledge'),
+]
+
+##
+
+def test_relation_weights():
+    assert get_relation_weight('strong_need_for_knowledge') == 3
+    assert get_relation_weight('medium_need_for_basic_skill') == 2
+    assert get_relation_weight('low_need_for_ability') == 1
+    assert get_relation_weight('need_for_personality_trait') == 3
+
+def test_titles_are_compared_without_case_spaces_and_separators():
+    assert normalize_title("Critical Thinking") == normalize_title("critical_thinking") == normalize_title("Critical-Thinking")
+
+def test_occupations_are_ranked_by_weighted_score():
+    scorer = OccupationScorer(EDGES)
+    result = scorer.recommend({'Realistic': 1, 'Investigative': 1})
+    assert [(r['occupation'], r['score']) for r in result['recommendations']] == [('Geologists', 3.0), ('Chefs', 1.5)]
+    assert result['unknown'] == []
+
+def test_matches_explain_the_score():
+    scorer = OccupationScorer(EDGES)
+    geologists = scorer.recommend({'mathematics': 1, 'Realistic': 1})['recommendations'][0]
+    assert geologists['occupation'] == 'Geologists'
+    assert geologists['matches'] == [
+        {'label': 'Personality_Trait', 'title': 'Realistic', 'relation': 'need_for_personality_trait', 'contribution': 1.5},
+        {'label': 'Basic_Skill', 'title': 'Mathematics', 'relation': 'medium_need_for_basic_skill', 'contribution': 1.0},
+    ]
+
+def test_a_title_shared_by_several_labels_matches_all_of_them():
+    result = OccupationScorer(EDGES).recommend(['Mathematics'])
+    assert [(r['occupation'], r['score']) for r in result['recommendations']] == [('Accountants', 3.0), ('Geologists', 2.0)]
+
+def test_a_title_shared_by_several_labels_counts_once():
+    # X needs Mathematics as a Basic_Skill and as a Knowledge, and no Investigative
+    edges = EDGES + [('X', 'Basic_Skill', 'Mathematics', 'strong_need_for_basic_skill'), ('X', 'Knowledge', 'Mathematics', 'strong_need_for_knowledge')]
+    scorer = OccupationScorer(edges)
+    scores = {r['occupation']: r['score'] for r in scorer.recommend({'Mathematics': 1, 'Investigative': 1})['recommendations']}
+    assert scores['X'] == 1.5 and scores['Geologists'] == 2.5
+    recommendations = {r['occupation']: r for r in scorer.recommend({'Mathematics': 1})['recommendations']}
+    assert recommendations['X'] == {
+        'occupation': 'X', 'score': 3.0,
+        'matches': [{'label': 'Basic_Skill', 'title': 'Mathematics', 'relation': 'strong_need_for_basic_skill', 'contribution': 3.0}],
+    }
+
+def test_scores_never_exceed_3():
+    edges = EDGES + [('X', label, title, 'strong_need_for_' + label.lower()) for label in ['Basic_Skill', 'Knowledge', 'Ability'] for title in ['Mathematics', 'Writing']]
+    scorer = OccupationScorer(edges)
+    titles = ['Mathematics', 'Writing', 'Realistic', 'Investigative', 'Artistic', 'Conventional']
+    for n in range(1, len(titles) + 1):
+        for weight in [0.1, 1, 5]:
+            for recommendation in scorer.recommend({title: weight for title in titles[:n]}, k=10)['recommendations']:
+                assert 0 < recommendation['score'] <= 3
+
+def test_top_k_and_unknown_titles():
+    scorer = OccupationScorer(EDGES)
+    result = scorer.recommend({'Realistic': 1, 'Juggling': 1}, k=1)
+    assert len(result['recommendations']) == 1
+    assert result['unknown'] == ['Juggling']
+    assert scorer.recommend({'Juggling': 1}) == {'recommendations': [], 'unknown': ['Juggling']}
+
+def test_rows_have_the_format_of_a_query_output():
+    rows = to_rows(OccupationScorer(EDGES).recommend({'Artistic': 1}, max_matches=1))
+    assert rows == [{'occupation': {'title': 'Chefs'}, 'matched': {'title': 'Artistic'}, 'relation': 'need_for_personality_trait', 'score': 3.0}]
+
+##
+
+def test_loader_builds_once_and_rebuilds_on_a_new_data_version():
+    versions, loads = ["v1"], []
+    async def load_edges():
+        loads.append(1)
+        return EDGES
+
+    async def main():
+        async def get_version():
+            return versions[-1]
+        loader = ScorerLoader(load_edges, version_getter=get_version, version_check_interval=0)
+        first = await asyncio.gather(*[loader.aget() for _ in range(3)])
+        versions.append("v2")
+        second = await loader.aget()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first[0] is first[1] is first[2] and first[0].version == "v1"
+    assert second.version == "v2"
+    assert len(loads) == 2
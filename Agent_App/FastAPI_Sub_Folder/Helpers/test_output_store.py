@@ -0,0 +1,51 @@
+""" Tests of the store of the full query outputs, kept out of the sessions' state """
+
+from FastAPI_Sub_Folder.Helpers.output_store import GraphOutputStore
+
+##
+
+def test_outputs_are_kept_per_session():
+    store = GraphOutputStore()
+    store.put("a", "MATCH (o:Occupation) RETURN o", '[{"o": 1}]')
+    store.put("b", "MATCH (o:Occupation) RETURN o", '[{"o": 2}]')
+    assert store.get("a", "MATCH (o:Occupation) RETURN o") == '[{"o": 1}]'
+    assert store.get_session("b") == {"MATCH (o:Occupation) RETURN o": '[{"o": 2}]'}
+    assert store.get_session("c") == {}
+
+def test_oldest_outputs_of_a_session_are_dropped_past_its_limit():
+    store = GraphOutputStore(max_bytes_per_session=10)
+    store.put("a", "q1", "x" * 6)
+    store.put("a", "q2", "y" * 6)
+    assert store.get_session("a") == {"q2": "y" * 6}
+    assert store.stats()['bytes'] == 6
+
+def test_least_recently_used_sessions_are_dropped():
+    store = GraphOutputStore(max_sessions=2)
+    store.put("a", "q", "1")
+    store.put("b", "q", "2")
+    store.get("a", "q")
+    store.put("c", "q", "3")
+    assert store.get("b", "q") is None
+    assert store.get("a", "q") == "1"
+    assert store.stats()['sessions'] == 2
+
+def test_total_size_is_bounded():
+    store = GraphOutputStore(max_bytes=10)
+    store.put("a", "q", "x" * 6)
+    store.put("b", "q", "y" * 6)
+    assert store.get_session("a") == {}
+    assert store.stats()['bytes'] == 6
+
+def test_output_larger_than_the_session_limit_is_not_stored():
+    store = GraphOutputStore(max_bytes_per_session=4)
+    store.put("a", "q", "x" * 5)
+    assert store.get("a", "q") is None
+
+def test_replacing_an_output_and_deleting_a_session():
+    store = GraphOutputStore()
+    store.put("a", "q", "old")
+    store.put("a", "q", "new!")
+    assert store.stats()['bytes'] == 4
+    assert store.get_session("a", cyphers=["q", "other"]) == {"q": "new!"}
+    store.delete("a")
+    assert store.stats() == {'sessions': 0, 'outputs': 0, 'bytes': 0, 'max_bytes': store.max_bytes, 'evictions': 0}
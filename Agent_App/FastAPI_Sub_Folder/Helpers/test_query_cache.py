@@ -0,0 +1,92 @@
+""" Tests of the shared cache of the query_graph outputs """
+
+import asyncio
+from FastAPI_Sub_Folder.Helpers.query_cache import QueryResultCache
+
+QUERY = "MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o, p"
+
+##
+
+def test_equivalent_queries_share_an_entry():
+    cache = QueryResultCache()
+    cache.set(QUERY, [{'o': 1}])
+    assert cache.get("match (x:Occupation)-[]->(y:Personality_Trait) return x, y") == (True, [{'o': 1}])
+
+def test_label_alternatives_do_not_share_an_entry_with_label_conjunctions():
+    cache = QueryResultCache()
+    cache.set("MATCH (n:A|B) RETURN n", ["either"])
+    assert cache.get("MATCH (n:A:B) RETURN n") == (False, None)
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryResultCache(max_entries=2)
+    cache.set("MATCH (a:A) RETURN a", 1)
+    cache.set("MATCH (b:B) RETURN b", 2)
+    cache.get("MATCH (a:A) RETURN a")
+    cache.set("MATCH (c:C) RETURN c", 3)
+    assert cache.get("MATCH (b:B) RETURN b") == (False, None)
+    assert cache.get("MATCH (a:A) RETURN a") == (True, 1)
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire():
+    cache = QueryResultCache(ttl=0)
+    cache.set(QUERY, 1)
+    assert cache.get(QUERY) == (False, None)
+
+def test_new_graph_data_version_clears_the_cache():
+    versions = ["v1"]
+    async def get_version():
+        return versions[-1]
+    async def run_query(query):
+        return [len(versions)]
+
+    cache = QueryResultCache(version_getter=get_version, version_check_interval=0)
+    assert asyncio.run(cache.aget_or_run(QUERY, run_query)) == [1]
+    assert asyncio.run(cache.aget_or_run(QUERY, run_query)) == [1]
+    versions.append("v2")
+    assert asyncio.run(cache.aget_or_run(QUERY, run_query)) == [2]
+    assert cache.stats()['invalidations'] == 1
+
+##
+
+def test_concurrent_misses_run_the_query_once():
+    calls = []
+    async def run_query(query):
+        calls.append(query)
+        await asyncio.sleep(0.05)
+        return [{'o': 1}]
+
+    async def main():
+        cache = QueryResultCache()
+        outputs = await asyncio.gather(*[cache.aget_or_run(QUERY, run_query) for _ in range(5)])
+        return cache, outputs
+
+    cache, outputs = asyncio.run(main())
+    assert len(calls) == 1
+    assert outputs == [[{'o': 1}]] * 5
+    assert cache.stats()['coalesced'] == 4
+    assert cache.in_flight == {}
+
+def test_waiting_callers_get_the_error_and_it_is_not_cached():
+    calls = []
+    async def run_query(query):
+        calls.append(query)
+        await asyncio.sleep(0.05)
+        raise ValueError("rejected")
+
+    async def main():
+        cache = QueryResultCache()
+        results = await asyncio.gather(*[cache.aget_or_run(QUERY, run_query) for _ in range(3)], return_exceptions=True)
+        return cache, results
+
+    cache, results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert cache.get(QUERY) == (False, None)
+
+def test_get_or_run_caches_the_output():
+    cache = QueryResultCache()
+    calls = []
+    run_query = lambda query: calls.append(query) or [1]
+    assert cache.get_or_run(QUERY, run_query) == [1]
+    assert cache.get_or_run(QUERY, run_query) == [1]
+    assert len(calls) == 1
@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+from FastAPI_Sub_Folder.Helpers.query_guard import QueryGuard, QueryRejected, check_plan, is_truncated
+from FastAPI_Sub_Folder.Helpers.result_compaction import compact_output
+
+##
+
+def make_plan(operator, estimated_rows=10, children=()):
+    return {'operatorType': f"{operator}@neo4j", 'args': {'EstimatedRows': estimated_rows}, 'children': list(children)}
+
+def read_plan(estimated_rows=10):
+    """ Plan of MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o, p """
+    return make_plan('ProduceResults', estimated_rows, [make_plan('Expand(All)', estimated_rows, [make_plan('NodeByLabelScan', 900)])])
+
+## Fake neo4j async driver, only what QueryGuard.run uses to read the rows
+class FakeRecord:
+
+    def __init__(self, data):
+        self.values = data
+
+    def data(self):
+        return self.values
+
+class FakeResult:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.read = 0
+
+    async def __aiter__(self):
+        for row in self.rows:
+            self.read += 1
+            yield FakeRecord(row)
+
+class FakeSession:
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute_read(self, work):
+        return await work(self)
+
+    async def run(self, query):
+        self.driver.result = FakeResult(self.driver.rows)
+        return self.driver.result
+
+class FakeDriver:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = None
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+## Query guard with a stubbed EXPLAIN
+class StubbedGuard(QueryGuard):
+
+    def __init__(self, rows, plan=None, query_type="r", **kwargs):
+        self.driver = FakeDriver(rows)
+        super().__init__(lambda: self.driver, **kwargs)
+        self.plan = plan if plan is not None else read_plan()
+        self.query_type = query_type
+
+    async def explain(self, query):
+        return self.plan, self.query_type
+
+def make_rows(count):
+    return [{'o': {'title': f"Occupation {i}"}} for i in range(count)]
+
+##
+
+def test_check_plan_accepts_a_connected_read_query():
+    assert check_plan(read_plan(estimated_rows=120)) == 120
+
+@pytest.mark.parametrize("operator", ['Create', 'Merge', 'SetProperty', 'DetachDelete'])
+def test_check_plan_rejects_write_operators(operator):
+    with pytest.raises(QueryRejected) as e:
+        check_plan(make_plan('ProduceResults', children=[make_plan('EmptyResult', children=[make_plan(operator)])]))
+    assert e.value.reason == "write_query"
+
+def test_check_plan_rejects_a_write_query_type():
+    with pytest.raises(QueryRejected) as e:
+        check_plan(read_plan(), query_type="rw")
+    assert e.value.reason == "write_query"
+
+def test_check_plan_rejects_a_cartesian_product():
+    plan = make_plan('ProduceResults', 810000, [make_plan('CartesianProduct', 810000, [make_plan('NodeByLabelScan', 900), make_plan('NodeByLabelScan', 900)])])
+    with pytest.raises(QueryRejected) as e:
+        check_plan(plan, max_estimated_rows=10 ** 9)
+    assert e.value.reason == "cartesian_product"
+    assert e.value.to_output()['estimated_rows'] == 810000
+
+def test_check_plan_rejects_an_all_nodes_scan():
+    with pytest.raises(QueryRejected) as e:
+        check_plan(make_plan('ProduceResults', children=[make_plan('AllNodesScan@neo4j')]))
+    assert e.value.reason == "all_nodes_scan"
+
+def test_check_plan_rejects_too_many_estimated_rows():
+    with pytest.raises(QueryRejected) as e:
+        check_plan(read_plan(estimated_rows=5001), max_estimated_rows=5000)
+    assert e.value.reason == "too_many_rows"
+    check_plan(read_plan(estimated_rows=5000), max_estimated_rows=5000)
+
+def test_check_plan_reads_the_http_arguments():
+    plan = {'operatorType': 'ProduceResults', 'arguments': {'EstimatedRows': 300000}, 'children': []}
+    with pytest.raises(QueryRejected):
+        check_plan(plan)
+
+##
+
+def test_run_counts_the_rejections():
+    guard = StubbedGuard(make_rows(3), plan=make_plan('AllNodesScan'))
+    with pytest.raises(QueryRejected):
+        asyncio.run(guard.run("MATCH (n) RETURN n"))
+    assert guard.stats()['rejections'] == {'all_nodes_scan': 1}
+    assert guard.driver.result is None # the query did not run
+
+def test_run_returns_exactly_max_rows_rows_without_truncation():
+    guard = StubbedGuard(make_rows(5), max_rows=5)
+    rows = asyncio.run(guard.run("MATCH (o:Occupation) RETURN o;"))
+    assert rows == make_rows(5)
+    assert not is_truncated(rows)
+    assert guard.stats()['truncations'] == 0
+
+def test_run_flags_a_truncated_result():
+    guard = StubbedGuard(make_rows(100), max_rows=5)
+    rows = asyncio.run(guard.run("MATCH (o:Occupation) RETURN o"))
+    assert rows == make_rows(5)
+    assert is_truncated(rows)
+    assert guard.driver.result.read == 6 # one extra row, the rest is not read
+    assert guard.stats()['truncations'] == 1
+
+def test_a_truncated_result_is_noted_in_the_compacted_output():
+    rows = asyncio.run(StubbedGuard(make_rows(100), max_rows=5).run("MATCH (o:Occupation) RETURN o"))
+    text, info = compact_output(rows, read_truncated=is_truncated(rows))
+    assert info['read_truncated']
+    assert text.splitlines()[-1].startswith("[truncated: the query returned more than 5 rows, only the first 5 were read.")
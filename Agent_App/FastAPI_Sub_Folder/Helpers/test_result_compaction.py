@@ -0,0 +1,39 @@
+""" Tests of the compaction of the query outputs given to the LLM """
+
+from FastAPI_Sub_Folder.Helpers.result_compaction import compact_output, project_value
+
+ROWS = [{'o': {'title': 'Baristas', 'code': 1}, 'p': {'title': 'Realistic'}},
+        {'o': {'title': 'Baristas', 'code': 2}, 'p': {'title': 'Realistic'}},
+        {'o': {'title': 'Chefs'}, 'p': {'title': 'Artistic'}, 'r': 'high'}]
+
+##
+
+def test_nodes_are_projected_to_their_title():
+    assert project_value({'title': 'Baristas', 'code': 1}) == "Baristas"
+    assert project_value({'level': 3, 'kind': 'high'}) == "{level: 3, kind: high}"
+    assert project_value([{'title': 'A'}, 2]) == "[A, 2]"
+
+def test_rows_are_deduplicated_and_written_as_a_table():
+    text, info = compact_output(ROWS)
+    assert text.split("\n") == ["o | p | r", "Baristas | Realistic | None", "Chefs | Artistic | high"]
+    assert info == {'rows': 3, 'unique_rows': 2, 'shown_rows': 2, 'truncated': False, 'read_truncated': False}
+
+def test_output_is_cut_at_max_rows_with_a_note():
+    rows = [{'o': {'title': f"Occupation {i}"}} for i in range(10)]
+    text, info = compact_output(rows, max_rows=3)
+    lines = text.split("\n")
+    assert lines[1:4] == ["Occupation 0", "Occupation 1", "Occupation 2"]
+    assert lines[-1].startswith("[truncated: 3 of 10 unique rows shown (10 rows returned)")
+    assert info['truncated'] and info['shown_rows'] == 3
+
+def test_output_is_cut_at_max_bytes():
+    rows = [{'o': {'title': "x" * 20 + str(i)}} for i in range(100)]
+    text, info = compact_output(rows, max_bytes=100)
+    table = text.rsplit("\n", 1)[0] # without the note
+    assert len(table.encode("utf-8")) <= 100
+    assert info['truncated'] and info['shown_rows'] < 100
+
+def test_output_that_is_not_a_list_of_rows_is_kept_as_text():
+    text, info = compact_output("no rows", max_bytes=4)
+    assert text == "no r"
+    assert info['truncated'] and info['rows'] is None
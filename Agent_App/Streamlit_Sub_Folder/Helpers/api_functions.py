@@ -1,6 +1,23 @@
+import json
 import requests
 
-# Function to send a request to the FastAPI backend
-def get_api_response(user_message):
-    response = requests.post(url="http://127.0.0.1:8000/messages", json={"message": user_message})
+# Function to send a request to the FastAPI backend. session_id is None for the first message of a conversation
+def get_api_response(user_message, session_id=None):
+    response = requests.post(url="http://127.0.0.1:8000/messages", json={"message": user_message, "session_id": session_id})
     return response.json()
+
+# Full outputs of the queries of a session: {cypher code: output as JSON}. The messages' responses only have the compacted outputs
+def get_graph_outputs(session_id):
+    response = requests.get(url=f"http://127.0.0.1:8000/sessions/{session_id}/graph_outputs")
+    return response.json()['graph_outputs']
+
+# Streaming version of get_api_response: yields (event, data) as the server sends them (node_start, node_end, token, done, error)
+def stream_api_response(user_message, session_id=None):
+    with requests.post(url="http://127.0.0.1:8000/messages/stream", json={"message": user_message, "session_id": session_id}, stream=True) as response:
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event is not None:
+                yield event, json.loads(line[len("data: "):])
+                event = None
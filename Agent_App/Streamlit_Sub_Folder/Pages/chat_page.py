@@ -1,35 +1,65 @@
 import streamlit as st
-from Streamlit_Sub_Folder.Helpers.api_functions import get_api_response
+from Streamlit_Sub_Folder.Helpers.api_functions import stream_api_response
+
+# What the agent is doing, shown while a node runs
+NODE_LABELS = {
+  "personality_scientist": "Reading your message ...",
+  "validate_cypher_then_query_graph": "Querying the knowledge graph ...",
+  "extract_data": "Extracting what suits you from the graph ...",
+  "recommend_careers": "Writing your career recommendations ...",
+}
 
 ## Handles Conversational UI 
 def display_chat_page(session_state):
 
+  # Display Conversation in the UI
+  for message in session_state.messages:
+    with st.chat_message(message["role"]):
+      st.markdown(message["content"])
+
   # Add user's message to sessions_state
   if prompt := st.chat_input(placeholder = "Your message ..."):
     session_state.messages.append({"role": "user", "content": prompt})
+    with st.chat_message("user"):
+      st.markdown(prompt)
 
-  # Send user's message to the Agent, recieve Agent's response, and save the response in sessions_state
+  # Send user's message to the Agent and display its answer as it is streamed, then save the response in sessions_state
   if prompt:
-    api_output = get_api_response(user_message=prompt) # api_output: {response, num_queries_made, cypher_code_and_query_outputs}
+    with st.chat_message("assistant"):
+      status = st.status("Thinking ...")
+      answer_box = st.empty()
+      api_output, answer, answer_node = None, "", None
 
-    # Check for returned errors
-    if isinstance(api_output, str):
-      session_state.messages.append({"role": "assistant", "content": f"Somthing went wrong ({api_output})."})
+      for event, data in stream_api_response(user_message=prompt, session_id=session_state.session_id):
+        if event == "node_start":
+          status.update(label=NODE_LABELS.get(data['node'], data['node']))
+          status.write(NODE_LABELS.get(data['node'], data['node']))
+        elif event == "token":
+          if data['node'] != answer_node: answer, answer_node = "", data['node'] # a new answer replaces the previous one
+          answer += data['content']
+          answer_box.markdown(answer)
+        elif event == "done":
+          api_output = data # api_output: {session_id, response, good_cypher_and_outputs, extracted_data, graph_data_to_be_used}
+        elif event == "error":
+          api_output = data['message']
 
-    # Save response in session_state: messages, num_queries_made, cypher_code_and_query_outputs
-    else:
-      ai_response = api_output['response'][-1]
-      session_state.messages.append({"role": "assistant", "content": f"{ai_response}"})
-      
-      session_state.extracted_data = api_output['extracted_data']
-      session_state.good_cypher_and_outputs = api_output['good_cypher_and_outputs']
-      session_state.graph_data_to_be_used = api_output['graph_data_to_be_used']
+      status.update(label="Done", state="complete" if isinstance(api_output, dict) else "error")
 
+      # Check for returned errors
+      if not isinstance(api_output, dict):
+        answer_box.markdown(f"Somthing went wrong ({api_output}).")
+        session_state.messages.append({"role": "assistant", "content": f"Somthing went wrong ({api_output})."})
 
-  # Display Conversation in the UI
-  for message in session_state.messages:
-    with st.chat_message(message["role"]):
-      st.markdown(message["content"])
+      # Save response in session_state: messages, extracted_data, cypher codes and their outputs (the graph page asks the API for the full outputs)
+      else:
+        ai_response = api_output['response'][-1] if len(api_output['response']) > 0 else answer
+        answer_box.markdown(ai_response)
+        session_state.messages.append({"role": "assistant", "content": f"{ai_response}"})
+        session_state.session_id = api_output['session_id'] # keep talking in the same conversation
+        
+        session_state.extracted_data = api_output['extracted_data']
+        session_state.good_cypher_and_outputs = api_output['good_cypher_and_outputs']
+        session_state.graph_data_to_be_used = api_output['graph_data_to_be_used']
 
   # Displays greeting UI if conversation is empty
   if len(session_state.messages) == 0:
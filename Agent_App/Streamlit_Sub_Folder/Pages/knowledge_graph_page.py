@@ -1,6 +1,8 @@
 import ast
+import json
 import streamlit as st
 from Streamlit_Sub_Folder.Helpers.app_helper_functions import display_knowledge_graph, display_extracted_traits_data, display_error_box
+from Streamlit_Sub_Folder.Helpers.api_functions import get_graph_outputs
 
 def display_knowledge_graph_page(session_state):
   
@@ -10,12 +12,15 @@ def display_knowledge_graph_page(session_state):
   # Check if the model used the graph
   if num_queries_made > 0:
     extracted_data = session_state.extracted_data[-1]
+    graph_outputs = get_graph_outputs(session_state.session_id) # full outputs, kept by the API out of the session's state
     
     # Display the results from the knowledge graph
     for i in range(-1, -num_queries_made - 1, -1): # backward loop
       cypher_code = session_state.graph_data_to_be_used[i]
-      output = session_state.good_cypher_and_outputs[cypher_code]
-      output = ast.literal_eval(output)
+      if cypher_code not in graph_outputs: # dropped by the API's output store (old session or restart)
+        display_error_box(text="⚠️ The output of this query is no longer available ⚠️")
+        continue
+      output = json.loads(graph_outputs[cypher_code])
 
       if len(output) > 0:
         st.markdown(f"""
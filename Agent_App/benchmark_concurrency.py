@@ -0,0 +1,95 @@
+"""
+Concurrency check of the async agent, without Groq and without Neo4j.
+
+A stub chat model answers after --llm-latency seconds and asks for one graph query on the first call of a turn,
+and a stub query_graph tool answers after --query-latency seconds. Both wait with asyncio.sleep, like a network call.
+One conversation is run alone, then N conversations are run in parallel with their own thread ids.
+With the async path, the N conversations should finish in close to the time of one.
+
+Usage (from the Agent_App folder):
+    python benchmark_concurrency.py
+    python benchmark_concurrency.py --conversations 50 --llm-latency 0.5 --query-latency 0.2
+"""
+
+import os
+import time
+import asyncio
+import argparse
+
+# agent_workflow reads these at import time. The stubs do not use them
+for key, value in [("NEO4J_URI", "bolt://localhost:7687"), ("NEO4J_USERNAME", "neo4j"), ("NEO4J_PASSWORD", "neo4j"), ("LANGCHAIN_TRACING_V2", "false")]:
+    os.environ.setdefault(key, value)
+
+from langchain_core.tools import tool
+from langchain_core.messages import AIMessage, HumanMessage
+from FastAPI_Sub_Folder.Helpers import agent_workflow
+
+QUERY = "MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o.title, p.title"
+
+##
+
+class StubChatModel:
+    """ Answers after latency seconds. Asks for QUERY if the conversation did not ask for a query yet, otherwise answers with text """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def bind_tools(self, tools):
+        return self
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if isinstance(messages, str): # extractor prompt
+            return AIMessage(content="Realistic: high")
+
+        asked_for_query = any(isinstance(message, AIMessage) and len(message.tool_calls) > 0 for message in messages)
+        if not asked_for_query:
+            return AIMessage(content="", tool_calls=[{'name': 'query_graph', 'args': {'query': QUERY}, 'id': f"call_{self.calls}"}])
+        return AIMessage(content="Here are careers that suit you")
+
+##
+
+def make_stub_tool(latency):
+    @tool("query_graph")
+    async def query_graph(query):
+        """Query from Neo4j knowledge graph using Cypher."""
+        await asyncio.sleep(latency)
+        return [{'o.title': 'Baristas', 'p.title': 'Realistic'}]
+    return query_graph
+
+##
+
+async def run_conversation(agent, thread_id):
+    config = {"configurable": {"thread_id": thread_id}}
+    response = []
+    async for event in agent.graph.astream({"conversation": [HumanMessage(content="Recommend me a career")], "graph_data_to_be_used": []}, config, stream_mode="values"):
+        response.append(event["conversation"][-1].content)
+    return response
+
+##
+
+async def main(num_conversations, llm_latency, query_latency):
+    agent = agent_workflow.Agent(model=StubChatModel(llm_latency), tools=[make_stub_tool(query_latency)], system="stub system prompt")
+
+    start_time = time.perf_counter()
+    await run_conversation(agent, "single")
+    single = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[run_conversation(agent, f"parallel_{i}") for i in range(num_conversations)])
+    parallel = time.perf_counter() - start_time
+
+    print(f"----- 1 conversation: {single:.2f}s | {num_conversations} parallel conversations: {parallel:.2f}s ({parallel / single:.2f}x the time of one)")
+    return {'single': single, 'parallel': parallel}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run N parallel conversations against a stub LLM and a stub graph")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per stub LLM call")
+    parser.add_argument("--query-latency", type=float, default=0.1, help="seconds per stub graph query")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.conversations, args.llm_latency, args.query_latency))
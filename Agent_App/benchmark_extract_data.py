@@ -0,0 +1,131 @@
+"""
+Benchmark of the extract_data step on LLM_Evaluation/gpt_synthetic_data.csv: LLM extractor vs local extractor.
+
+Every synthetic conversation is paired with the output of MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o, p,
+built from Knowledge_Graph/Datasets/ONet/Formatted Parquet/formatted_interests.parquet (the synthetic data has no query outputs).
+For every row it reports the local extractor's time, whether it had to fall back to the LLM, and how many of the
+traits of the synthetic extracted_data it found.
+
+Turn latency = personality_scientist + extract_data + recommend_careers. Without --groq the LLM calls are not made
+and their latency is the --llm-latency assumption. With --groq, the LLM extractor is called for real (needs GROQ_API_KEY).
+
+Usage (from the Agent_App folder):
+    python benchmark_extract_data.py
+    python benchmark_extract_data.py --llm-latency 2.5 --output extract_benchmark.json
+    python benchmark_extract_data.py --groq
+"""
+
+import os
+import re
+import ast
+import json
+import time
+import argparse
+import pandas as pd
+from pathlib import Path
+from langchain_core.messages import HumanMessage, AIMessage
+from FastAPI_Sub_Folder.Helpers.local_extractor import TRAITS, extract_locally, identify_traits
+
+ROOT = Path(__file__).resolve().parent.parent
+SYNTHETIC_DATA_PATH = ROOT / "LLM_Evaluation" / "gpt_synthetic_data.csv"
+INTERESTS_PATH = ROOT / "Knowledge_Graph" / "Datasets" / "ONet" / "Formatted Parquet" / "formatted_interests.parquet"
+CYPHER = "MATCH (o:Occupation)-[]->(p:Personality_Trait) RETURN o, p"
+
+##
+
+def parse_conversation(text):
+    """ 'ai message: ... human message: ...' -> list of messages """
+    messages = []
+    for role, content in re.findall(r"(ai|human) message:\s*(.*?)(?=\s*(?:ai|human) message:|$)", text, flags=re.DOTALL):
+        messages.append(HumanMessage(content=content) if role == "human" else AIMessage(content=content))
+    return messages
+
+##
+
+def get_query_output():
+    """ Output of CYPHER as stored in the agent's state (JSON of the rows) """
+    df = pd.read_parquet(INTERESTS_PATH)
+    return json.dumps([{'o': {'title': occupation}, 'p': {'title': trait}} for occupation, trait in zip(df['node_1_value'], df['node_2_value'])])
+
+##
+
+def get_expected_traits(extracted_data):
+    return {item for row in ast.literal_eval(extracted_data) for item in row if item in TRAITS}
+
+##
+
+def get_llm_extractor():
+    """ Returns a function (conversation, query_output) -> extracted data calling Groq like Agent.extract_data did """
+    from langchain_groq import ChatGroq
+    from dotenv import load_dotenv
+    from FastAPI_Sub_Folder.Helpers import prompts
+    load_dotenv(dotenv_path=Path('.env'))
+    model = ChatGroq(temperature=0.7, model_name="llama-3.1-70b-versatile", max_retries=5)
+    return lambda conversation, output: model.invoke(prompts.extractor_prompt.format(queried_data=[{CYPHER: str(json.loads(output))}], conversation=conversation)).content
+
+##
+
+def run_benchmark(llm_latency, use_groq=False):
+    data = pd.read_csv(SYNTHETIC_DATA_PATH)
+    output = get_query_output()
+    llm_extractor = get_llm_extractor() if use_groq else None
+
+    results = []
+    for i, row in data.iterrows():
+        conversation = parse_conversation(row['conversation'])
+
+        start_time = time.perf_counter()
+        extracted = extract_locally([output], conversation)
+        local_seconds = time.perf_counter() - start_time
+
+        if llm_extractor is not None:
+            start_time = time.perf_counter()
+            llm_extractor(conversation, output)
+            llm_seconds = time.perf_counter() - start_time
+        else:
+            llm_seconds = llm_latency
+
+        expected = get_expected_traits(row['extracted_data'])
+        found = set(identify_traits(conversation))
+        results.append({
+            'row': i, 'local_seconds': local_seconds, 'llm_seconds': llm_seconds, 'fallback': extracted is None,
+            'extracted_edges': 0 if extracted is None else len(extracted),
+            'expected_traits': sorted(expected), 'found_traits': sorted(found),
+            'trait_precision': len(expected & found) / len(found) if len(found) > 0 else None,
+            'trait_recall': len(expected & found) / len(expected) if len(expected) > 0 else None,
+            # personality_scientist + extract_data + recommend_careers
+            'turn_seconds_before': 2 * llm_latency + llm_seconds,
+            'turn_seconds_after': 2 * llm_latency + local_seconds + (llm_seconds if extracted is None else 0),
+        })
+
+    return results
+
+##
+
+def print_summary(results, use_groq):
+    df = pd.DataFrame(results)
+    # NOTE: the synthetic extracted_data holds every trait of the occupations GPT picked, not only the user's traits
+    print(f"----- {len(df)} conversations | local extractor: {df['local_seconds'].mean() * 1000:.1f} ms on average, "
+          f"{df['fallback'].sum()} fallbacks to the LLM | traits vs synthetic data: "
+          f"{df['trait_precision'].dropna().mean():.0%} precision, {df['trait_recall'].dropna().mean():.0%} recall")
+    print(f"----- extract_data: {df['llm_seconds'].mean():.2f}s with the LLM{'' if use_groq else ' (assumed)'} -> "
+          f"{(df['local_seconds'] + df['fallback'] * df['llm_seconds']).mean():.3f}s")
+    print(f"----- Turn latency: {df['turn_seconds_before'].mean():.2f}s before -> {df['turn_seconds_after'].mean():.2f}s after")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the local extract_data fast path on the synthetic conversations")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="assumed seconds per LLM call")
+    parser.add_argument("--groq", action="store_true", help="call the Groq LLM extractor for real")
+    parser.add_argument("--output", default=None, help="save the results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.llm_latency, use_groq=args.groq)
+    for result in results:
+        print(f"row {result['row']:>2} | {result['local_seconds'] * 1000:>6.1f} ms | fallback: {str(result['fallback']):<5} | "
+              f"expected {','.join(result['expected_traits']):<40} found {','.join(result['found_traits'])}")
+    print_summary(results, args.groq)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({'llm_latency': args.llm_latency, 'groq': args.groq, 'results': results}, f, indent=2)
@@ -0,0 +1,309 @@
+"""
+Offline load test of the /messages/ endpoint: throughput and tail latency without Groq quota and without Neo4j.
+
+fast_api_server.app is started in this process (with its lifespan, middleware and routes) and called through httpx's ASGI transport:
+    - the Groq model is replaced by ScriptedChatModel: deterministic answers after --llm-latency seconds (+- --llm-jitter),
+      with tool calls on the last turn of a conversation (query_graph and recommend_occupations)
+    - Neo4j is replaced by InMemoryGraph: the edges of Knowledge_Graph/Datasets/ONet/Formatted Parquet, answered after --query-latency seconds.
+      It also gives the schema and the edges of the occupation scorer
+    - the session store is in memory, the LLM response cache is off (--llm-cache to use it) and the scheduler has no rate limit
+      (--requests-per-minute and --tokens-per-minute to test the Groq limits)
+
+Every conversation of LLM_Evaluation/gpt_synthetic_data.csv is a session: OPENING_MESSAGE, then its human messages, one turn after the other.
+The sessions run concurrently (--concurrency at a time). The report has the p50, p95 and p99 of the turn latency (all turns and per turn
+of the conversation), the requests per second, and the LLM calls, Neo4j queries and cache hits per turn (read from the X-LLM-Calls,
+X-Neo4j-Queries and X-Cache-Hits headers of the response, see metrics.py).
+The results are saved as JSON with the git commit, so that two commits can be compared with --compare.
+
+Usage (from the Agent_App folder):
+    python benchmark_load.py
+    python benchmark_load.py --repeat 10 --concurrency 50 --llm-latency 1.5 --output load_test.json
+    python benchmark_load.py --requests-per-minute 30 --tokens-per-minute 6000
+    python benchmark_load.py --output load_test_new.json --compare load_test.json
+"""
+
+import os
+import io
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# fast_api_server and agent_workflow read these at import time. Nothing connects to Groq or Neo4j
+for key, value in [("GROQ_API_KEY", "stub"), ("NEO4J_URI", "bolt://localhost:7687"), ("NEO4J_USERNAME", "neo4j"), ("NEO4J_PASSWORD", "neo4j"),
+                   ("LANGCHAIN_TRACING_V2", "false"), ("SESSION_STORE", "memory")]:
+    os.environ.setdefault(key, value)
+
+import httpx
+from langchain_core.messages import AIMessage, HumanMessage
+import fast_api_server
+from FastAPI_Sub_Folder.Helpers import agent_workflow, graph_client, llm_scheduler, metrics
+from FastAPI_Sub_Folder.Helpers.occupation_scoring import ScorerLoader, read_edges_from_parquet
+from FastAPI_Sub_Folder.Helpers.prompt_budget import estimate_tokens, message_tokens
+from benchmark_extract_data import parse_conversation, SYNTHETIC_DATA_PATH
+
+ROOT = Path(__file__).resolve().parent.parent
+PARQUET_FOLDER = ROOT / "Knowledge_Graph" / "Datasets" / "ONet" / "Formatted Parquet"
+OPENING_MESSAGE = "Hi, I would like to find a career that suits me."
+
+# Queries of the scripted tool calls, one per conversation in turn (the same query in many sessions hits the query cache)
+QUERIES = [
+    "MATCH (o:Occupation)-[r]->(p:Personality_Trait) RETURN o, r, p",
+    "MATCH (o:Occupation)-[r]->(s:Basic_Skill) RETURN o, r, s",
+]
+PROFILES = [
+    {"Realistic": 1, "Investigative": 0.5},
+    {"Artistic": 1, "Social": 0.7, "Writing": 0.5},
+    {"Enterprising": 1, "Speaking": 0.8},
+    {"Investigative": 1, "Mathematics": 0.8, "Critical_Thinking": 0.5},
+]
+
+##
+
+class ScriptedChatModel:
+    """
+    Deterministic stand-in of ChatGroq. Every answer takes latency * (1 +- jitter) seconds, the jitter being read from the hash of the input.
+    personality_scientist: asks a question, or on the query_after-th human message asks for a query and a scoring (one per turn at most)
+    extractor prompt (str): answers with the traits, recommend_careers: answers with text
+    """
+
+    def __init__(self, latency, jitter=0.0, query_after=3):
+        self.latency = latency
+        self.jitter = jitter
+        self.query_after = query_after
+        self.calls = 0
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def get_latency(self, content):
+        fraction = int(hashlib.sha256(content.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return self.latency * (1 + self.jitter * (2 * fraction - 1))
+
+    def answer(self, model_input):
+        if isinstance(model_input, str): return "Realistic: high, Investigative: medium"
+        if metrics.current_node.get() == "recommend_careers": return "Here are careers that suit you: Geologists, Civil Engineers and Surveyors."
+
+        human_messages = [message for message in model_input if isinstance(message, HumanMessage)]
+        asked_this_turn = any(isinstance(message, AIMessage) and len(message.tool_calls) > 0 for message in model_input[model_input.index(human_messages[-1]):])
+        if len(human_messages) < self.query_after or asked_this_turn:
+            return f"Question {len(human_messages)}: what do you enjoy doing in your free time?"
+
+        # Same script for the same conversation
+        index = int(hashlib.sha256(human_messages[0].content.encode("utf-8")).hexdigest()[:8], 16)
+        return AIMessage(content="Let me look at the knowledge graph.", tool_calls=[
+            {'name': 'query_graph', 'args': {'query': QUERIES[index % len(QUERIES)]}, 'id': f"call_query_{self.calls}"},
+            {'name': 'recommend_occupations', 'args': {'profile': PROFILES[index % len(PROFILES)], 'k': 6}, 'id': f"call_scoring_{self.calls}"},
+        ])
+
+    async def ainvoke(self, model_input, **kwargs):
+        self.calls += 1
+        content = model_input if isinstance(model_input, str) else json.dumps([str(message.content) for message in model_input])
+        await asyncio.sleep(self.get_latency(content))
+
+        response = self.answer(model_input)
+        if isinstance(response, str): response = AIMessage(content=response)
+        prompt_tokens = estimate_tokens(model_input) if isinstance(model_input, str) else sum(map(message_tokens, model_input))
+        completion_tokens = estimate_tokens(response.content)
+        response.usage_metadata = {'input_tokens': prompt_tokens, 'output_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+        return response
+
+##
+
+class InMemoryGraph:
+    """
+    Stand-in of the graph, built from the formatted parquet files. Takes the place of the query guard (same run method):
+    a query gets the edges from Occupation to the other label of its MATCH, after latency seconds
+    """
+
+    def __init__(self, edges, latency):
+        self.edges = edges # (occupation, label, title, relation)
+        self.latency = latency
+        self.calls = 0
+
+    async def run(self, query):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        labels = [label for label in {edge[1] for edge in self.edges} if f":{label})" in query]
+        return [{'o': {'title': occupation}, 'r': relation, 'p': {'title': title}} for occupation, label, title, relation in self.edges if label in labels]
+
+    async def load_edges(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.edges
+
+    def get_schema(self):
+        """ Structured schema, as Neo4jGraph.structured_schema """
+        labels = sorted({edge[1] for edge in self.edges})
+        relationships = sorted({(edge[1], edge[3]) for edge in self.edges})
+        return {
+            'node_props': {label: [{'property': 'title', 'type': 'STRING'}] for label in ['Occupation'] + labels},
+            'rel_props': {},
+            'relationships': [{'start': 'Occupation', 'type': relation, 'end': label} for label, relation in relationships],
+            'metadata': {'constraint': [], 'index': []},
+        }
+
+##
+
+def load_conversations(repeat=1):
+    """ Human messages of every synthetic conversation, with OPENING_MESSAGE first """
+    df = pd.read_csv(SYNTHETIC_DATA_PATH)
+    conversations = []
+    for text in df['conversation']:
+        conversations.append([OPENING_MESSAGE] + [message.content for message in parse_conversation(str(text)) if isinstance(message, HumanMessage)])
+    return conversations * repeat
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_percentiles(values):
+    if len(values) == 0: return {'p50': None, 'p95': None, 'p99': None, 'mean': None, 'max': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'mean': float(np.mean(values)), 'max': float(np.max(values))}
+
+##
+
+async def run_session(client, messages, session_index, semaphore):
+    """ Sends the messages of one conversation one after the other. Returns one record per turn """
+    turns = []
+    async with semaphore:
+        session_id = None
+        for turn_index, message in enumerate(messages):
+            start_time = time.perf_counter()
+            response = await client.post("/messages/", json={'message': message, 'session_id': session_id})
+            seconds = time.perf_counter() - start_time
+
+            output = response.json() if response.status_code == 200 else None
+            ok = isinstance(output, dict) # the endpoint answers with a string when the turn failed
+            if ok: session_id = output['session_id']
+            turns.append({
+                'session': session_index, 'turn': turn_index, 'seconds': seconds, 'ok': ok, 'status_code': response.status_code,
+                'error': None if ok else str(output if output is not None else response.text)[:200],
+                'llm_calls': int(response.headers.get('X-LLM-Calls', 0)), 'neo4j_queries': int(response.headers.get('X-Neo4j-Queries', 0)),
+                'cache_hits': int(response.headers.get('X-Cache-Hits', 0)), 'prompt_tokens': int(response.headers.get('X-Prompt-Tokens', 0)),
+                'completion_tokens': int(response.headers.get('X-Completion-Tokens', 0)),
+            })
+            if not ok: break # the next turns of this conversation would not mean anything
+    return turns
+
+def summarize(turns, seconds):
+    ok_turns = [turn for turn in turns if turn['ok']]
+    summary = {
+        'turns': len(turns), 'errors': len(turns) - len(ok_turns), 'sessions': len({turn['session'] for turn in turns}), 'seconds': seconds,
+        'requests_per_second': len(turns) / seconds if seconds > 0 else None,
+        'latency': get_percentiles([turn['seconds'] for turn in ok_turns]),
+        'latency_by_turn': {},
+    }
+    for key in ['llm_calls', 'neo4j_queries', 'cache_hits', 'prompt_tokens', 'completion_tokens']:
+        summary[f"{key}_per_turn"] = float(np.mean([turn[key] for turn in ok_turns])) if len(ok_turns) > 0 else None
+    for turn_index in sorted({turn['turn'] for turn in ok_turns}):
+        values = [turn for turn in ok_turns if turn['turn'] == turn_index]
+        summary['latency_by_turn'][turn_index] = {**get_percentiles([turn['seconds'] for turn in values]),
+                                                  'llm_calls': float(np.mean([turn['llm_calls'] for turn in values])),
+                                                  'neo4j_queries': float(np.mean([turn['neo4j_queries'] for turn in values]))}
+    return summary
+
+def print_summary(summary):
+    latency = summary['latency']
+    print(f"----- {summary['turns']} turns of {summary['sessions']} sessions in {summary['seconds']:.2f}s: {summary['requests_per_second']:.2f} requests/s, {summary['errors']} errors")
+    if latency['p50'] is not None:
+        print(f"----- Turn latency: p50 {latency['p50']:.3f}s | p95 {latency['p95']:.3f}s | p99 {latency['p99']:.3f}s | max {latency['max']:.3f}s")
+        print(f"----- Per turn: {summary['llm_calls_per_turn']:.2f} LLM calls, {summary['neo4j_queries_per_turn']:.2f} Neo4j queries, "
+              f"{summary['cache_hits_per_turn']:.2f} cache hits, {summary['prompt_tokens_per_turn']:.0f} prompt tokens")
+    for turn_index, values in summary['latency_by_turn'].items():
+        print(f"      turn {turn_index}: p50 {values['p50']:.3f}s | p95 {values['p95']:.3f}s | p99 {values['p99']:.3f}s | "
+              f"{values['llm_calls']:.2f} LLM calls | {values['neo4j_queries']:.2f} Neo4j queries")
+
+## Differences with the results of another run (example: the previous commit)
+def print_comparison(summary, previous):
+    print(f"----- Compared with {previous.get('commit')} ({previous['config']}):")
+    rows = [("requests/s", ['requests_per_second']), ("p50", ['latency', 'p50']), ("p95", ['latency', 'p95']), ("p99", ['latency', 'p99']),
+            ("LLM calls/turn", ['llm_calls_per_turn']), ("Neo4j queries/turn", ['neo4j_queries_per_turn']), ("errors", ['errors'])]
+    for name, path in rows:
+        new, old = summary, previous['summary']
+        for key in path: new, old = new[key], old[key]
+        if new is None or old is None: continue
+        change = f" ({(new - old) / old * 100:+.1f}%)" if old != 0 else ""
+        print(f"      {name}: {old:.3f} -> {new:.3f}{change}")
+
+##
+
+async def main(args):
+    edges = read_edges_from_parquet(PARQUET_FOLDER)
+    graph = InMemoryGraph(edges, args.query_latency)
+    model = ScriptedChatModel(args.llm_latency, jitter=args.llm_jitter, query_after=args.query_after)
+
+    # Replace Groq and Neo4j, before the app starts
+    fast_api_server.model = model
+    fast_api_server.helper_model = model
+    fast_api_server.LLM_CACHE_PATH = args.llm_cache or ""
+    fast_api_server.scheduler = llm_scheduler.LLMScheduler(requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+                                                           deadline=fast_api_server.LLM_QUEUE_DEADLINE_SECONDS)
+    graph_client.schema = {'version': "in_memory", 'structured_schema': graph.get_schema(), 'saved_at': time.time()}
+    agent_workflow.query_guard = graph
+    agent_workflow.query_cache.version_getter = None
+    agent_workflow.scorer_loader = ScorerLoader(graph.load_edges)
+    if args.no_query_cache: agent_workflow.query_cache.max_entries = 0
+
+    conversations = load_conversations(args.repeat)
+    semaphore = asyncio.Semaphore(args.concurrency or len(conversations))
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()) # the agent prints every step
+
+    with quiet:
+        async with fast_api_server.lifespan(fast_api_server.app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=fast_api_server.app), base_url="http://load-test", timeout=None) as client:
+                start_time = time.perf_counter()
+                sessions = await asyncio.gather(*[run_session(client, messages, i, semaphore) for i, messages in enumerate(conversations)])
+                seconds = time.perf_counter() - start_time
+                scheduler_stats = fast_api_server.scheduler.stats()
+                query_cache_stats = agent_workflow.query_cache.stats()
+
+    turns = [turn for session in sessions for turn in session]
+    summary = summarize(turns, seconds)
+    summary['stub_llm_calls'] = model.calls
+    summary['stub_graph_calls'] = graph.calls
+    print_summary(summary)
+
+    results = {
+        'commit': get_commit(), 'started_at': time.time(),
+        'config': {key: value for key, value in vars(args).items() if key not in ['output', 'compare', 'verbose']},
+        'summary': summary, 'scheduler': scheduler_stats, 'query_cache': query_cache_stats, 'turns': turns,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"----- Results saved in {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(summary, json.load(f))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the synthetic conversations as concurrent sessions against /messages/, with a stub LLM and an in-memory graph")
+    parser.add_argument("--repeat", type=int, default=1, help="sessions per synthetic conversation")
+    parser.add_argument("--concurrency", type=int, default=None, help="sessions running at the same time (default: all)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per stub LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="the stub LLM latency varies by +- this fraction, the same for the same input")
+    parser.add_argument("--query-latency", type=float, default=0.05, help="seconds per in-memory graph query")
+    parser.add_argument("--query-after", type=int, default=3, help="the stub LLM asks for a query on this human message")
+    parser.add_argument("--requests-per-minute", type=int, default=None, help="LLM scheduler limit (default: no limit)")
+    parser.add_argument("--tokens-per-minute", type=int, default=None, help="LLM scheduler limit (default: no limit)")
+    parser.add_argument("--llm-cache", default=None, help="SQLite file of the LLM response cache (default: no cache)")
+    parser.add_argument("--no-query-cache", action="store_true", help="every query reaches the graph")
+    parser.add_argument("--output", default="load_test.json")
+    parser.add_argument("--compare", default=None, help="results of a previous run to compare with")
+    parser.add_argument("--verbose", action="store_true", help="show the prints of the agent")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,105 @@
+"""
+Startup time of the FastAPI server's agent: import time and cold start (Neo4j client + graph schema).
+
+Every measure runs in a new Python process, so that nothing is already imported or connected:
+    - import: import of agent_workflow (no connection to Neo4j since the driver is created on first use)
+    - before: what the startup used to do, two Neo4jGraph() (one in agent_workflow, one in fast_api_server), each reading the schema
+      (needs langchain and langchain_community)
+    - after, no snapshot: the one async driver, the schema is read once and saved in the snapshot file
+    - after, with snapshot: the one async driver, the data version is read and the schema comes from the snapshot file
+    - after, snapshot only: the snapshot file without reading the data version (no connection to Neo4j)
+
+The other cold start measures need Neo4j (NEO4J_URI, NEO4J_USERNAME, NEO4J_PASSWORD in .env), they are reported as failed otherwise.
+
+Usage (from the Agent_App folder):
+    python benchmark_startup.py
+    python benchmark_startup.py --repeat 5
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from statistics import median
+
+SETUP = """
+import os, time, json
+from dotenv import load_dotenv
+load_dotenv('.env')
+for key, value in [("NEO4J_URI", "bolt://localhost:7687"), ("NEO4J_USERNAME", "neo4j"), ("NEO4J_PASSWORD", "neo4j"), ("LANGCHAIN_TRACING_V2", "false")]:
+    os.environ.setdefault(key, value)
+start_time = time.perf_counter()
+"""
+
+MEASURES = {
+    'import': """
+from FastAPI_Sub_Folder.Helpers import agent_workflow
+""",
+    'before': """
+from FastAPI_Sub_Folder.Helpers import agent_workflow
+from langchain.graphs import Neo4jGraph
+schema = [Neo4jGraph().structured_schema for _ in range(2)][-1]
+""",
+    'after, no snapshot': """
+import asyncio
+from FastAPI_Sub_Folder.Helpers import agent_workflow, graph_client
+async def main():
+    try: return await graph_client.refresh_schema()
+    finally: await graph_client.close()
+schema = asyncio.run(main())
+""",
+    'after, with snapshot': """
+import asyncio
+from FastAPI_Sub_Folder.Helpers import agent_workflow, graph_client
+async def main():
+    try: return await graph_client.load_schema()
+    finally: await graph_client.close()
+schema = asyncio.run(main())
+""",
+    'after, snapshot only': """
+import asyncio
+from FastAPI_Sub_Folder.Helpers import agent_workflow, graph_client
+schema = asyncio.run(graph_client.load_schema(check_version=False))
+""",
+}
+
+##
+
+def run_measure(code, snapshot_path):
+    """ Seconds taken by code in a new process, or the error it raised """
+    script = SETUP + code + "\nprint(json.dumps({'seconds': time.perf_counter() - start_time}))"
+    process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                             env={**os.environ, "SCHEMA_SNAPSHOT_PATH": str(snapshot_path)}, cwd=Path(__file__).resolve().parent)
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith("{"): return json.loads(line)['seconds'], None
+    return None, (process.stderr.strip().splitlines() or ["no output"])[-1]
+
+##
+
+def run_benchmark(repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        snapshot_path = Path(folder) / "graph_schema.json"
+        for name, code in MEASURES.items():
+            seconds, error = [], None
+            for _ in range(repeat):
+                # the "no snapshot" measure writes the snapshot used by the "with snapshot" one
+                if name == 'after, no snapshot' and snapshot_path.exists(): snapshot_path.unlink()
+                value, error = run_measure(code, snapshot_path)
+                if value is None: break
+                seconds.append(value)
+            results[name] = {'seconds': median(seconds) if len(seconds) > 0 else None, 'error': error if len(seconds) == 0 else None}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time and the cold start of the agent")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of every measure, the median is reported")
+    args = parser.parse_args()
+
+    for name, result in run_benchmark(args.repeat).items():
+        if result['seconds'] is not None: print(f"----- {name:<22} {result['seconds']:.3f}s")
+        else: print(f"----- {name:<22} failed: {result['error']}")
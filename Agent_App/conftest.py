@@ -0,0 +1,17 @@
+"""
+Setup of the tests of the FastAPI helpers (FastAPI_Sub_Folder/Helpers/test_*.py). They run without Groq and without Neo4j.
+
+Usage (from the Agent_App folder):
+    python -m pytest -q
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# The helpers are imported as FastAPI_Sub_Folder.Helpers.<module>, like in fast_api_server.py
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# agent_workflow reads these at import time. The tests do not connect to Neo4j
+for key, value in [("NEO4J_URI", "bolt://localhost:7687"), ("NEO4J_USERNAME", "neo4j"), ("NEO4J_PASSWORD", "neo4j"), ("LANGCHAIN_TRACING_V2", "false")]:
+    os.environ.setdefault(key, value)
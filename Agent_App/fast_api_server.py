@@ -1,15 +1,19 @@
 ## FastAPI
+import uuid
+import json
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
+from typing import Optional
+from contextlib import asynccontextmanager
 
 ## LangChain
 from langchain_groq import ChatGroq
-from langchain.graphs import Neo4jGraph
 from langchain_core.messages import HumanMessage
 
 ## LangGraph
-from FastAPI_Sub_Folder.Helpers import agent_workflow, prompts
+from FastAPI_Sub_Folder.Helpers import agent_workflow, prompts, session_store, output_store, graph_client, llm_cache, llm_scheduler, metrics
 
 ## Environment Variables
 import os
@@ -26,62 +30,225 @@ os.environ["GROQ_API_KEY"] = os.getenv('GROQ_API_KEY')
 os.environ["NEO4J_URI"] = os.getenv('NEO4J_URI')
 os.environ["NEO4J_USERNAME"] = os.getenv('NEO4J_USERNAME')
 os.environ["NEO4J_PASSWORD"] = os.getenv('NEO4J_PASSWORD')
-graph = Neo4jGraph()
+
+# Session store: "memory" (bounded, lost on restart) or "sqlite" (persistent)
+SESSION_STORE = os.getenv('SESSION_STORE', 'memory')
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', 'sessions.sqlite')
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', 1000))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 24 * 3600))
+
+# Full outputs of the queries, kept in memory out of the sessions' state (see output_store.py)
+GRAPH_OUTPUTS_MAX_BYTES = int(os.getenv('GRAPH_OUTPUTS_MAX_BYTES', 256 * 1024 * 1024))
+GRAPH_OUTPUTS_MAX_BYTES_PER_SESSION = int(os.getenv('GRAPH_OUTPUTS_MAX_BYTES_PER_SESSION', 16 * 1024 * 1024))
+
+# Cache of the LLM's answers to the helper steps (cypher comparison, data extraction). LLM_CACHE_PATH="" disables it
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite')
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Local, deterministic extract_data step instead of the LLM when it can decide (see local_extractor.py). Off unless LOCAL_EXTRACTION=true
+LOCAL_EXTRACTION = os.getenv('LOCAL_EXTRACTION', 'false').lower() == 'true'
+
+# Rate limits of the Groq plan, shared by every session. A request waiting longer than LLM_QUEUE_DEADLINE_SECONDS fails
+GROQ_REQUESTS_PER_MINUTE = int(os.getenv('GROQ_REQUESTS_PER_MINUTE', 30))
+GROQ_TOKENS_PER_MINUTE = int(os.getenv('GROQ_TOKENS_PER_MINUTE', 6000))
+LLM_QUEUE_DEADLINE_SECONDS = float(os.getenv('LLM_QUEUE_DEADLINE_SECONDS', 60))
 
 ##############################
 # Initialize model and agent #
 ##############################
-model = ChatGroq(temperature=0.7, model_name="llama-3.1-70b-versatile", max_retries=5, verbose=True)
+model = ChatGroq(temperature=0.7, model_name="llama-3.1-70b-versatile", max_retries=0, verbose=True) # the scheduler retries, for every session at once
 # model = ChatGroq(temperature=0.7, model_name="llama3-70b-8192")
-agent = agent_workflow.Agent(
-    model=model, 
-    tools=[agent_workflow.query_graph], 
-    system=prompts.personality_scientist_prompt.format(schema=graph.structured_schema)
-    )
-
-# Function to send a message to groq and recive its outputs
-def send_user_message(user_message):
-    config = {"configurable": {"thread_id": "1"}}
+helper_model = ChatGroq(temperature=0, model_name="llama-3.1-70b-versatile", max_retries=0) # cypher comparison and data extraction, its answers are cached
+agent = None # created at startup, since the session store may need the event loop
+scheduler = llm_scheduler.LLMScheduler(requests_per_minute=GROQ_REQUESTS_PER_MINUTE, tokens_per_minute=GROQ_TOKENS_PER_MINUTE, deadline=LLM_QUEUE_DEADLINE_SECONDS)
+
+# Nodes whose start and end are streamed, and the ones whose LLM tokens are the agent's answer
+STREAMED_NODES = ["personality_scientist", "validate_cypher_then_query_graph", "extract_data", "recommend_careers"]
+RESPONSE_NODES = ["personality_scientist", "recommend_careers"]
+
+# Function to send a message to groq and recive its outputs. Async so that a slow LLM call does not block the other requests
+# NOTE: every session_id is its own conversation
+async def send_user_message(user_message, session_id):
+    config = {"configurable": {"thread_id": session_id}}
     response = []
-    for event in agent.graph.stream({"conversation": [user_message], "graph_data_to_be_used": []}, config, stream_mode="values"):
+    async for event in agent.graph.astream({"conversation": [user_message], "graph_data_to_be_used": []}, config, stream_mode="values"):
         response.append(event["conversation"][-1].content)
     
-    state = agent.graph.get_state(config=config).values
+    return await get_turn_output(session_id, response)
+
+# Output of a turn, read from the session's state
+async def get_turn_output(session_id, response):
+    config = {"configurable": {"thread_id": session_id}}
+    state = (await agent.graph.aget_state(config=config)).values
     
     return {
+        "session_id": session_id,
         "response": response, 
-        "good_cypher_and_outputs": state['good_cypher_and_outputs'],
+        "good_cypher_and_outputs": state['good_cypher_and_outputs'], # the full outputs are read from /sessions/{session_id}/graph_outputs
         "extracted_data": state['extracted_data'],
         "graph_data_to_be_used": state['graph_data_to_be_used']
         }
 
+## One Server-Sent Event
+def to_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Same as send_user_message, but yields Server-Sent Events as the workflow runs:
+#   node_start / node_end: {node}, token: {node, content} (LLM tokens of the answer), done: output of the turn, error: {message, status_code}
+async def stream_user_message(user_message, session_id):
+    config = {"configurable": {"thread_id": session_id}}
+    response = []
+    request_metrics = metrics.current_request.get() # the headers were sent before the stream, the measures go in the done event
+    try:
+        async for event in agent.graph.astream_events({"conversation": [user_message], "graph_data_to_be_used": []}, config, version="v2"):
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            if event["event"] == "on_chain_start" and event["name"] in STREAMED_NODES and node == event["name"]:
+                yield to_sse("node_start", {"node": node})
+
+            elif event["event"] == "on_chain_end" and event["name"] in STREAMED_NODES and node == event["name"]:
+                output = event["data"].get("output")
+                if node in RESPONSE_NODES and isinstance(output, dict) and len(output.get("conversation", [])) > 0:
+                    response.append(output["conversation"][-1].content)
+                yield to_sse("node_end", {"node": node})
+
+            elif event["event"] == "on_chat_model_stream" and node in RESPONSE_NODES:
+                content = event["data"]["chunk"].content
+                if isinstance(content, str) and content != "": yield to_sse("token", {"node": node, "content": content})
+
+        output = await get_turn_output(session_id, response)
+        if request_metrics is not None: output["metrics"] = request_metrics.summary()
+        yield to_sse("done", output)
+
+    except Exception as e:
+        print("-----------------")
+        print(e)
+        print("-----------------")
+        yield to_sse("error", {"message": str(e), "status_code": getattr(getattr(e, "response", None), "status_code", None)})
+
+    finally: # a failed or interrupted stream is measured too
+        if request_metrics is not None: request_metrics.finish()
+
 
 ##################
 # Initialize app #
 ##################
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    global agent
+    checkpointer = await session_store.create_checkpointer(SESSION_STORE, path=SESSION_STORE_PATH, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+    schema = await graph_client.load_schema() # from the snapshot file while the graph data version is the same
+    response_cache = llm_cache.LLMResponseCache(LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES) if LLM_CACHE_PATH else None
+    agent = agent_workflow.Agent(
+        model=model, 
+        helper_model=helper_model,
+        tools=[agent_workflow.query_graph, agent_workflow.recommend_occupations], 
+        system=prompts.personality_scientist_prompt.format(schema=schema),
+        checkpointer=checkpointer,
+        llm_cache=response_cache,
+        scheduler=scheduler,
+        local_extraction=LOCAL_EXTRACTION,
+        output_store=output_store.GraphOutputStore(max_sessions=MAX_SESSIONS, max_bytes=GRAPH_OUTPUTS_MAX_BYTES, max_bytes_per_session=GRAPH_OUTPUTS_MAX_BYTES_PER_SESSION)
+        )
+    yield
+    await checkpointer.aclose()
+    if response_cache is not None: response_cache.close()
+    await graph_client.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Every request is measured (see metrics.py): timing headers, request duration histogram and local trace
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    request_metrics = metrics.RequestMetrics(route=request.url.path)
+    token = metrics.current_request.set(request_metrics)
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.current_request.reset(token)
+
+    if response.headers.get("content-type", "").startswith("text/event-stream"): # still running, its measures go in the done event
+        return response
+    response.headers.update(request_metrics.headers())
+    request_metrics.finish()
+    return response
+
+# Gauges read when /metrics is scraped
+def collect_gauges():
+    scheduler_stats = scheduler.stats()
+    cache_stats = agent_workflow.query_cache.stats()
+    return (metrics.gauge_lines("personabot_llm_queue_depth", "LLM requests waiting in the scheduler", scheduler_stats['queue_depth'])
+            + metrics.gauge_lines("personabot_llm_in_flight", "LLM requests running", scheduler_stats['in_flight'])
+            + metrics.gauge_lines("personabot_query_cache_entries", "Queries in the query cache", cache_stats['entries'])
+            + metrics.gauge_lines("personabot_query_cache_bytes", "Size of the outputs in the query cache", cache_stats['bytes']))
+
+metrics.collectors.append(collect_gauges)
 
 class Messages(BaseModel):
     message: str
+    session_id: Optional[str] = None # a new session is created if it is not given
 
 
 @app.post("/messages/")
 async def call_agent(request: Messages):
     try:
         user_message = HumanMessage(content=request.message)
-        ai_response = send_user_message(user_message)
+        ai_response = await send_user_message(user_message, session_id=request.session_id or uuid.uuid4().hex)
         return ai_response
     except Exception as e:
         
         print("-----------------")
         print(e)
         print("-----------------")
+        if isinstance(e, llm_scheduler.LLMQueueTimeout): return "The agent is busy, try again in a minute."
+        if isinstance(e, llm_scheduler.LLMRateLimited): return "Rate limit reached for model"
+        if not hasattr(e, "response"): return "Internal Server Error"
         if e.response.status_code == 400: return "Agent failed to call the function. Try to better explain what you want."
         elif e.response.status_code == 422: return "Unprocessable Entry"
         elif e.response.status_code == 429: return "Rate limit reached for model"
         elif e.response.status_code == 500: return "Internal Server Error"
         elif e.response.status_code == 503: return "Internal Server Error"
 
+# Streaming version of /messages/: Server-Sent Events (see stream_user_message)
+@app.post("/messages/stream")
+async def stream_agent(request: Messages):
+    user_message = HumanMessage(content=request.message)
+    return StreamingResponse(stream_user_message(user_message, session_id=request.session_id or uuid.uuid4().hex), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Read the graph's schema again (example: after changing the graph without writing a new data version) and use it in the next turns
+@app.post("/schema/refresh")
+async def refresh_schema():
+    schema = await graph_client.refresh_schema()
+    agent.system = prompts.personality_scientist_prompt.format(schema=schema)
+    return {"data_version": graph_client.schema['version'], "saved_at": graph_client.schema['saved_at']}
+
+# Number of sessions and memory used by the session store and by the full outputs of the queries
+@app.get("/sessions/stats")
+async def get_session_stats():
+    return {**await agent.checkpointer.astats(), "graph_outputs": agent.output_store.stats()}
+
+# Full outputs of the queries of a session (the state only has the compacted ones): {cypher code: output as JSON}. Used by the Streamlit graph page
+@app.get("/sessions/{session_id}/graph_outputs")
+async def get_graph_outputs(session_id: str):
+    return {"session_id": session_id, "graph_outputs": agent.output_store.get_session(session_id)}
+
+# Hits, misses and size of the LLM response cache
+@app.get("/llm_cache/stats")
+async def get_llm_cache_stats():
+    cache = agent.helper_model.cache if isinstance(agent.helper_model, llm_cache.CachedChatModel) else None
+    return cache.stats() if cache is not None else {"enabled": False}
+
+# Queue depth, wait times and retries of the LLM scheduler
+@app.get("/llm_scheduler/stats")
+async def get_llm_scheduler_stats():
+    return scheduler.stats()
+
+# Prometheus metrics of the agent
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Only run this if the script is executed directly (not inside a notebook or interactive shell)
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -14,6 +14,9 @@ if not ("pages" and "current_page") in st.session_state:
 if "messages" not in st.session_state:
   st.session_state.messages = []
 
+if "session_id" not in st.session_state:
+  st.session_state.session_id = None # given by the API on the first message
+
 if not ("graph_data_to_be_used") in st.session_state:
   st.session_state.graph_data_to_be_used = []
 
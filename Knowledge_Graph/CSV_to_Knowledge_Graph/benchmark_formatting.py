@@ -0,0 +1,123 @@
+"""
+Benchmark of format_functions.py against the per-row loops of format_csvs.ipynb.
+Both versions format the same combined CSVs, their outputs are compared and the timings are printed.
+
+Usage:
+  python benchmark_formatting.py                    # every table, every row (the loops take a few minutes)
+  python benchmark_formatting.py --rows 2000        # only the first 2000 rows of each combined CSV
+"""
+
+import re
+import time
+import argparse
+import pandas as pd
+from format_functions import DATASETS_FOLDER, FORMATTERS, to_formatted_csv
+
+##
+## Loops copied from format_csvs.ipynb
+##
+
+def evaluate_importance(importance, relation_root_label):
+  if importance == "Not available": relation_name = f"low_{relation_root_label}"
+  elif int(importance) >= 80: relation_name = f"strong_{relation_root_label}"
+  elif int(importance) <= 40: relation_name = f"low_{relation_root_label}"
+  else: relation_name = f"medium_{relation_root_label}"
+
+  return relation_name
+
+def get_personality_traits(coded_traits:str):
+  personality_traits=['Social', 'Realistic', 'Investigative', 'Enterprising', 'Conventional', 'Artistic']
+  decoded_traits = []
+  for letter in coded_traits:
+    if letter == "S": personality_trait = personality_traits[0]
+    elif letter == "R": personality_trait = personality_traits[1]
+    elif letter == "I": personality_trait = personality_traits[2]
+    elif letter == "E": personality_trait = personality_traits[3]
+    elif letter == "C": personality_trait = personality_traits[4]
+    elif letter == "A": personality_trait = personality_traits[5]
+
+    decoded_traits.append(personality_trait)
+
+  return decoded_traits
+
+def preprocess_string(text):
+  text = re.sub(r"[ -]", "_", text)
+  return text
+
+def loop_format_with_importance(df, item_column, relation_root_label, node_2_label=None, category_as_property=False):
+  formatted = pd.DataFrame(columns=['Node_1', 'Node_2', 'Relation'])
+
+  for i in range(len(df)):
+    level = df.loc[i, 'Level']
+    occupation = preprocess_string(df.loc[i, 'Occupation'])
+    item = preprocess_string(df.loc[i, item_column])
+    category = preprocess_string(df.loc[i, 'Category'])
+
+    importance = df.loc[i, 'Importance']
+    importance = importance.item() if hasattr(importance, 'item') else importance # numpy >= 2 would write np.int64(97)
+    relation_label = evaluate_importance(importance=importance, relation_root_label=relation_root_label)
+
+    properties = {'title': item, 'category': category} if category_as_property else {'title': item}
+    formatted.loc[i, "Node_1"] = str({'label': 'Occupation', 'properties': str({'title': occupation}), 'identifier': str({'title': occupation})})
+    formatted.loc[i, "Node_2"] = str({'label': node_2_label or category, 'properties': str(properties), 'identifier': str({'title': item})})
+    formatted.loc[i, "Relation"] = str({'label': relation_label, 'properties': str({'importance': importance, 'level': level})})
+
+  return formatted
+
+def loop_format_interests(df):
+  formatted = pd.DataFrame(columns=['Node_1', 'Node_2', 'Relation'])
+  index = -1
+
+  for i in range(len(df)):
+    occupation = preprocess_string(df.loc[i, 'Occupation'])
+    decoded_personality_traits = get_personality_traits(coded_traits=df.loc[i, 'Interest Code'])
+
+    for trait in decoded_personality_traits:
+      index += 1
+      formatted.loc[index, "Node_1"] = str({'label': 'Occupation', 'properties': str({'title': occupation}), 'identifier': str({'title': occupation})})
+      formatted.loc[index, "Node_2"] = str({'label': 'Personality_Trait', 'properties': str({'title': trait}), 'identifier': str({'title': trait})})
+      formatted.loc[index, "Relation"] = str({'label': 'need_for_personality_trait'})
+
+  return formatted
+
+LOOP_FORMATTERS = {
+  'abilities': lambda df: loop_format_with_importance(df, 'Ability', 'need_for_ability'),
+  'basic_skills': lambda df: loop_format_with_importance(df, 'Skill', 'need_for_basic_skill', node_2_label='Basic Skill'),
+  'cross_functional_skills': lambda df: loop_format_with_importance(df, 'Skill', 'need_for_cross_functional_skill'),
+  'interests': loop_format_interests,
+  'knowledge': lambda df: loop_format_with_importance(df, 'Knowledge', 'need_for_knowledge_in', node_2_label='Knowledge', category_as_property=True),
+}
+
+##
+
+def benchmark(name, rows=None):
+  """ Time both versions on one table and check that they write the same CSV """
+  file_name, formatter = FORMATTERS[name]
+  df = pd.read_csv(DATASETS_FOLDER / "Combined CSVs" / file_name)
+  if rows is not None: df = df[:rows]
+
+  start_time = time.perf_counter()
+  loop_output = LOOP_FORMATTERS[name](df).to_csv()
+  loop_seconds = time.perf_counter() - start_time
+
+  start_time = time.perf_counter()
+  # the notebook's preprocess_string replaces "-" as well
+  vectorized_output = to_formatted_csv(formatter(df, replace_hyphens=True)).to_csv()
+  vectorized_seconds = time.perf_counter() - start_time
+
+  same = loop_output == vectorized_output
+  print(f"----- {name:<25} {len(df):>6} rows | loops: {loop_seconds:8.2f}s | vectorized: {vectorized_seconds:6.3f}s | "
+        f"speedup: {loop_seconds / vectorized_seconds:6.0f}x | identical output: {same}")
+
+  return {'rows': len(df), 'loop_seconds': loop_seconds, 'vectorized_seconds': vectorized_seconds, 'identical': same}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark format_functions.py against the notebook loops")
+  parser.add_argument("--rows", type=int, default=None, help="only format the first N rows of each table")
+  parser.add_argument("--tables", nargs="+", choices=list(FORMATTERS.keys()), default=list(FORMATTERS.keys()))
+  args = parser.parse_args()
+
+  results = {name: benchmark(name, rows=args.rows) for name in args.tables}
+  if not all(result['identical'] for result in results.values()):
+    raise SystemExit("The vectorized output differs from the notebook loops")
@@ -0,0 +1,115 @@
+"""
+Benchmark of the graph loaders on the real formatted files under Knowledge_Graph/Datasets/ONet.
+
+By default the loaders run against fake_neo4j.FakeDriver, which records the queries, sessions and transactions
+and can simulate a round-trip latency. With --neo4j they run against the database of the .env file instead.
+For every (file, loader) the benchmark reports rows/sec, queries per row, transactions per row and peak memory.
+
+Usage:
+  python benchmark_ingestion.py                                   # every file and loader, no latency
+  python benchmark_ingestion.py --latency-ms 2 --rows 500         # simulate a 2ms round trip on the first 500 rows
+  python benchmark_ingestion.py --loaders bulk bulk_cache --output results.json
+  python benchmark_ingestion.py --neo4j --rows 500                # NOTE: writes into the configured database
+"""
+
+import os
+import json
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+from contextlib import redirect_stdout
+from io import StringIO
+from dotenv import load_dotenv
+from fake_neo4j import FakeDriver
+from columnar_format import read_formatted
+from graph_functions import connect_to_database, populate_graph, bulk_populate_graph, NodeCache
+
+DATASETS_FOLDER = Path(__file__).resolve().parent.parent / "Datasets" / "ONet"
+
+##
+
+def get_files():
+  return sorted((DATASETS_FOLDER / "Formatted CSVs").glob("formatted_*.csv")) + sorted((DATASETS_FOLDER / "Formatted Parquet").glob("formatted_*.parquet"))
+
+# name: function(driver, path, rows, batch_size)
+LOADERS = {
+  'populate_graph': lambda driver, path, rows, batch_size: populate_graph(driver, read_formatted(path)[:rows]),
+  'populate_graph_cache': lambda driver, path, rows, batch_size: populate_graph(driver, read_formatted(path)[:rows], node_cache=NodeCache()),
+  'bulk': lambda driver, path, rows, batch_size: bulk_populate_graph(driver, path if rows is None else read_formatted(path)[:rows], batch_size=batch_size),
+  'bulk_cache': lambda driver, path, rows, batch_size: bulk_populate_graph(driver, path if rows is None else read_formatted(path)[:rows], batch_size=batch_size, node_cache=NodeCache()),
+}
+
+##
+
+def count_rows(path, rows):
+  num_rows = len(read_formatted(path))
+  return num_rows if rows is None else min(rows, num_rows)
+
+##
+
+def run_benchmark(driver, path, loader, rows=None, batch_size=1000):
+  """ Run one loader on one file and return its measurements """
+  if isinstance(driver, FakeDriver): driver.reset()
+  num_rows = count_rows(path, rows)
+
+  tracemalloc.start()
+  start_time = time.perf_counter()
+  with redirect_stdout(StringIO()): # the loaders print their own progress
+    LOADERS[loader](driver, path, rows, batch_size)
+  seconds = time.perf_counter() - start_time
+  _, peak_memory = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  result = {
+    'file': path.name, 'loader': loader, 'rows': num_rows, 'seconds': seconds,
+    'rows_per_second': num_rows / seconds if seconds > 0 else float("inf"),
+    'peak_memory_mb': peak_memory / (1024 * 1024),
+  }
+  if isinstance(driver, FakeDriver):
+    stats = driver.stats()
+    result.update({
+      'queries_per_row': stats['queries'] / num_rows, 'transactions_per_row': stats['transactions'] / num_rows,
+      'sessions': stats['sessions'], 'queries': stats['queries'], 'transactions': stats['transactions'],
+    })
+
+  return result
+
+##
+
+def print_result(result):
+  line = f"{result['file']:<38} {result['loader']:<22} {result['rows']:>6} rows | {result['rows_per_second']:>9.0f} rows/sec | "
+  if 'queries_per_row' in result:
+    line += f"{result['queries_per_row']:>6.3f} queries/row | {result['transactions_per_row']:>6.3f} tx/row | "
+  print(line + f"peak {result['peak_memory_mb']:>7.1f} MB")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the graph loaders on the formatted O*NET files")
+  parser.add_argument("--loaders", nargs="+", choices=list(LOADERS.keys()), default=list(LOADERS.keys()))
+  parser.add_argument("--files", nargs="+", default=None, help="file names to benchmark. example: formatted_interests.parquet")
+  parser.add_argument("--rows", type=int, default=None, help="only load the first N rows of each file")
+  parser.add_argument("--batch-size", type=int, default=1000)
+  parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated round trip of the fake driver")
+  parser.add_argument("--neo4j", action="store_true", help="run against the Neo4j database of the .env file instead of the fake driver")
+  parser.add_argument("--output", default=None, help="save the results as JSON")
+  args = parser.parse_args()
+
+  if args.neo4j:
+    load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent.parent / '.env')
+    driver = connect_to_database(uri=os.getenv('NEO4J_URI'), username=os.getenv('NEO4J_USERNAME'), password=os.getenv('NEO4J_PASSWORD'))
+  else:
+    driver = FakeDriver(latency=args.latency_ms / 1000, keep_queries=False)
+
+  files = [path for path in get_files() if args.files is None or path.name in args.files]
+  results = []
+  for path in files:
+    for loader in args.loaders:
+      result = run_benchmark(driver, path, loader, rows=args.rows, batch_size=args.batch_size)
+      print_result(result)
+      results.append(result)
+
+  driver.close()
+  if args.output:
+    with open(args.output, "w", encoding="utf-8") as f:
+      json.dump({'latency_ms': args.latency_ms, 'neo4j': args.neo4j, 'batch_size': args.batch_size, 'results': results}, f, indent=2)
@@ -0,0 +1,203 @@
+"""
+Offline export of the formatted tables for full graph rebuilds.
+
+The formatted data is turned into node and relationship CSV files using the header format of
+`neo4j-admin database import full`. Nodes are deduplicated and given a stable ID in memory during the export,
+so the files can be imported in one go instead of going through millions of MERGE statements.
+The same files can also be loaded into an empty database through the driver with load_export.
+
+Usage:
+  python bulk_import.py                                     # export the Parquet tables to ../Datasets/ONet/Bulk Import
+  python bulk_import.py --tables "../Datasets/ONet/Formatted CSVs/formatted_interests.csv"
+"""
+
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+from columnar_format import iter_rows, read_formatted_in_batches
+from graph_functions import preprocess_string, create_schema, set_data_version
+
+DATASETS_FOLDER = Path(__file__).resolve().parent.parent / "Datasets" / "ONet"
+MANIFEST_NAME = "manifest.json"
+
+##
+
+def get_node_id(label, identifier):
+  """ Stable ID of a node, the same node always gets the same ID. example: Occupation|title|Psychologist """
+  return "|".join([label] + [f"{key}|{value}" for key, value in identifier.items()])
+
+##
+
+def export_for_bulk_import(datasets, export_folder, batch_size=10000):
+  """
+  Export formatted tables to node and relationship files that neo4j-admin can import.
+
+  datasets: list of formatted dataframes (any format) or paths to formatted .csv/.parquet files
+  export_folder: where the files and the manifest are written
+
+  Files:
+    nodes_<Label>.csv                        :ID,<properties...>,:LABEL
+    relationships_<Label>_<TYPE>_<Label>.csv  :START_ID,:END_ID,:TYPE,<properties...>
+    manifest.json                            labels, identifier keys, property keys and counts of every file
+
+  NOTE: like bulk_populate_graph, the first properties seen for a node are kept and relation properties are written as strings.
+  """
+  export_folder = Path(export_folder)
+  export_folder.mkdir(parents=True, exist_ok=True)
+  start_time = time.perf_counter()
+
+  nodes = {} # {label: {node_id: properties}}
+  identifier_keys = {} # {label: identifier keys}
+  relations = {} # {(start label, type, end label): {(start id, end id, properties): None}}, dicts keep the insertion order
+  num_rows = 0
+
+  for dataset in datasets:
+    batches = read_formatted_in_batches(dataset, batch_size=batch_size) if isinstance(dataset, (str, Path)) else [dataset]
+    for batch in batches:
+      for node_1, node_2, relation in iter_rows(batch):
+        num_rows += 1
+        ids = []
+        for node in [node_1, node_2]:
+          label = preprocess_string(node['label'].strip())
+          node_id = get_node_id(label, node['identifier'])
+          nodes.setdefault(label, {}).setdefault(node_id, node['properties'])
+          identifier_keys.setdefault(label, list(node['identifier'].keys()))
+          ids.append((label, node_id))
+
+        (start_label, start_id), (end_label, end_id) = ids
+        relation_type = preprocess_string(relation['label'].strip())
+        properties = tuple((key, str(value)) for key, value in relation['properties'].items())
+        relations.setdefault((start_label, relation_type, end_label), {})[(start_id, end_id, properties)] = None
+
+  manifest = {'nodes': [], 'relationships': []}
+
+  for label, label_nodes in sorted(nodes.items()):
+    property_keys = list(dict.fromkeys(key for properties in label_nodes.values() for key in properties))
+    file_name = f"nodes_{label}.csv"
+    with open(export_folder / file_name, "w", newline="", encoding="utf-8") as f:
+      writer = csv.writer(f)
+      writer.writerow([":ID"] + property_keys + [":LABEL"])
+      for node_id, properties in label_nodes.items():
+        writer.writerow([node_id] + [properties.get(key, "") for key in property_keys] + [label])
+
+    manifest['nodes'].append({'file': file_name, 'label': label, 'identifier_keys': identifier_keys[label], 'property_keys': property_keys, 'count': len(label_nodes)})
+
+  for (start_label, relation_type, end_label), group in sorted(relations.items()):
+    property_keys = list(dict.fromkeys(key for _, _, properties in group for key, _ in properties))
+    file_name = f"relationships_{start_label}_{relation_type}_{end_label}.csv"
+    with open(export_folder / file_name, "w", newline="", encoding="utf-8") as f:
+      writer = csv.writer(f)
+      writer.writerow([":START_ID", ":END_ID", ":TYPE"] + property_keys)
+      for start_id, end_id, properties in group:
+        properties = dict(properties)
+        writer.writerow([start_id, end_id, relation_type] + [properties.get(key, "") for key in property_keys])
+
+    manifest['relationships'].append({'file': file_name, 'start_label': start_label, 'type': relation_type, 'end_label': end_label, 'property_keys': property_keys, 'count': len(group)})
+
+  with open(export_folder / MANIFEST_NAME, "w", encoding="utf-8") as f:
+    json.dump(manifest, f, indent=2)
+
+  num_nodes = sum(item['count'] for item in manifest['nodes'])
+  num_relations = sum(item['count'] for item in manifest['relationships'])
+  print(f"----- Exported {num_rows} rows as {num_nodes} nodes and {num_relations} relationships in {time.perf_counter() - start_time:.2f}s")
+
+  return manifest
+
+##
+
+def get_import_command(export_folder, database="neo4j"):
+  """
+  Command that imports an export into an empty (or overwritten) database. Neo4j must be stopped while it runs.
+  NOTE: once the database is started again, call graph_functions.set_data_version so that the agent clears its query cache.
+  """
+  export_folder = Path(export_folder)
+  with open(export_folder / MANIFEST_NAME, encoding="utf-8") as f:
+    manifest = json.load(f)
+
+  arguments = [f'--nodes="{export_folder / item["file"]}"' for item in manifest['nodes']]
+  arguments += [f'--relationships="{export_folder / item["file"]}"' for item in manifest['relationships']]
+  return " ".join(["neo4j-admin database import full", "--overwrite-destination"] + arguments + [database])
+
+##
+
+def read_export_file(path, batch_size):
+  """ Stream the rows of an exported file as lists of dictionaries """
+  with open(path, newline="", encoding="utf-8") as f:
+    batch = []
+    for row in csv.DictReader(f):
+      batch.append(row)
+      if len(batch) == batch_size:
+        yield batch
+        batch = []
+    if len(batch) > 0: yield batch
+
+##
+
+def load_export(driver, export_folder, batch_size=10000, force=False):
+  """
+  Load an export into an empty database through the driver, for when neo4j-admin can not be used (example: Aura).
+  Since the database is empty, nodes and relations are created with CREATE instead of MERGE.
+
+  force: load even if the database already has nodes (this can create duplicates)
+  """
+  export_folder = Path(export_folder)
+  with open(export_folder / MANIFEST_NAME, encoding="utf-8") as f:
+    manifest = json.load(f)
+
+  with driver.session() as session:
+    num_nodes = session.run("MATCH (n) RETURN count(n) AS count").single()['count']
+  if num_nodes > 0 and not force:
+    raise ValueError(f"The database already has {num_nodes} nodes. load_export only loads into an empty database, use force=True to load anyway.")
+
+  start_time = time.perf_counter()
+  ids = {} # node id: identifier values, needed to find the nodes of the relationships
+  identifier_keys = {item['label']: item['identifier_keys'] for item in manifest['nodes']}
+  create_schema(driver, [(label, tuple(keys)) for label, keys in identifier_keys.items()])
+
+  with driver.session() as session:
+    for item in manifest['nodes']:
+      query = f"UNWIND $rows AS row CREATE (n:{item['label']}) SET n = row"
+      for batch in read_export_file(export_folder / item['file'], batch_size):
+        rows = []
+        for row in batch:
+          node_id = row.pop(":ID")
+          row.pop(":LABEL")
+          properties = {key: value for key, value in row.items() if value != ""}
+          ids[node_id] = properties
+          rows.append(properties)
+        session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+
+    for item in manifest['relationships']:
+      start = ", ".join([f"{key}: row.start.{key}" for key in identifier_keys[item['start_label']]])
+      end = ", ".join([f"{key}: row.end.{key}" for key in identifier_keys[item['end_label']]])
+      query = f"""
+      UNWIND $rows AS row
+      MATCH (n:{item['start_label']} {{{start}}})
+      MATCH (m:{item['end_label']} {{{end}}})
+      CREATE (n)-[r:{item['type']}]->(m)
+      SET r = row.properties
+      """
+      for batch in read_export_file(export_folder / item['file'], batch_size):
+        rows = []
+        for row in batch:
+          start_id, end_id = row.pop(":START_ID"), row.pop(":END_ID")
+          row.pop(":TYPE")
+          properties = {key: value for key, value in row.items() if value != ""}
+          rows.append({'start': ids[start_id], 'end': ids[end_id], 'properties': properties})
+        session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+
+  set_data_version(driver)
+  print(f"----- Loaded {len(ids)} nodes and {sum(item['count'] for item in manifest['relationships'])} relationships in {time.perf_counter() - start_time:.2f}s")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Export the formatted tables for neo4j-admin database import")
+  parser.add_argument("--tables", nargs="+", default=sorted((DATASETS_FOLDER / "Formatted Parquet").glob("formatted_*.parquet")))
+  parser.add_argument("--export-folder", default=DATASETS_FOLDER / "Bulk Import")
+  parser.add_argument("--database", default="neo4j")
+  args = parser.parse_args()
+
+  export_for_bulk_import(args.tables, args.export_folder)
+  print(get_import_command(args.export_folder, database=args.database))
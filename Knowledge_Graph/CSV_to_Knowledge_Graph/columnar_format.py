@@ -0,0 +1,167 @@
+"""
+Flat, typed intermediate format used instead of the stringified dictionaries of the formatted CSVs.
+
+Every row is one relation between two nodes:
+  node_1_label | node_1_key | node_1_value | node_2_label | node_2_key | node_2_value | relation_label
+  Occupation   | title      | Psychologist | Basic_Skill  | title      | Writing      | strong_need_for_basic_skill
+
+Properties other than the identifier go in their own columns, named after the element they belong to:
+  node_1_prop_<name>, node_2_prop_<name>, relation_prop_<name>  (example: node_2_prop_category, relation_prop_level)
+A missing property is stored as null.
+
+NOTE: relation properties are stored as strings since the graph functions write them as strings.
+"""
+
+import ast
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+NODE_COLUMNS = ['label', 'key', 'value']
+COLUMNS = [f"node_1_{c}" for c in NODE_COLUMNS] + [f"node_2_{c}" for c in NODE_COLUMNS] + ['relation_label']
+
+##
+
+def get_arrow_schema(columns):
+  """ Every column is a string. Labels, keys and values repeat a lot so they are dictionary encoded. """
+  fields = []
+  for column in columns:
+    if column in COLUMNS or column.startswith(('node_1_prop_', 'node_2_prop_')):
+      fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+    else:
+      fields.append(pa.field(column, pa.string()))
+  return pa.schema(fields)
+
+##
+
+def node_to_columns(node, prefix):
+  """
+  Flatten one node into columns. example:
+  {'label': 'Knowledge', 'properties': {'title': 'Biology', 'category': 'Biology'}, 'identifier': {'title': 'Biology'}}
+  => {'node_2_label': 'Knowledge', 'node_2_key': 'title', 'node_2_value': 'Biology', 'node_2_prop_category': 'Biology'}
+
+  NOTE: the identifier must have exactly one key.
+  """
+  identifier = node['identifier']
+  if len(identifier) != 1:
+    raise ValueError(f"The columnar format supports one identifier key per node, got: {identifier}")
+
+  key, value = list(identifier.items())[0]
+  columns = {f"{prefix}_label": node['label'], f"{prefix}_key": key, f"{prefix}_value": str(value)}
+  for name, property_value in node['properties'].items():
+    if name != key: columns[f"{prefix}_prop_{name}"] = str(property_value)
+
+  return columns
+
+##
+
+def columns_to_node(record, prefix):
+  """ Inverse of node_to_columns: returns {'label', 'properties', 'identifier'} with properties and identifier as dictionaries. """
+  key, value = record[f"{prefix}_key"], record[f"{prefix}_value"]
+  properties = {key: value}
+  property_prefix = f"{prefix}_prop_"
+  for column, property_value in record.items():
+    if column.startswith(property_prefix) and not pd.isna(property_value):
+      properties[column[len(property_prefix):]] = property_value
+
+  return {'label': record[f"{prefix}_label"], 'properties': properties, 'identifier': {key: value}}
+
+##
+
+def record_to_row(record):
+  """ Turn one flat record into (node_1, node_2, relation), the same structure returned when parsing a formatted CSV row. """
+  relation_properties = {}
+  for column, value in record.items():
+    if column.startswith('relation_prop_') and not pd.isna(value):
+      relation_properties[column[len('relation_prop_'):]] = value
+
+  relation = {'label': record['relation_label'], 'properties': relation_properties}
+  return columns_to_node(record, 'node_1'), columns_to_node(record, 'node_2'), relation
+
+##
+
+def parse_csv_row(node_1, node_2, relation):
+  """ Evaluate the three cells of a formatted CSV row, including the stringified 'properties' and 'identifier' inside them. """
+  node_1, node_2, relation = ast.literal_eval(node_1), ast.literal_eval(node_2), ast.literal_eval(relation)
+  for node in [node_1, node_2]:
+    node['properties'] = ast.literal_eval(node['properties'])
+    node['identifier'] = ast.literal_eval(node['identifier'])
+  relation['properties'] = ast.literal_eval(relation['properties']) if "properties" in relation.keys() else {}
+
+  return node_1, node_2, relation
+
+##
+
+def rows_to_columnar(rows):
+  """ Build a columnar dataframe from an iterable of (node_1, node_2, relation) with parsed properties. """
+  records = []
+  for node_1, node_2, relation in rows:
+    record = {**node_to_columns(node_1, 'node_1'), **node_to_columns(node_2, 'node_2'), 'relation_label': relation['label']}
+    for name, value in relation.get('properties', {}).items():
+      record[f"relation_prop_{name}"] = str(value)
+    records.append(record)
+
+  df = pd.DataFrame.from_records(records)
+  property_columns = sorted([c for c in df.columns if c not in COLUMNS])
+  return df.reindex(columns=COLUMNS + property_columns)
+
+##
+
+def csv_to_columnar(dataset):
+  """ Convert a formatted CSV dataframe (Node_1, Node_2, Relation) into the columnar format. """
+  rows = (parse_csv_row(n1, n2, r) for n1, n2, r in zip(dataset['Node_1'], dataset['Node_2'], dataset['Relation']))
+  return rows_to_columnar(rows)
+
+##
+
+def is_columnar(dataset):
+  return 'node_1_label' in dataset.columns
+
+##
+
+def iter_rows(dataset):
+  """
+  Yield (node_1, node_2, relation) for every row of a formatted dataframe, whatever its format (formatted CSV or columnar).
+  The 'properties' and 'identifier' of the returned dictionaries are already parsed.
+  """
+  if is_columnar(dataset):
+    for record in dataset.to_dict('records'):
+      yield record_to_row(record)
+  else:
+    for n1, n2, r in zip(dataset['Node_1'], dataset['Node_2'], dataset['Relation']):
+      yield parse_csv_row(n1, n2, r)
+
+##
+
+def write_columnar(dataset, path):
+  """ Write a columnar dataframe (or a formatted CSV dataframe, which gets converted) to a Parquet file. """
+  if not is_columnar(dataset): dataset = csv_to_columnar(dataset)
+  table = pa.Table.from_pandas(dataset.astype(object).where(dataset.notna(), None), schema=get_arrow_schema(dataset.columns), preserve_index=False)
+  pq.write_table(table, path)
+
+##
+
+def read_formatted(path):
+  """ Read a formatted dataset. Parquet files are read in the columnar format, CSV files in the old formatted CSV format. """
+  path = Path(path)
+  if path.suffix == ".parquet":
+    return pq.read_table(path).to_pandas().astype(object)
+
+  dataset = pd.read_csv(path)
+  return dataset.drop('Unnamed: 0', axis=1) if 'Unnamed: 0' in dataset.columns else dataset
+
+##
+
+def read_formatted_in_batches(path, batch_size=1000):
+  """
+  Stream a formatted dataset as dataframes of at most batch_size rows.
+  Parquet files are read batch by batch without loading the whole file, CSV files are read in chunks.
+  """
+  path = Path(path)
+  if path.suffix == ".parquet":
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+      yield batch.to_pandas().astype(object)
+  else:
+    for chunk in pd.read_csv(path, chunksize=batch_size):
+      yield chunk.drop('Unnamed: 0', axis=1) if 'Unnamed: 0' in chunk.columns else chunk
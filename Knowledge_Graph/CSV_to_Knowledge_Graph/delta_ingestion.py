@@ -0,0 +1,230 @@
+"""
+Incremental (delta) ingestion of the formatted tables.
+
+A local SQLite manifest keeps a content hash for every edge (row) of every source table.
+On each run, the rows of a table are hashed and compared with the previous run to find the added, changed and removed edges.
+Only those are applied to Neo4j: removed and changed edges are deleted, added and changed edges are merged.
+If a file did not change at all since the previous run, it is skipped without reading its rows.
+Rows with the same edge key in one table are the same relation: identical rows are counted as duplicates and applied once,
+rows with a different content are rejected (the loaders would write both relations, the manifest can only keep one).
+
+Usage:
+  python delta_ingestion.py                            # every Parquet table in ../Datasets/ONet/Formatted Parquet
+  python delta_ingestion.py --tables "../Datasets/ONet/Formatted Parquet/formatted_interests.parquet"
+  python delta_ingestion.py --dry-run                  # only print the delta
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+from columnar_format import iter_rows, rows_to_columnar, read_formatted
+from graph_functions import connect_to_database, preprocess_string, group_rows, write_batch, set_data_version
+
+DATASETS_FOLDER = Path(__file__).resolve().parent.parent / "Datasets" / "ONet"
+DEFAULT_MANIFEST_PATH = DATASETS_FOLDER / "delta_manifest.sqlite"
+
+##
+
+def get_hash(value):
+  return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+##
+
+def get_file_hash(path):
+  digest = hashlib.sha1()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+##
+
+def describe_edge(node_1, node_2, relation):
+  """
+  Returns (edge_key, content_hash, edge).
+  The edge key identifies the relation (both nodes and the relation type), the content hash covers everything in the row.
+  """
+  edge = {
+    'start_label': preprocess_string(node_1['label'].strip()), 'identifier_1': node_1['identifier'],
+    'type': preprocess_string(relation['label'].strip()),
+    'end_label': preprocess_string(node_2['label'].strip()), 'identifier_2': node_2['identifier'],
+  }
+  content = [node_1['properties'], node_2['properties'], {k: str(v) for k, v in relation['properties'].items()}]
+  return get_hash(edge), get_hash([edge, content]), edge
+
+##
+
+class DeltaManifest:
+  """ SQLite store of the per-edge content hashes of every source table, and of the hash of every source file. """
+
+  def __init__(self, path=DEFAULT_MANIFEST_PATH):
+    self.connection = sqlite3.connect(str(path))
+    self.connection.executescript("""
+      CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, file_hash TEXT, num_edges INTEGER, updated_at REAL);
+      CREATE TABLE IF NOT EXISTS edges (source TEXT, edge_key TEXT, content_hash TEXT, edge TEXT, PRIMARY KEY (source, edge_key));
+    """)
+
+  def get_source(self, source):
+    """ Returns (file_hash, num_edges) of the previous run, (None, None) if the table was never applied """
+    row = self.connection.execute("SELECT file_hash, num_edges FROM sources WHERE source = ?", (source,)).fetchone()
+    return row if row else (None, None)
+
+  def get_edges(self, source):
+    """ Returns {edge_key: (content_hash, edge)} of the previous run """
+    rows = self.connection.execute("SELECT edge_key, content_hash, edge FROM edges WHERE source = ?", (source,))
+    return {edge_key: (content_hash, json.loads(edge)) for edge_key, content_hash, edge in rows}
+
+  def save(self, source, file_hash, added, changed, removed, num_edges):
+    """ Apply a delta to the manifest. Called once the delta has been written to the graph. """
+    with self.connection:
+      self.connection.executemany("DELETE FROM edges WHERE source = ? AND edge_key = ?", [(source, key) for key in removed])
+      self.connection.executemany(
+        "INSERT OR REPLACE INTO edges (source, edge_key, content_hash, edge) VALUES (?, ?, ?, ?)",
+        [(source, key, content_hash, json.dumps(edge)) for key, (content_hash, edge, _) in {**added, **changed}.items()]
+      )
+      self.connection.execute(
+        "INSERT OR REPLACE INTO sources (source, file_hash, num_edges, updated_at) VALUES (?, ?, ?, ?)",
+        (source, file_hash, num_edges, time.time())
+      )
+
+  def close(self):
+    self.connection.close()
+
+##
+
+def compute_delta(dataset, previous_edges):
+  """
+  Compare the rows of a formatted dataframe with the edges of the previous run.
+
+  Returns added, changed, removed, the number of edges and the number of duplicate rows:
+    added / changed: {edge_key: (content_hash, edge, row)} where row is (node_1, node_2, relation)
+    removed: {edge_key: edge}
+
+  Raises a ValueError if two rows have the same edge key and a different content.
+  """
+  current = {}
+  duplicates = 0
+  for row in iter_rows(dataset):
+    edge_key, content_hash, edge = describe_edge(*row)
+    if edge_key in current:
+      if current[edge_key][0] != content_hash:
+        raise ValueError(f"Two rows of the table describe the same relation with a different content: {edge}")
+      duplicates += 1
+      continue
+    current[edge_key] = (content_hash, edge, row)
+
+  added = {key: value for key, value in current.items() if key not in previous_edges}
+  changed = {key: value for key, value in current.items() if key in previous_edges and previous_edges[key][0] != value[0]}
+  removed = {key: edge for key, (_, edge) in previous_edges.items() if key not in current}
+
+  return added, changed, removed, len(current), duplicates
+
+##
+
+def delete_edges(tx, edges):
+  """ Delete relations, grouped by (start label, identifier keys, type, end label, identifier keys) """
+  groups = {}
+  for edge in edges:
+    key = (edge['start_label'], tuple(edge['identifier_1'].keys()), edge['type'], edge['end_label'], tuple(edge['identifier_2'].keys()))
+    groups.setdefault(key, []).append({'identifier_1': edge['identifier_1'], 'identifier_2': edge['identifier_2']})
+
+  for (start_label, keys_1, relation_type, end_label, keys_2), rows in groups.items():
+    identifier_1 = ", ".join([f"{key}: row.identifier_1.{key}" for key in keys_1])
+    identifier_2 = ", ".join([f"{key}: row.identifier_2.{key}" for key in keys_2])
+    tx.run(f"""
+    UNWIND $rows AS row
+    MATCH (n:{start_label} {{{identifier_1}}})-[r:{relation_type}]->(m:{end_label} {{{identifier_2}}})
+    DELETE r
+    """, rows=rows).consume()
+
+##
+
+def apply_delta(driver, added, changed, removed, batch_size=1000):
+  """
+  Write a delta to the graph. Changed edges are deleted then merged again since the loaders merge relations on their properties.
+
+  NOTE: nodes are never deleted, a node left without relations stays in the graph.
+  """
+  to_delete = list(removed.values()) + [edge for _, edge, _ in changed.values()]
+  to_merge = [row for _, _, row in added.values()] + [row for _, _, row in changed.values()]
+
+  with driver.session() as session:
+    for start in range(0, len(to_delete), batch_size):
+      session.execute_write(delete_edges, to_delete[start:start + batch_size])
+
+    for start in range(0, len(to_merge), batch_size):
+      nodes, relations = group_rows(rows_to_columnar(to_merge[start:start + batch_size]))
+      session.execute_write(write_batch, nodes, relations)
+
+  set_data_version(driver)
+
+##
+
+def delta_populate_graph(driver, dataset, source=None, manifest=None, batch_size=1000, dry_run=False):
+  """
+  Apply only what changed in a formatted table since the previous run.
+
+  driver: Neo4j driver instance (can be None when dry_run=True)
+  dataset: path to a formatted .csv/.parquet file, or a formatted dataframe
+  source: name of the table in the manifest, defaults to the file name. Required for dataframes.
+  manifest: DeltaManifest, defaults to the one in DEFAULT_MANIFEST_PATH
+  dry_run: compute and print the delta without writing anything
+
+  Returns the number of added, changed, removed and unchanged edges, and of duplicate rows (0 for a skipped file, its rows are not read).
+  """
+  start_time = time.perf_counter()
+  own_manifest = manifest is None
+  manifest = manifest if manifest is not None else DeltaManifest()
+
+  try:
+    file_hash = None
+    if isinstance(dataset, (str, Path)):
+      source = source or Path(dataset).name
+      file_hash = get_file_hash(dataset)
+      previous_file_hash, previous_num_edges = manifest.get_source(source)
+      if file_hash == previous_file_hash:
+        print(f"----- {source}: unchanged since the previous run ({time.perf_counter() - start_time:.2f}s)")
+        return {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': previous_num_edges, 'duplicates': 0}
+      dataset = read_formatted(dataset)
+    elif source is None:
+      raise ValueError("source is required when dataset is a dataframe")
+
+    added, changed, removed, num_edges, duplicates = compute_delta(dataset, manifest.get_edges(source))
+    stats = {'added': len(added), 'changed': len(changed), 'removed': len(removed), 'unchanged': num_edges - len(added) - len(changed),
+             'duplicates': duplicates}
+
+    if not dry_run:
+      if len(added) + len(changed) + len(removed) > 0:
+        apply_delta(driver, added, changed, removed, batch_size=batch_size)
+      manifest.save(source, file_hash, added, changed, removed, num_edges)
+  finally:
+    if own_manifest: manifest.close()
+
+  print(f"----- {source}: {stats['added']} added, {stats['changed']} changed, {stats['removed']} removed, {stats['unchanged']} unchanged, "
+        f"{stats['duplicates']} duplicate rows ({time.perf_counter() - start_time:.2f}s{', dry run' if dry_run else ''})")
+
+  return stats
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Apply only the changed rows of the formatted tables to Neo4j")
+  parser.add_argument("--tables", nargs="+", default=sorted((DATASETS_FOLDER / "Formatted Parquet").glob("formatted_*.parquet")))
+  parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+  parser.add_argument("--batch-size", type=int, default=1000)
+  parser.add_argument("--dry-run", action="store_true")
+  args = parser.parse_args()
+
+  driver = None
+  if not args.dry_run:
+    load_dotenv(dotenv_path=Path(__file__).resolve().parent.parent.parent / '.env')
+    driver = connect_to_database(uri=os.getenv('NEO4J_URI'), username=os.getenv('NEO4J_USERNAME'), password=os.getenv('NEO4J_PASSWORD'))
+
+  manifest = DeltaManifest(args.manifest)
+  for table in args.tables:
+    delta_populate_graph(driver, table, manifest=manifest, batch_size=args.batch_size, dry_run=args.dry_run)
+  manifest.close()
+  if driver is not None: driver.close()
@@ -0,0 +1,113 @@
+"""
+In-process stand-in for the Neo4j driver, used to measure the loaders without a database.
+
+It does not execute Cypher. It records every query with its parameters, every session and every transaction,
+and can sleep for a simulated round-trip latency on every query and commit.
+It supports what graph_functions.py uses: driver.session(), session.run(), session.execute_write() and tx.run().
+"""
+
+import time
+
+##
+
+class FakeResult:
+
+  def __init__(self, records=None):
+    self.records = records or []
+
+  def consume(self):
+    return None
+
+  def single(self):
+    return self.records[0] if len(self.records) > 0 else None
+
+  def data(self):
+    return self.records
+
+  def __iter__(self):
+    return iter(self.records)
+
+##
+
+class FakeTransaction:
+
+  def __init__(self, driver):
+    self.driver = driver
+
+  def run(self, query, parameters=None, **kwargs):
+    return self.driver.record(query, {**(parameters or {}), **kwargs})
+
+##
+
+class FakeSession:
+
+  def __init__(self, driver):
+    self.driver = driver
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    pass
+
+  ## Auto-commit query: one round trip
+  def run(self, query, parameters=None, **kwargs):
+    self.driver.transactions += 1
+    return self.driver.record(query, {**(parameters or {}), **kwargs})
+
+  ## Transaction function: its queries plus one round trip for the commit
+  def execute_write(self, transaction_function, *args, **kwargs):
+    self.driver.transactions += 1
+    result = transaction_function(FakeTransaction(self.driver), *args, **kwargs)
+    self.driver.wait()
+    return result
+
+  execute_read = execute_write
+
+##
+
+class FakeDriver:
+  """
+  latency: seconds slept for every query and every commit, to simulate the network round trip
+  responder: optional function (query, parameters) -> list of records returned by the query
+  keep_queries: keep the text and parameters of every query (disable it for long runs to save memory)
+  """
+
+  def __init__(self, latency=0.0, responder=None, keep_queries=True):
+    self.latency = latency
+    self.responder = responder
+    self.keep_queries = keep_queries
+    self.reset()
+
+  def reset(self):
+    self.queries = []
+    self.num_queries = 0
+    self.num_parameter_rows = 0 # number of rows sent through $rows
+    self.sessions = 0
+    self.transactions = 0
+
+  def wait(self):
+    if self.latency > 0: time.sleep(self.latency)
+
+  def record(self, query, parameters):
+    self.num_queries += 1
+    self.num_parameter_rows += len(parameters.get('rows', [])) if isinstance(parameters.get('rows'), list) else 0
+    if self.keep_queries: self.queries.append((query, parameters))
+    self.wait()
+    return FakeResult(self.responder(query, parameters) if self.responder else [])
+
+  def session(self, **kwargs):
+    self.sessions += 1
+    return FakeSession(self)
+
+  def verify_connectivity(self):
+    return None
+
+  def close(self):
+    pass
+
+  def stats(self):
+    return {'queries': self.num_queries, 'parameter_rows': self.num_parameter_rows, 'sessions': self.sessions, 'transactions': self.transactions}
@@ -0,0 +1,205 @@
+"""
+Builds the formatted tables used by populate_graph from the combined O*NET CSVs.
+This is the vectorized version of the loops found in format_csvs.ipynb, its output is identical to theirs.
+
+Usage:
+  python format_functions.py                                  # format every table
+  python format_functions.py --tables interests knowledge     # format some tables
+  python format_functions.py --no-parquet                     # only write the formatted CSVs
+"""
+
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from columnar_format import COLUMNS, write_columnar
+
+DATASETS_FOLDER = Path(__file__).resolve().parent.parent / "Datasets" / "ONet"
+
+PERSONALITY_TRAITS = {'S': 'Social', 'R': 'Realistic', 'I': 'Investigative', 'E': 'Enterprising', 'C': 'Conventional', 'A': 'Artistic'}
+
+##
+
+def preprocess_string(text, replace_hyphens=False):
+  """
+  Replace white spaces with "_" for a whole column.
+  NOTE: the committed formatted CSVs only replaced white spaces (example: 'Industrial-Organizational_Psychologists'),
+  set replace_hyphens=True to also replace "-" like the current preprocess_string of format_csvs.ipynb does.
+  """
+  return text.str.replace(r"[ -]" if replace_hyphens else " ", "_", regex=True)
+
+##
+
+def evaluate_importance(importance, relation_root_label):
+  """
+  Create the relation labels of a whole column based on the level of importance.
+  Not available or <= 40: low_ | >= 80: strong_ | otherwise: medium_
+  """
+  numeric_importance = pd.to_numeric(importance, errors='coerce')
+  prefix = np.select(
+    [numeric_importance.isna(), numeric_importance >= 80, numeric_importance <= 40],
+    ['low', 'strong', 'low'],
+    default='medium'
+  )
+  return pd.Series(prefix, index=importance.index, dtype=object) + f"_{relation_root_label}"
+
+##
+
+def get_personality_traits(coded_traits):
+  """
+  Decode a column of RIASEC codes into one row per letter. example: 'CSR' -> 'Conventional', 'Social', 'Realistic'
+  The returned Series keeps the index of the coded row so that it can be joined back.
+  """
+  letters = coded_traits.map(list).explode()
+  return letters.map(PERSONALITY_TRAITS)
+
+##
+
+def map_unique(frame, func):
+  """
+  Apply func once per unique row of frame (a dataframe or a series) and broadcast the results back to every row.
+  The formatted tables repeat the same occupations and relations thousands of times, so this is where the speed comes from.
+  """
+  if isinstance(frame, pd.Series):
+    codes, uniques = pd.factorize(frame)
+    values = [func(value) for value in uniques]
+  else:
+    codes, uniques = pd.factorize(pd.MultiIndex.from_frame(frame))
+    values = [func(*value) for value in uniques]
+
+  return pd.Series(np.asarray(values + [None], dtype=object)[codes], index=frame.index, dtype=object)
+
+##
+
+def build_table(occupations, node_2_label, node_2_titles, relation_labels, node_2_properties=None, relation_properties=None):
+  """
+  Build a formatted table in the columnar format. Property values keep their original type so that the
+  formatted CSV rendering matches the one produced by the notebook.
+  """
+  table = pd.DataFrame({
+    'node_1_label': 'Occupation', 'node_1_key': 'title', 'node_1_value': occupations,
+    'node_2_label': node_2_label, 'node_2_key': 'title', 'node_2_value': node_2_titles,
+    'relation_label': relation_labels
+  }, index=occupations.index)
+
+  for name, values in (node_2_properties or {}).items(): table[f"node_2_prop_{name}"] = values
+  for name, values in (relation_properties or {}).items(): table[f"relation_prop_{name}"] = values
+
+  return table.reset_index(drop=True)
+
+##
+
+def format_with_importance(df, item_column, relation_root_label, node_2_label=None, category_as_property=False, replace_hyphens=False):
+  """
+  Shared by abilities, basic skills, cross-functional skills and knowledge.
+  node_2_label: label of the second node. If None, the row's preprocessed Category is used as the label.
+  """
+  category = preprocess_string(df['Category'], replace_hyphens)
+  importance = df['Importance'].astype(object)
+
+  return build_table(
+    occupations=preprocess_string(df['Occupation'], replace_hyphens),
+    node_2_label=category if node_2_label is None else node_2_label,
+    node_2_titles=preprocess_string(df[item_column], replace_hyphens),
+    relation_labels=evaluate_importance(importance, relation_root_label),
+    node_2_properties={'category': category} if category_as_property else None,
+    relation_properties={'importance': importance, 'level': df['Level'].astype(object)}
+  )
+
+##
+
+def format_abilities(df, replace_hyphens=False):
+  return format_with_importance(df, 'Ability', 'need_for_ability', replace_hyphens=replace_hyphens)
+
+def format_basic_skills(df, replace_hyphens=False):
+  return format_with_importance(df, 'Skill', 'need_for_basic_skill', node_2_label='Basic Skill', replace_hyphens=replace_hyphens)
+
+def format_cross_functional_skills(df, replace_hyphens=False):
+  return format_with_importance(df, 'Skill', 'need_for_cross_functional_skill', replace_hyphens=replace_hyphens)
+
+def format_knowledge(df, replace_hyphens=False):
+  return format_with_importance(df, 'Knowledge', 'need_for_knowledge_in', node_2_label='Knowledge', category_as_property=True, replace_hyphens=replace_hyphens)
+
+def format_interests(df, replace_hyphens=False):
+  traits = get_personality_traits(df['Interest Code'])
+  occupations = preprocess_string(df['Occupation'], replace_hyphens).loc[traits.index].reset_index(drop=True)
+  return build_table(occupations, 'Personality_Trait', traits.reset_index(drop=True), 'need_for_personality_trait')
+
+# name of the formatted table: (combined CSV, function)
+FORMATTERS = {
+  'abilities': ('Abilities.csv', format_abilities),
+  'basic_skills': ('Basic_Skills.csv', format_basic_skills),
+  'cross_functional_skills': ('Cross-Functional Skills.csv', format_cross_functional_skills),
+  'interests': ('Interests.csv', format_interests),
+  'knowledge': ('Knowledge.csv', format_knowledge),
+}
+
+##
+
+def to_formatted_csv(table):
+  """ Render a table in the columnar format as the formatted CSV format: Node_1, Node_2 and Relation holding stringified dictionaries. """
+  def node_string(prefix):
+    property_columns = [c for c in table.columns if c.startswith(f"{prefix}_prop_")]
+    def render(label, key, value, *properties):
+      extra = {c[len(f"{prefix}_prop_"):]: v for c, v in zip(property_columns, properties)}
+      return str({'label': label, 'properties': str({key: value, **extra}), 'identifier': str({key: value})})
+    return map_unique(table[[f"{prefix}_label", f"{prefix}_key", f"{prefix}_value"] + property_columns], render)
+
+  relation_columns = [c for c in table.columns if c.startswith("relation_prop_")]
+  def render_relation(label, *properties):
+    if len(relation_columns) == 0: return str({'label': label})
+    return str({'label': label, 'properties': str({c[len("relation_prop_"):]: v for c, v in zip(relation_columns, properties)})})
+
+  return pd.DataFrame({
+    'Node_1': node_string('node_1'),
+    'Node_2': node_string('node_2'),
+    'Relation': map_unique(table[['relation_label'] + relation_columns], render_relation)
+  })
+
+##
+
+def save_formatted(table, name, csv_folder=None, parquet_folder=None):
+  """ Write a formatted table as formatted_<name>.csv and, if parquet_folder is given, as formatted_<name>.parquet """
+  if csv_folder is not None:
+    to_formatted_csv(table).to_csv(Path(csv_folder) / f"formatted_{name}.csv")
+
+  if parquet_folder is not None:
+    columnar = table.copy()
+    for column in columnar.columns:
+      if column not in COLUMNS: columnar[column] = columnar[column].astype(str)
+    write_columnar(columnar, Path(parquet_folder) / f"formatted_{name}.parquet")
+
+##
+
+def format_all(input_folder, csv_folder=None, parquet_folder=None, tables=None, replace_hyphens=False):
+  """ Format the combined CSVs found in input_folder and save them. Returns {name: table} """
+  formatted = {}
+  for name in (tables or FORMATTERS.keys()):
+    file_name, formatter = FORMATTERS[name]
+    formatted[name] = formatter(pd.read_csv(Path(input_folder) / file_name), replace_hyphens=replace_hyphens)
+    save_formatted(formatted[name], name, csv_folder=csv_folder, parquet_folder=parquet_folder)
+    print(f"----- formatted_{name}: {len(formatted[name])} rows")
+
+  return formatted
+
+##
+
+def main():
+  parser = argparse.ArgumentParser(description="Format the combined O*NET CSVs for populate_graph")
+  parser.add_argument("--input-folder", default=DATASETS_FOLDER / "Combined CSVs")
+  parser.add_argument("--csv-folder", default=DATASETS_FOLDER / "Formatted CSVs")
+  parser.add_argument("--parquet-folder", default=DATASETS_FOLDER / "Formatted Parquet")
+  parser.add_argument("--no-parquet", action="store_true", help="only write the formatted CSVs")
+  parser.add_argument("--replace-hyphens", action="store_true", help='also replace "-" with "_" in titles')
+  parser.add_argument("--tables", nargs="+", choices=list(FORMATTERS.keys()), default=None)
+  args = parser.parse_args()
+
+  Path(args.csv_folder).mkdir(parents=True, exist_ok=True)
+  if not args.no_parquet: Path(args.parquet_folder).mkdir(parents=True, exist_ok=True)
+
+  format_all(args.input_folder, csv_folder=args.csv_folder, parquet_folder=None if args.no_parquet else args.parquet_folder,
+             tables=args.tables, replace_hyphens=args.replace_hyphens)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,6 +1,14 @@
 from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError
+from collections import OrderedDict
+from pathlib import Path
+from columnar_format import iter_rows, is_columnar, read_formatted_in_batches
 import re
 import ast
+import time
+import uuid
+
+DATA_VERSION_LABEL = "Graph_Data_Version"
 
 def connect_to_database(uri, username, password):
   driver = GraphDatabase.driver(uri=uri, auth=(username, password))
@@ -8,6 +16,22 @@ def connect_to_database(uri, username, password):
 
 ##
 
+def set_data_version(driver):
+  """
+  Write a new data version in the graph. The agent's query result cache is cleared when this version changes.
+
+  NOTE: every function writing data calls it once done. After a neo4j-admin import, call it once the database is started.
+  """
+  version = uuid.uuid4().hex
+  with driver.session() as session:
+    session.run(f"""
+    MERGE (v:{DATA_VERSION_LABEL})
+    SET v.version = $version, v.updated_at = datetime()
+    """, version=version).consume()
+  return version
+
+##
+
 def preprocess_string(text):
   text = re.sub(r"[ -]", "_", text)
   return text
@@ -83,40 +107,364 @@ def create_relation(driver, n_label_1, n_identifier_1, n_label_2, n_identifier_2
 
 ##
 
-def populate_graph(driver, dataset):
+class NodeCache:
+  """
+  Bounded set of (label, identifier) keys of the nodes already written during a load.
+  When max_size is reached, the least recently seen key is dropped.
+  A node whose key is in the cache is not merged again, only its relations are sent.
+
+  NOTE: a key is only added once its node is committed (add), so a failed write followed by a retry with the same cache
+  merges the node again instead of skipping it.
+  """
+
+  def __init__(self, max_size=100000):
+    self.max_size = max_size
+    self.keys = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def make_key(label, identifier):
+    return (preprocess_string(label.strip()), tuple(sorted(identifier.items())))
+
+  ## Returns True if the node was already written. Does not remember it, see add
+  def seen(self, label, identifier):
+    key = self.make_key(label, identifier)
+    if key in self.keys:
+      self.keys.move_to_end(key)
+      self.hits += 1
+      return True
+
+    self.misses += 1
+    return False
+
+  ## Remember a node once its write is committed
+  def add(self, label, identifier):
+    self.keys[self.make_key(label, identifier)] = None
+    if len(self.keys) > self.max_size:
+      self.keys.popitem(last=False)
+
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return self.hits / total if total > 0 else 0.0
+
+  def report(self):
+    print(f"----- Node cache: {self.hits} hits, {self.misses} misses, hit rate {self.hit_rate():.1%} ({len(self.keys)}/{self.max_size} keys)")
+    return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate()}
+
+##
+
+def populate_graph(driver, dataset, node_cache=None):
   """
   In this function, the dataset is loaded and each Node's label and properties are extracted.
   The three functions created above are used to then create a relation between the two nodes.
+
+  dataset: formatted dataframe, either in the formatted CSV format (Node_1, Node_2, Relation) or in the columnar format (see columnar_format.py)
+  node_cache: optional NodeCache. Nodes that were already written in this run are skipped.
+
+  NOTE: this makes three round trips per row. For full loads use bulk_populate_graph.
   """
-  for i in range(len(dataset)):
-    node_1 = ast.literal_eval(dataset.loc[i, 'Node_1'])
-    node_2 = ast.literal_eval(dataset.loc[i, 'Node_2'])
-    relation = ast.literal_eval(dataset.loc[i, 'Relation'])
+  for node_1, node_2, relation in iter_rows(dataset):
 
-    create_node(
-      driver=driver,
-      label=f"{node_1['label']}",
-      properties=ast.literal_eval(node_1['properties'])
-    )
+    for node in [node_1, node_2]:
+      if node_cache is not None and node_cache.seen(node['label'], node['identifier']):
+        continue
 
-    create_node(
-      driver=driver,
-      label=f"{node_2['label']}",
-      properties=ast.literal_eval(node_2['properties'])
-    )
-    
-    if "properties" in relation.keys():
-      create_relation(
+      create_node(
         driver=driver,
-        n_identifier_1=ast.literal_eval(node_1['identifier']), n_label_1=f"{node_1['label']}", 
-        n_identifier_2=ast.literal_eval(node_2['identifier']), n_label_2=f"{node_2['label']}",
-        relation_label=relation['label'], relation_properties=ast.literal_eval(relation['properties'])
+        label=f"{node['label']}",
+        properties=node['properties']
       )
-    
-    else:
-      create_relation(
-        driver=driver,
-        n_identifier_1=ast.literal_eval(node_1['identifier']), n_label_1=f"{node_1['label']}", 
-        n_identifier_2=ast.literal_eval(node_2['identifier']), n_label_2=f"{node_2['label']}",
-        relation_label=relation['label']
-      )
\ No newline at end of file
+      if node_cache is not None: node_cache.add(node['label'], node['identifier']) # committed
+
+    create_relation(
+      driver=driver,
+      n_identifier_1=node_1['identifier'], n_label_1=f"{node_1['label']}", 
+      n_identifier_2=node_2['identifier'], n_label_2=f"{node_2['label']}",
+      relation_label=relation['label'], relation_properties=relation['properties']
+    )
+
+  set_data_version(driver)
+  if node_cache is not None: node_cache.report()
+
+##
+
+def build_node_merge_query(label, identifier_keys):
+  """
+  Build a parameterized query that merges a batch of nodes sharing the same label and identifier keys.
+
+  label: Label for the nodes (example: Occupation)
+  identifier_keys: keys used to find the node (example: ('title',))
+
+  Every row in $rows should look like: {'identifier': {'title': 'Psychologist'}, 'properties': {'title': 'Psychologist', ...}}
+  """
+  label = preprocess_string(label.strip())
+  identifier = ", ".join([f"{key}: row.identifier.{key}" for key in identifier_keys]) # example: title: row.identifier.title
+
+  query = f"""
+  UNWIND $rows AS row
+  MERGE (n:{label} {{{identifier}}})
+  ON CREATE SET n += row.properties
+  """
+  return query
+
+##
+
+def build_relation_merge_query(n_label_1, identifier_keys_1, n_label_2, identifier_keys_2, relation_label, relation_keys):
+  """
+  Build a parameterized query that merges a batch of relations n_label_1 -[relation_label]-> n_label_2.
+
+  Every row in $rows should look like: {'identifier_1': {...}, 'identifier_2': {...}, 'properties': {...}}
+  relation_keys: keys of the relation's properties, can be empty.
+  """
+  n_label_1 = preprocess_string(n_label_1.strip())
+  n_label_2 = preprocess_string(n_label_2.strip())
+  relation_label = preprocess_string(relation_label.strip())
+
+  identifier_1 = ", ".join([f"{key}: row.identifier_1.{key}" for key in identifier_keys_1])
+  identifier_2 = ", ".join([f"{key}: row.identifier_2.{key}" for key in identifier_keys_2])
+  properties = ", ".join([f"{key}: row.properties.{key}" for key in relation_keys])
+
+  query = f"""
+  UNWIND $rows AS row
+  MATCH (n:{n_label_1} {{{identifier_1}}})
+  MATCH (m:{n_label_2} {{{identifier_2}}})
+  MERGE (n)-[r:{relation_label} {{{properties}}}]->(m)
+  """
+  return query
+
+##
+
+def group_rows(dataset, node_cache=None):
+  """
+  Parse the rows of a formatted dataset (any format) and group them by node label and relation type.
+  If a NodeCache is given, only the nodes it has not seen yet are returned. They are not added to it: call
+  node_cache.add for every returned node once the batch is committed (see bulk_populate_graph).
+
+  Returns:
+    nodes: {(label, identifier_keys): [{'identifier': {...}, 'properties': {...}}, ...]}
+    relations: {(n_label_1, identifier_keys_1, n_label_2, identifier_keys_2, relation_label, relation_keys): [{'identifier_1': {...}, 'identifier_2': {...}, 'properties': {...}}, ...]}
+
+  NOTE: relation properties are stored as strings, the same way create_relation writes them.
+  """
+  nodes = {}
+  relations = {}
+  batch_keys = set() # nodes returned by this call, so that a node is only merged once per batch
+
+  for node_1, node_2, relation in iter_rows(dataset):
+
+    identifiers = []
+    for node in [node_1, node_2]:
+      identifier, properties = node['identifier'], node['properties']
+      key = (node['label'], tuple(identifier.keys()))
+      identifiers.append((key, identifier))
+
+      if node_cache is not None:
+        node_key = NodeCache.make_key(node['label'], identifier)
+        if node_key in batch_keys:
+          node_cache.hits += 1
+          continue
+        if node_cache.seen(node['label'], identifier):
+          continue
+        batch_keys.add(node_key)
+      nodes.setdefault(key, []).append({'identifier': identifier, 'properties': properties})
+
+    relation_properties = {k: str(v) for k, v in relation['properties'].items()}
+
+    (key_1, identifier_1), (key_2, identifier_2) = identifiers
+    key = key_1 + key_2 + (relation['label'], tuple(relation_properties.keys()))
+    relations.setdefault(key, []).append({'identifier_1': identifier_1, 'identifier_2': identifier_2, 'properties': relation_properties})
+
+  return nodes, relations
+
+##
+
+def write_batch(tx, nodes, relations):
+  """
+  Write one batch of grouped nodes and relations inside a single transaction.
+  Nodes are written first so that the relations' MATCH clauses can find them.
+  """
+  for (label, identifier_keys), rows in nodes.items():
+    tx.run(build_node_merge_query(label, identifier_keys), rows=rows).consume()
+
+  for (n_label_1, identifier_keys_1, n_label_2, identifier_keys_2, relation_label, relation_keys), rows in relations.items():
+    query = build_relation_merge_query(n_label_1, identifier_keys_1, n_label_2, identifier_keys_2, relation_label, relation_keys)
+    tx.run(query, rows=rows).consume()
+
+##
+
+def bulk_populate_graph(driver, dataset, batch_size=1000, node_cache=None):
+  """
+  Bulk version of populate_graph. The dataset is split into batches of batch_size rows, every batch is
+  grouped by node label and relation type and written in one transaction using UNWIND $rows MERGE queries.
+
+  driver: Neo4j driver instance
+  dataset: formatted dataframe (formatted CSV or columnar format), or the path to a formatted .csv/.parquet file.
+           Files are streamed batch by batch instead of being loaded at once.
+  batch_size: number of CSV rows written per transaction
+  node_cache: optional NodeCache shared across datasets. Nodes already written in this run are not merged again.
+
+  Returns a dictionary with the number of rows, batches, the elapsed seconds, the rows per second and the cache stats.
+  """
+  if isinstance(dataset, (str, Path)):
+    batches = read_formatted_in_batches(dataset, batch_size=batch_size)
+  else:
+    batches = (dataset[start:start + batch_size] for start in range(0, len(dataset), batch_size))
+
+  start_time = time.perf_counter()
+  num_batches = 0
+  num_rows = 0
+
+  with driver.session() as session:
+    for batch in batches:
+      nodes, relations = group_rows(batch, node_cache=node_cache)
+      session.execute_write(write_batch, nodes, relations)
+      if node_cache is not None: # only now, a failed batch leaves its nodes out of the cache
+        for (label, identifier_keys), rows in nodes.items():
+          for row in rows: node_cache.add(label, row['identifier'])
+      num_batches += 1
+      num_rows += len(batch)
+  set_data_version(driver)
+
+  elapsed = time.perf_counter() - start_time
+  rows_per_second = num_rows / elapsed if elapsed > 0 else float("inf")
+  print(f"----- Loaded {num_rows} rows in {num_batches} batches, {elapsed:.2f}s ({rows_per_second:.0f} rows/sec)")
+
+  stats = {'rows': num_rows, 'batches': num_batches, 'seconds': elapsed, 'rows_per_second': rows_per_second}
+  if node_cache is not None: stats['node_cache'] = node_cache.report()
+
+  return stats
+
+##
+
+def get_graph_schema(dataset):
+  """
+  Derive the node labels and their identifier keys from a formatted dataset.
+  Returns a sorted list of (label, identifier_keys). example: [('Basic_Skill', ('title',)), ('Occupation', ('title',))]
+
+  NOTE: Node_1 and Node_2 repeat a lot, so only their unique values are evaluated.
+  """
+  schema = set()
+  if is_columnar(dataset):
+    for prefix in ['node_1', 'node_2']:
+      for label, key in dataset[[f"{prefix}_label", f"{prefix}_key"]].drop_duplicates().itertuples(index=False):
+        schema.add((preprocess_string(label.strip()), (key,)))
+    return sorted(schema)
+
+  for column in ['Node_1', 'Node_2']:
+    for cell in dataset[column].unique():
+      node = ast.literal_eval(cell)
+      label = preprocess_string(node['label'].strip())
+      schema.add((label, tuple(ast.literal_eval(node['identifier']).keys())))
+
+  return sorted(schema)
+
+##
+
+def get_schema_name(label, identifier_keys, kind="unique"):
+  """ Name given to a constraint or an index. example: Occupation_title_unique """
+  return f"{label}_{'_'.join(identifier_keys)}_{kind}"
+
+##
+
+def create_schema(driver, schema, timeout=300):
+  """
+  Create a uniqueness constraint (and with it, its backing index) on the identifier keys of every label in the schema,
+  then wait until all indexes are online. Safe to run several times since every statement uses IF NOT EXISTS.
+
+  driver: Neo4j driver instance
+  schema: list of (label, identifier_keys) as returned by get_graph_schema
+  timeout: seconds to wait for the indexes to come online
+
+  NOTE: if a constraint can not be created (example: the graph already has duplicate nodes), a plain index is created instead.
+  """
+  with driver.session() as session:
+    for label, identifier_keys in schema:
+      properties = ", ".join([f"n.{key}" for key in identifier_keys]) # example: n.title
+      try:
+        session.run(f"""
+        CREATE CONSTRAINT {get_schema_name(label, identifier_keys)} IF NOT EXISTS
+        FOR (n:{label}) REQUIRE ({properties}) IS UNIQUE
+        """).consume()
+      except ClientError as e:
+        print(f"----- Could not create a uniqueness constraint on {label}{identifier_keys}, creating an index instead: {e.message}")
+        session.run(f"""
+        CREATE INDEX {get_schema_name(label, identifier_keys, kind="index")} IF NOT EXISTS
+        FOR (n:{label}) ON ({properties})
+        """).consume()
+
+    session.run("CALL db.awaitIndexes($timeout)", timeout=timeout).consume()
+
+##
+
+def drop_schema(driver, schema):
+  """ Drop the constraints and indexes created by create_schema. """
+  with driver.session() as session:
+    for label, identifier_keys in schema:
+      session.run(f"DROP CONSTRAINT {get_schema_name(label, identifier_keys)} IF EXISTS").consume()
+      session.run(f"DROP INDEX {get_schema_name(label, identifier_keys, kind='index')} IF EXISTS").consume()
+
+##
+
+def bootstrap_schema(driver, datasets, timeout=300):
+  """
+  Ingestion step that should run before populate_graph or bulk_populate_graph.
+  The labels and identifier keys of all datasets are collected, then the matching constraints are created.
+
+  Returns the schema that was created.
+  """
+  schema = set()
+  for dataset in datasets:
+    schema.update(get_graph_schema(dataset))
+  schema = sorted(schema)
+
+  start_time = time.perf_counter()
+  create_schema(driver, schema, timeout=timeout)
+  print(f"----- Schema ready for {len(schema)} labels in {time.perf_counter() - start_time:.2f}s")
+
+  return schema
+
+##
+
+def delete_nodes(driver, schema, batch_size=10000):
+  """ Delete every node (and its relations) that has one of the labels found in the schema. """
+  with driver.session() as session:
+    for label, _ in schema:
+      session.run(f"""
+      MATCH (n:{label})
+      CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+      """).consume()
+  set_data_version(driver)
+
+##
+
+def compare_load_times(driver, dataset, loader=None, **loader_kwargs):
+  """
+  Report how the load time of a dataset changes when the constraints and indexes are in place.
+  The dataset is loaded once without a schema and once with it. The loaded nodes are deleted before each run.
+
+  loader: populate_graph or bulk_populate_graph (default). loader_kwargs are passed to the loader.
+  A node_cache in loader_kwargs only gives its max_size: each run gets an empty NodeCache, since the nodes it holds are deleted
+  before the run and would not be merged again.
+
+  NOTE: this deletes every node having one of the dataset's labels. Only run it against a scratch database.
+  """
+  loader = loader or bulk_populate_graph
+  schema = get_graph_schema(dataset)
+  node_cache = loader_kwargs.pop('node_cache', None)
+  timings = {}
+
+  for with_schema in [False, True]:
+    delete_nodes(driver, schema)
+    if with_schema: create_schema(driver, schema)
+    else: drop_schema(driver, schema)
+
+    run_kwargs = {**loader_kwargs, 'node_cache': NodeCache(max_size=node_cache.max_size)} if node_cache is not None else loader_kwargs
+    start_time = time.perf_counter()
+    loader(driver, dataset, **run_kwargs)
+    timings['with_schema' if with_schema else 'without_schema'] = time.perf_counter() - start_time
+
+  speedup = timings['without_schema'] / timings['with_schema'] if timings['with_schema'] > 0 else float("inf")
+  print(f"----- Without schema: {timings['without_schema']:.2f}s | With schema: {timings['with_schema']:.2f}s | Speedup: {speedup:.1f}x")
+
+  return {**timings, 'speedup': speedup}
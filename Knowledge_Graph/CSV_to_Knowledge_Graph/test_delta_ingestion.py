@@ -0,0 +1,63 @@
+"""
+Tests of the delta ingestion, with the recording fake driver (no database).
+
+Usage (from the CSV_to_Knowledge_Graph folder):
+  python -m pytest -q test_delta_ingestion.py
+"""
+
+import pandas as pd
+import pytest
+import delta_ingestion
+from fake_neo4j import FakeDriver
+from delta_ingestion import DeltaManifest, compute_delta, delta_populate_graph
+
+##
+
+def make_row(occupation, skill, importance=90):
+  return {
+    'Node_1': str({'label': 'Occupation', 'properties': str({'title': occupation}), 'identifier': str({'title': occupation})}),
+    'Node_2': str({'label': 'Basic Skill', 'properties': str({'title': skill}), 'identifier': str({'title': skill})}),
+    'Relation': str({'label': 'strong_need_for_basic_skill', 'properties': str({'importance': importance})}),
+  }
+
+DATASET = pd.DataFrame([make_row('Technical_Writers', 'Writing'), make_row('Poets', 'Writing'), make_row('Poets', 'Reading')])
+
+## Records whether the manifests it creates are closed
+class RecordedManifest(DeltaManifest):
+  closed = []
+
+  def __init__(self):
+    super().__init__(":memory:")
+
+  def close(self):
+    RecordedManifest.closed.append(self)
+    super().close()
+
+##
+
+def test_identical_rows_are_counted_once():
+  added, _, _, num_edges, duplicates = compute_delta(pd.concat([DATASET, DATASET.iloc[:1]], ignore_index=True), {})
+  assert len(added) == 3 and num_edges == 3 and duplicates == 1
+
+def test_rows_of_the_same_relation_with_a_different_content_are_rejected():
+  dataset = pd.concat([DATASET, pd.DataFrame([make_row('Poets', 'Reading', importance=50)])], ignore_index=True)
+  with pytest.raises(ValueError):
+    compute_delta(dataset, {})
+
+def test_a_skipped_file_returns_its_number_of_edges(tmp_path):
+  path = tmp_path / "formatted_basic_skills.csv"
+  DATASET.to_csv(path, index=False)
+  manifest = DeltaManifest(tmp_path / "manifest.sqlite")
+  assert delta_populate_graph(FakeDriver(), path, manifest=manifest)['added'] == 3
+
+  driver = FakeDriver()
+  assert delta_populate_graph(driver, path, manifest=manifest) == {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 3, 'duplicates': 0}
+  assert driver.queries == []
+  manifest.close()
+
+def test_the_default_manifest_is_closed(monkeypatch):
+  monkeypatch.setattr(delta_ingestion, "DeltaManifest", RecordedManifest)
+  delta_populate_graph(FakeDriver(), DATASET, source="basic_skills")
+  with pytest.raises(ValueError):
+    delta_populate_graph(FakeDriver(), DATASET) # no source for a dataframe
+  assert len(RecordedManifest.closed) == 2
@@ -0,0 +1,95 @@
+"""
+Tests of the node cache of the loaders, with the recording fake driver (no database).
+
+Usage (from the CSV_to_Knowledge_Graph folder):
+  python -m pytest -q test_graph_functions.py
+"""
+
+import pandas as pd
+import pytest
+from fake_neo4j import FakeDriver
+from graph_functions import NodeCache, group_rows, populate_graph, bulk_populate_graph, compare_load_times
+
+##
+
+def make_row(occupation, skill):
+  return {
+    'Node_1': str({'label': 'Occupation', 'properties': str({'title': occupation}), 'identifier': str({'title': occupation})}),
+    'Node_2': str({'label': 'Basic Skill', 'properties': str({'title': skill}), 'identifier': str({'title': skill})}),
+    'Relation': str({'label': 'strong_need_for_basic_skill', 'properties': str({'importance': 90})}),
+  }
+
+DATASET = pd.DataFrame([make_row('Technical_Writers', 'Writing'), make_row('Poets', 'Writing'), make_row('Poets', 'Reading')])
+
+## Fails the node merges until fail is set to False
+class FailingResponder:
+
+  def __init__(self):
+    self.fail = True
+
+  def __call__(self, query, parameters):
+    if self.fail and "ON CREATE" in query: raise RuntimeError("write failed")
+    return []
+
+def merged_titles(driver):
+  """ Titles of the nodes sent in the node merge queries """
+  titles = []
+  for query, parameters in driver.queries:
+    if "ON CREATE" in query: titles += [row['identifier']['title'] for row in parameters['rows']]
+  return titles
+
+##
+
+def test_group_rows_returns_each_new_node_once_per_batch():
+  cache = NodeCache()
+  nodes, relations = group_rows(DATASET, node_cache=cache)
+  assert sorted(row['identifier']['title'] for rows in nodes.values() for row in rows) == ['Poets', 'Reading', 'Technical_Writers', 'Writing']
+  assert sum(len(rows) for rows in relations.values()) == 3
+  assert len(cache.keys) == 0 # nothing is committed yet
+
+def test_bulk_populate_graph_skips_nodes_committed_before():
+  cache = NodeCache()
+  driver = FakeDriver()
+  bulk_populate_graph(driver, DATASET, batch_size=2, node_cache=cache)
+  assert sorted(merged_titles(driver)) == ['Poets', 'Reading', 'Technical_Writers', 'Writing']
+
+  driver = FakeDriver()
+  bulk_populate_graph(driver, DATASET, batch_size=2, node_cache=cache)
+  assert merged_titles(driver) == []
+
+def test_bulk_populate_graph_retry_after_failed_batch_writes_the_nodes():
+  cache = NodeCache()
+  responder = FailingResponder()
+  with pytest.raises(RuntimeError):
+    bulk_populate_graph(FakeDriver(responder=responder), DATASET, node_cache=cache)
+  assert len(cache.keys) == 0
+
+  responder.fail = False
+  driver = FakeDriver(responder=responder)
+  bulk_populate_graph(driver, DATASET, node_cache=cache)
+  assert sorted(merged_titles(driver)) == ['Poets', 'Reading', 'Technical_Writers', 'Writing']
+
+def test_populate_graph_retry_after_failed_write_creates_the_nodes():
+  cache = NodeCache()
+  responder = FailingResponder()
+  with pytest.raises(RuntimeError):
+    populate_graph(FakeDriver(responder=responder), DATASET, node_cache=cache)
+  assert len(cache.keys) == 0
+
+  responder.fail = False
+  driver = FakeDriver(responder=responder)
+  populate_graph(driver, DATASET, node_cache=cache)
+  assert len([query for query, _ in driver.queries if "ON CREATE" in query]) == 4
+
+def test_node_cache_is_bounded():
+  cache = NodeCache(max_size=2)
+  for title in ['a', 'b', 'c']: cache.add('Occupation', {'title': title})
+  assert not cache.seen('Occupation', {'title': 'a'})
+  assert cache.seen('Occupation', {'title': 'c'})
+
+def test_compare_load_times_merges_the_nodes_in_both_runs():
+  cache = NodeCache()
+  bulk_populate_graph(FakeDriver(), DATASET, node_cache=cache) # already filled before the comparison
+  driver = FakeDriver()
+  compare_load_times(driver, DATASET, node_cache=cache)
+  assert sorted(merged_titles(driver)) == sorted(['Poets', 'Reading', 'Technical_Writers', 'Writing'] * 2)
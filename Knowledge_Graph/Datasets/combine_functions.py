@@ -0,0 +1,152 @@
+"""
+Combines the raw O*NET CSVs (one file per ability, skill or knowledge) into one CSV per category type (Abilities.csv, Knowledge.csv ...).
+
+Two folder layouts are handled:
+  multi folder:      Cognitive Abilities/<category>/<ability>.csv   -> the category is the sub folder's name
+  non multi folder:  Basic Skills/<skill>.csv                      -> the category is given
+
+Files are read in parallel and concatenated once. With max_memory_mb, the output is written incrementally
+instead of building the whole dataframe in memory.
+
+Usage:
+  python combine_functions.py "O*NET/Abilities" "ONet/Combined CSVs/Abilities.csv" --category-type Ability
+  python combine_functions.py "O*NET/Basic Skills" "ONet/Combined CSVs/Basic_Skills.csv" --category-type Skill --category-name "Basic Skill"
+  python combine_functions.py "O*NET/Knowledge" "ONet/Combined CSVs/Knowledge.csv" --category-type Knowledge --max-memory-mb 64
+"""
+
+import re
+import argparse
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+##
+
+def replace_non_letters_with_space(text):
+  text = re.sub(r"[^a-zA-Z]", " ", text)
+  return text
+
+##
+
+def list_csvs(path_to_general_folder, category_name=None):
+  """
+  Returns [(path to csv, item name, category)] in the order the rows should appear in the combined CSV.
+
+  If category_name is None, every sub folder of path_to_general_folder is a category (multi folder layout).
+  NOTE: the notebook prepended every file to the combined dataframe, so the last file read comes first. The same order is kept here.
+  """
+  general_folder = Path(path_to_general_folder)
+  if category_name is None:
+    folders = [(folder, folder.name) for folder in sorted(general_folder.iterdir()) if folder.is_dir()]
+  else:
+    folders = [(general_folder, category_name)]
+
+  csvs = []
+  for folder, category in folders:
+    for path in sorted(folder.glob("*.csv")):
+      csvs.append((path, replace_non_letters_with_space(path.stem), category))
+
+  return csvs[::-1]
+
+##
+
+def read_csv(path, item, category, category_type):
+  """ Read one raw CSV and add the item (example: Ability) and Category columns """
+  df = pd.read_csv(path)
+  df[category_type] = item
+  df["Category"] = category
+  return df
+
+##
+
+def print_summary(df, category_type):
+  print(f"main_df contains:")
+  print(f"{df['Occupation'].nunique()} unique occupations")
+  print(f"{df['Category'].nunique()} unique categories")
+  print(f"{df[category_type].nunique()} unique {category_type}s")
+
+##
+
+def create_combined_csv(path_to_general_folder, category_type, category_name=None, max_workers=8):
+  """
+  Read every CSV of a general folder in parallel with a thread pool and concatenate them once.
+
+  category_type: name of the column that holds the file's name (example: Ability, Skill, Knowledge)
+  category_name: set it for a non multi folder layout, every row gets this category
+  """
+  csvs = list_csvs(path_to_general_folder, category_name=category_name)
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    dfs = list(executor.map(lambda csv: read_csv(*csv, category_type=category_type), csvs))
+
+  main_df = pd.concat(dfs, ignore_index=True)
+  print_summary(main_df, category_type)
+
+  return main_df
+
+##
+
+def write_combined_csv(path_to_general_folder, output_path, category_type, category_name=None, max_workers=8, max_memory_mb=None):
+  """
+  Combine a general folder and write it to output_path.
+
+  max_memory_mb: if None, everything is combined in memory then written. Otherwise the files are read in groups whose
+  size on disk stays under max_memory_mb, and every group is appended to output_path as soon as it is read.
+  """
+  if max_memory_mb is None:
+    create_combined_csv(path_to_general_folder, category_type, category_name=category_name, max_workers=max_workers).to_csv(output_path, index=False)
+    return
+
+  csvs = list_csvs(path_to_general_folder, category_name=category_name)
+
+  # Read the headers first so that every group is written with the same columns
+  columns = []
+  for path, _, _ in csvs:
+    columns += [column for column in pd.read_csv(path, nrows=0).columns if column not in columns]
+  columns += [category_type, "Category"]
+
+  groups, group, group_size = [], [], 0
+  for csv in csvs:
+    size = csv[0].stat().st_size
+    if len(group) > 0 and group_size + size > max_memory_mb * 1024 * 1024:
+      groups.append(group)
+      group, group_size = [], 0
+    group.append(csv)
+    group_size += size
+  if len(group) > 0: groups.append(group)
+
+  num_rows = 0
+  with ThreadPoolExecutor(max_workers=max_workers) as executor, open(output_path, "w", newline="", encoding="utf-8") as f:
+    for i, group in enumerate(groups):
+      dfs = list(executor.map(lambda csv: read_csv(*csv, category_type=category_type), group))
+      df = pd.concat(dfs, ignore_index=True).reindex(columns=columns)
+      df.to_csv(f, index=False, header=(i == 0))
+      num_rows += len(df)
+
+  print(f"----- Wrote {num_rows} rows from {len(csvs)} files in {len(groups)} groups to {output_path}")
+
+##
+
+## Names used in combine_csvs.ipynb
+
+def create_combined_csv_from_a_multi_folder_folder(path_to_general_folder, category_type):
+  """ Handles a folder like Cognitive Abilities/<category>/file.csv """
+  return create_combined_csv(path_to_general_folder, category_type)
+
+def create_combined_csv_from_a_non_multi_folder_folder(path_to_general_folder, category_name, category_type):
+  """ Handles a folder like Abilities/file.csv """
+  return create_combined_csv(path_to_general_folder, category_type, category_name=category_name)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Combine the raw O*NET CSVs of a folder into one CSV")
+  parser.add_argument("general_folder")
+  parser.add_argument("output_path")
+  parser.add_argument("--category-type", required=True, help="column holding the file's name. example: Ability")
+  parser.add_argument("--category-name", default=None, help="category of every file, for folders without category sub folders")
+  parser.add_argument("--workers", type=int, default=8)
+  parser.add_argument("--max-memory-mb", type=float, default=None, help="write the output incrementally, reading at most this much data at once")
+  args = parser.parse_args()
+
+  write_combined_csv(args.general_folder, args.output_path, args.category_type, category_name=args.category_name,
+                     max_workers=args.workers, max_memory_mb=args.max_memory_mb)